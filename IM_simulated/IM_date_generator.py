@@ -2,13 +2,82 @@ import math
 import random
 import json
 import os
+import argparse
+import base64
+import io
+import tempfile
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 
-def draw_rotated_text(base_img, pos, text, font, angle, fill, pad=10):
+import domain_randomization
+
+# Base URL template (adjust if necessary)
+BASE_URL = "https://github.com/osamamoller/finetuning-garanti/blob/main"
+
+# Task prompt text (as specified)
+TASK_PROMPT = (
+    "Task: Date Code Analysis\n\n"
+    "You are provided with an image of an injection mold stamp that includes a circular date code used on car parts. "
+    "Your objective is to extract the production date, formatted as MM/YYYY. Follow these steps precisely:\n\n"
+    "1. **Edge Numbers Sequence:**\n"
+    "   - Identify and list all numbers arranged around the edge of the circle in clockwise order.\n"
+    "   - Verify that these numbers form the standard sequence from 1 through 12.\n\n"
+    "2. **Target Number Identification:**\n"
+    "   - Determine the exact number that the arrow points to; this represents the target month.\n"
+    "   - Confirm that the number immediately preceding the target is the previous month and the number immediately following is the next month (e.g., if the target is 6, then 5 should precede it and 7 should follow).\n\n"
+    "3. **Arrow Orientation and Year Digits:**\n"
+    "   - Note the direction in which the arrow points (e.g., left, right, up, down).\n"
+    "   - Based on the arrow's direction, read the digit from the side corresponding to the arrow as the decade digit, and the digit from the opposite side as the year digit.\n"
+    "     - *Example:* If the arrow points left, use the top digit as the decade and the bottom digit as the year unit.\n"
+    "     - Adjust appropriately for other orientations.\n\n"
+    "4. **Full Year Calculation:**\n"
+    "   - Combine the decade digit and the year digit to form the complete year (e.g., decade digit '2' and year digit '1' yield 2021).\n\n"
+    "5. **Validation:**\n"
+    "   - Redo all the above steps independently to ensure consistency in your result.\n\n"
+    "**Final Output Requirements:**\n"
+    "- The response must include only the final answer in both formats:\n"
+    "   - Textual: \"Month YYYY\" (e.g., February 2021)\n"
+    "   - Numeric: \"MM/YYYY\" (e.g., 02/2021)\n\n"
+    "Do not include any additional explanations, validations, or step-by-step reasoning in your output.\n\n"
+    "**Example Input:**\n"
+    "[Image provided below]\n\n"
+    "**Example Final Answer:**\n"
+    "02/2021"
+)
+
+# Samples handed to a worker process at a time
+CHUNK_SIZE = 32
+
+# Chunks submitted ahead of the writer per worker; bounds the rendered samples held in memory
+CHUNKS_AHEAD_PER_WORKER = 2
+
+# Supersampling factor of the renderer
+SCALE = 4
+
+@lru_cache(maxsize=None)
+def load_font(size):
     """
-    Draws rotated text onto base_img at a given angle, centered at pos.
+    arial.ttf at `size` pixels, loaded once per process. Without Arial, Pillow's default font
+    at the same size: the unsized bitmap default draws the month numbers as specks.
     """
-    dummy_draw = ImageDraw.Draw(base_img)
+    try:
+        return ImageFont.truetype("arial.ttf", size)
+    except OSError:
+        pass
+    try:
+        return ImageFont.load_default(size)
+    except (TypeError, ImportError):
+        # Pillow < 10.1, or built without FreeType
+        return ImageFont.load_default()
+
+def render_rotated_text(text, font, angle, fill, pad=10):
+    """
+    Text on a transparent RGBA image, rotated by angle.
+    """
+    dummy_draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
     bbox = dummy_draw.textbbox((0, 0), text, font=font)
     w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
     
@@ -16,57 +85,47 @@ def draw_rotated_text(base_img, pos, text, font, angle, fill, pad=10):
     txt_draw = ImageDraw.Draw(txt_img)
     txt_draw.text((pad//2, pad//2), text, font=font, fill=fill)
     
-    rotated = txt_img.rotate(angle, expand=True)
+    return txt_img.rotate(angle, expand=True)
+
+@lru_cache(maxsize=4096)
+def cached_rotated_text(text, font_size, angle, fill, pad=10):
+    """
+    render_rotated_text with load_font(font_size) and the box of its non-transparent pixels,
+    memoized: month numbers and year digits only ever appear at a few dozen angles
+    """
+    rotated = render_rotated_text(text, load_font(font_size), angle, fill, pad)
+    return rotated, rotated.getchannel("A").getbbox()
+
+def paste_rotated_text(base_img, pos, rotated, opaque_box=None):
+    """
+    Pastes a rotated text image centered at pos; returns the box of the pixels it changed
+    (its non-transparent part).
+    """
     rw, rh = rotated.size
     paste_pos = (int(pos[0] - rw/2), int(pos[1] - rh/2))
     base_img.paste(rotated, paste_pos, rotated)
+    x0, y0, x1, y1 = opaque_box or rotated.getchannel("A").getbbox() or (0, 0, 0, 0)
+    return paste_pos[0] + x0, paste_pos[1] + y0, paste_pos[0] + x1, paste_pos[1] + y1
 
-def draw_injection_mold_date(year, month, 
-                             img_size=300, 
-                             circle_radius=55,
-                             circle_center=None,
-                             arrow_color=(0, 0, 0),
-                             text_color=(0, 0, 0),
-                             bg_color=(255, 255, 255),
-                             font_size=20,
-                             line_offset=12,
-                             digit_offset=20,
-                             arrow_width=10,
-                             arrow_margin=5,
-                             arrow_head_length=15,
-                             save_path=None):
+def draw_rotated_text(base_img, pos, text, font, angle, fill, pad=10):
     """
-    Draws an injection mold date indicator with a truly hollow (outlined) arrow.
+    Draws rotated text onto base_img at a given angle, centered at pos.
     """
-    # 1) Scale up to reduce graininess
-    scale = 4
-    img_size_scaled = img_size * scale
-    
-    # 2) Prepare fonts
-    try:
-        font = ImageFont.truetype("arial.ttf", font_size * scale)
-    except OSError:
-        font = ImageFont.load_default()
+    return paste_rotated_text(base_img, pos, render_rotated_text(text, font, angle, fill, pad))
 
-    try:
-        year_font = ImageFont.truetype("arial.ttf", int(font_size * 1.5 * scale))
-    except OSError:
-        year_font = ImageFont.load_default()
-    
-    # 3) Create high-res blank image
-    img = Image.new("RGB", (img_size_scaled, img_size_scaled), bg_color)
-    draw = ImageDraw.Draw(img)
-    
-    # 4) Determine center
-    if circle_center is None:
-        center_x = img_size_scaled // 2
-        center_y = img_size_scaled // 2
-    else:
-        center_x, center_y = circle_center[0] * scale, circle_center[1] * scale
+def _text(base_img, pos, text, font_size, angle, fill, pad, use_cache):
+    if use_cache:
+        return paste_rotated_text(base_img, pos, *cached_rotated_text(text, font_size, angle, fill, pad))
+    return draw_rotated_text(base_img, pos, text, load_font(font_size), angle, fill, pad)
+
+def _draw_dial(img, center_x, center_y, circle_radius_scaled, line_offset_scaled, text_color, font_size, use_cache):
+    """
+    Steps 5 and 6: the static part of the stamp (circles and month ring)
+    """
+    scale = SCALE
     
     # 5) Draw outer and inner circles
-    circle_radius_scaled = circle_radius * scale
-    line_offset_scaled = line_offset * scale
+    draw = ImageDraw.Draw(img)
     outer_radius = circle_radius_scaled + line_offset_scaled
     inner_radius = circle_radius_scaled - line_offset_scaled
     
@@ -97,7 +156,227 @@ def draw_injection_mold_date(year, month,
         inward_angle_deg = math.degrees(math.atan2(dy, dx))
         month_rotation = -inward_angle_deg - 270
         
-        draw_rotated_text(img, (x, y), str(m), font, month_rotation, text_color, pad=10*scale)
+        _text(img, (x, y), str(m), font_size * scale, month_rotation, text_color, 10*scale, use_cache)
+
+@lru_cache(maxsize=32)
+def dial_template(img_size, center_x, center_y, circle_radius, line_offset, text_color, bg_color, font_size):
+    """
+    High-res image with only the circles and month ring, per geometry. Copies of it get the
+    arrow and year digits drawn on top.
+    """
+    img = Image.new("RGB", (img_size * SCALE, img_size * SCALE), bg_color)
+    _draw_dial(img, center_x, center_y, circle_radius * SCALE, line_offset * SCALE, text_color, font_size, use_cache=True)
+    return img
+
+def rotation_matrix(w, h, angle):
+    """
+    The affine matrix and output size Image.rotate(angle, expand=True) uses for a w x h image
+    """
+    center = (w / 2, h / 2)
+    angle = -math.radians(angle)
+    matrix = [
+        round(math.cos(angle), 15),
+        round(math.sin(angle), 15),
+        0.0,
+        round(-math.sin(angle), 15),
+        round(math.cos(angle), 15),
+        0.0,
+    ]
+    
+    def transform(x, y, matrix):
+        a, b, c, d, e, f = matrix
+        return a * x + b * y + c, d * x + e * y + f
+    
+    matrix[2], matrix[5] = transform(-center[0], -center[1], matrix)
+    matrix[2] += center[0]
+    matrix[5] += center[1]
+    
+    xx = []
+    yy = []
+    for x, y in ((0, 0), (w, 0), (w, h), (0, h)):
+        transformed_x, transformed_y = transform(x, y, matrix)
+        xx.append(transformed_x)
+        yy.append(transformed_y)
+    nw = math.ceil(max(xx)) - math.floor(min(xx))
+    nh = math.ceil(max(yy)) - math.floor(min(yy))
+    matrix[2], matrix[5] = transform(-(nw - w) / 2.0, -(nh - h) / 2.0, matrix)
+    return matrix, nw, nh
+
+def rotate_and_downscale(img, angle, img_size, bg_color):
+    """
+    Steps 10.5 and 11: rotate the high-res image, center-crop it and downscale to img_size
+    """
+    img_size_scaled = img_size * SCALE
+    if angle % 360 == 0 and img.size == (img_size_scaled, img_size_scaled):
+        # Image.rotate returns a plain copy here and the crop is the whole image
+        return img.resize((img_size, img_size), resample=Image.BICUBIC)
+    rotated = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=bg_color)
+    # Center-crop to the original high-res dimensions
+    rotated_w, rotated_h = rotated.size
+    left = (rotated_w - img_size_scaled) // 2
+    top = (rotated_h - img_size_scaled) // 2
+    img = rotated.crop((left, top, left + img_size_scaled, top + img_size_scaled))
+    
+    # 11) Downscale to final size
+    return img.resize((img_size, img_size), resample=Image.BICUBIC)
+
+# (template key, angle) pairs rendered once already; the finished template is only built
+# when a pair comes up again, so short runs do not pay for templates they never reuse.
+# Only the most recent pairs are remembered, a few times as many as finished_template keeps.
+SEEN_ANGLES_MAX = 2048
+_seen_angles = OrderedDict()
+
+def _seen_before(key):
+    """
+    True when key was rendered before (among the last SEEN_ANGLES_MAX keys); remembers it
+    """
+    if key in _seen_angles:
+        _seen_angles.move_to_end(key)
+        return True
+    _seen_angles[key] = None
+    if len(_seen_angles) > SEEN_ANGLES_MAX:
+        _seen_angles.popitem(last=False)
+    return False
+
+@lru_cache(maxsize=512)
+def finished_template(template_key, angle):
+    """
+    rotate_and_downscale of the bare dial template, per geometry and angle
+    """
+    img_size, bg_color = template_key[0], template_key[6]
+    return rotate_and_downscale(dial_template(*template_key), angle, img_size, bg_color)
+
+def segment_boxes(p, q, margin, length=16 * SCALE):
+    """
+    Boxes covering a stroke from p to q (widened by margin), one per piece of at most `length`
+    pixels, so a long diagonal stroke is not covered by one large box
+    """
+    pieces = max(1, math.ceil(math.dist(p, q) / length))
+    boxes = []
+    for k in range(pieces):
+        ax, ay = p[0] + (q[0] - p[0]) * k / pieces, p[1] + (q[1] - p[1]) * k / pieces
+        bx, by = p[0] + (q[0] - p[0]) * (k + 1) / pieces, p[1] + (q[1] - p[1]) * (k + 1) / pieces
+        boxes.append((min(ax, bx) - margin, min(ay, by) - margin, max(ax, bx) + margin, max(ay, by) + margin))
+    return boxes
+
+def rotate_and_downscale_window(img, angle, img_size, bg_color, changed_boxes, base, tile=8):
+    """
+    rotate_and_downscale(img, ...) for an img that differs from the one `base` was made from
+    only inside changed_boxes: just the output pixels that can see a changed box are
+    recomputed (with the same sampling positions as the full rotate and resize) and pasted
+    onto a copy of base. Pixel-identical to the full computation.
+    
+    Output pixels are marked per tile x tile block and recomputed as one window per run of
+    marked blocks in a block row.
+    """
+    size = img_size * SCALE
+    matrix, rotated_w, rotated_h = rotation_matrix(size, size, angle)
+    left = (rotated_w - size) // 2
+    top = (rotated_h - size) // 2
+    a, b, c, d, e, f = matrix
+    
+    # An output pixel sees high-res pixels within 2 * SCALE - 2 / 2 * SCALE + 2 of 4 * ox
+    # (bicubic downscale support); a rotated pixel sees changed pixels within 2 (+ rounding)
+    mark_margin = 2 * SCALE + 6
+    source_margin = 2 * SCALE
+    blocks = (img_size + tile - 1) // tile
+    marked = [[False] * blocks for _ in range(blocks)]
+    for x0, y0, x1, y1 in changed_boxes:
+        # Box corners in the cropped, rotated image (inverse of the orthonormal rotation)
+        xs, ys = [], []
+        for x, y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1)):
+            dx, dy = x - c, y - f
+            xs.append(a * dx + d * dy - left)
+            ys.append(b * dx + e * dy - top)
+        ox0 = max(0, (math.floor(min(xs)) - mark_margin) // SCALE)
+        oy0 = max(0, (math.floor(min(ys)) - mark_margin) // SCALE)
+        ox1 = min(img_size, (math.ceil(max(xs)) + mark_margin) // SCALE + 1)
+        oy1 = min(img_size, (math.ceil(max(ys)) + mark_margin) // SCALE + 1)
+        for row in range(oy0 // tile, (oy1 - 1) // tile + 1):
+            for column in range(ox0 // tile, (ox1 - 1) // tile + 1):
+                if 0 <= row < blocks and 0 <= column < blocks:
+                    marked[row][column] = True
+    
+    final_img = base.copy()
+    for row in range(blocks):
+        column = 0
+        while column < blocks:
+            if not marked[row][column]:
+                column += 1
+                continue
+            start = column
+            while column < blocks and marked[row][column]:
+                column += 1
+            ox0, oy0 = start * tile, row * tile
+            ox1, oy1 = min(img_size, column * tile), min(img_size, (row + 1) * tile)
+            
+            # High-res window covering the downscale support of those output pixels
+            sx0, sy0 = max(0, ox0 * SCALE - source_margin), max(0, oy0 * SCALE - source_margin)
+            sx1, sy1 = min(size, ox1 * SCALE + source_margin), min(size, oy1 * SCALE + source_margin)
+            X0, Y0 = sx0 + left, sy0 + top
+            window_matrix = [a, b, a * X0 + b * Y0 + c, d, e, d * X0 + e * Y0 + f]
+            window = img.transform((sx1 - sx0, sy1 - sy0), Image.Transform.AFFINE, window_matrix, Image.BICUBIC, fillcolor=bg_color)
+            patch = window.resize(
+                (ox1 - ox0, oy1 - oy0), resample=Image.BICUBIC,
+                box=(ox0 * SCALE - sx0, oy0 * SCALE - sy0, ox1 * SCALE - sx0, oy1 * SCALE - sy0),
+            )
+            final_img.paste(patch, (ox0, oy0))
+    return final_img
+
+def draw_injection_mold_date(year, month, 
+                             img_size=300, 
+                             circle_radius=55,
+                             circle_center=None,
+                             arrow_color=(0, 0, 0),
+                             text_color=(0, 0, 0),
+                             bg_color=(255, 255, 255),
+                             font_size=20,
+                             line_offset=12,
+                             digit_offset=20,
+                             arrow_width=10,
+                             arrow_margin=5,
+                             arrow_head_length=15,
+                             save_path=None,
+                             rng=None,
+                             use_cache=True,
+                             angle=None):
+    """
+    Draws an injection mold date indicator with a truly hollow (outlined) arrow.
+    The image is rotated by `angle` degrees; by default a random rotation is drawn from `rng`
+    (a random.Random), or the global generator.
+    
+    With use_cache (the default) fonts, rotated glyphs, the dial template and the rotated,
+    downscaled template are cached per geometry, and only the region around the arrow and
+    year digits is rotated and downscaled per sample. The output is pixel-identical to
+    use_cache=False, which renders everything from scratch.
+    """
+    # 1) Scale up to reduce graininess
+    scale = SCALE
+    img_size_scaled = img_size * scale
+    
+    # 2) Prepare fonts
+    year_font_size = int(font_size * 1.5 * scale)
+    
+    # 4) Determine center
+    if circle_center is None:
+        center_x = img_size_scaled // 2
+        center_y = img_size_scaled // 2
+    else:
+        center_x, center_y = circle_center[0] * scale, circle_center[1] * scale
+    
+    circle_radius_scaled = circle_radius * scale
+    line_offset_scaled = line_offset * scale
+    inner_radius = circle_radius_scaled - line_offset_scaled
+    
+    # 3) Create high-res image with the circles (5) and month numbers (6)
+    text_color, bg_color, arrow_color = tuple(text_color), tuple(bg_color), tuple(arrow_color)
+    template_key = (img_size, center_x, center_y, circle_radius, line_offset, text_color, bg_color, font_size)
+    if use_cache:
+        img = dial_template(*template_key).copy()
+    else:
+        img = Image.new("RGB", (img_size_scaled, img_size_scaled), bg_color)
+        _draw_dial(img, center_x, center_y, circle_radius_scaled, line_offset_scaled, text_color, font_size, use_cache=False)
+    draw = ImageDraw.Draw(img)
     
     # 7) Arrow direction
     arrow_angle_deg = 90 - (month - 1) * 30
@@ -169,122 +448,303 @@ def draw_injection_mold_date(year, month,
     year_str = f"{year % 100:02d}"
     left_digit, right_digit = year_str[0], year_str[1]
     
-    draw_rotated_text(img, (left_digit_x, left_digit_y), left_digit, year_font, arrow_angle_deg - 90, text_color, pad=10*scale)
-    draw_rotated_text(img, (right_digit_x, right_digit_y), right_digit, year_font, arrow_angle_deg - 90, text_color, pad=10*scale)
-    
-    # 10.5) Rotate entire high-res image by a random angle between 0 and 360 degrees.
-    random_angle = random.randint(0, 360)
-    rotated = img.rotate(random_angle, resample=Image.BICUBIC, expand=True, fillcolor=bg_color)
-    # Center-crop to the original high-res dimensions
-    rotated_w, rotated_h = rotated.size
-    left = (rotated_w - img_size_scaled) // 2
-    top = (rotated_h - img_size_scaled) // 2
-    img = rotated.crop((left, top, left + img_size_scaled, top + img_size_scaled))
+    left_box = _text(img, (left_digit_x, left_digit_y), left_digit, year_font_size, arrow_angle_deg - 90, text_color, 10*scale, use_cache)
+    right_box = _text(img, (right_digit_x, right_digit_y), right_digit, year_font_size, arrow_angle_deg - 90, text_color, 10*scale, use_cache)
+    
+    # 10.5) Rotate entire high-res image by a random angle between 0 and 360 degrees,
+    # center-crop and (11) downscale to final size
+    random_angle = (rng or random).randint(0, 360) if angle is None else angle
+    reuse = use_cache and random_angle % 90 and _seen_before((template_key, random_angle))
+    if reuse:
+        # Everything drawn on top of the template lies along the arrow outline or in the digit boxes
+        outline = arrow_width_scaled / 4 + 2
+        changed_boxes = [left_box, right_box]
+        for polygon in (arrow_body_polygon, arrow_head_polygon):
+            for p, q in zip(polygon, polygon[1:] + polygon[:1]):
+                changed_boxes.extend(segment_boxes(p, q, outline))
+        base = finished_template(template_key, random_angle)
+        final_img = rotate_and_downscale_window(img, random_angle, img_size, bg_color, changed_boxes, base)
+    else:
+        final_img = rotate_and_downscale(img, random_angle, img_size, bg_color)
     
-    # 11) Downscale to final size
-    final_img = img.resize((img_size, img_size), resample=Image.BICUBIC)
     if save_path:
         final_img.save(save_path)
     
     return final_img
 
-def create_and_write_jsonl(dataset, jsonl_path):
+def make_dataset_entry(image_url, year, month, task_prompt=TASK_PROMPT):
     """
-    Shuffles the dataset (a list of JSON objects) and writes them to a JSONL file.
+    Chat-format training entry for one generated image
     """
-    random.shuffle(dataset)
-    with open(jsonl_path, "w") as f:
-        for entry in dataset:
-            f.write(json.dumps(entry) + "\n")
-
-if __name__ == "__main__":
-    # Define the image folder and JSONL dataset file path
-    image_folder = "IM_data_generation/images"
-    jsonl_path = "IM_data_generation/dataset.jsonl"
-    
-    os.makedirs(image_folder, exist_ok=True)
-    
-    # Base URL template (adjust if necessary)
-    base_url = "https://github.com/osamamoller/finetuning-garanti/blob/main"
-    
-    # Task prompt text (as specified)
-    task_prompt = (
-        "Task: Date Code Analysis\n\n"
-        "You are provided with an image of an injection mold stamp that includes a circular date code used on car parts. "
-        "Your objective is to extract the production date, formatted as MM/YYYY. Follow these steps precisely:\n\n"
-        "1. **Edge Numbers Sequence:**\n"
-        "   - Identify and list all numbers arranged around the edge of the circle in clockwise order.\n"
-        "   - Verify that these numbers form the standard sequence from 1 through 12.\n\n"
-        "2. **Target Number Identification:**\n"
-        "   - Determine the exact number that the arrow points to; this represents the target month.\n"
-        "   - Confirm that the number immediately preceding the target is the previous month and the number immediately following is the next month (e.g., if the target is 6, then 5 should precede it and 7 should follow).\n\n"
-        "3. **Arrow Orientation and Year Digits:**\n"
-        "   - Note the direction in which the arrow points (e.g., left, right, up, down).\n"
-        "   - Based on the arrow's direction, read the digit from the side corresponding to the arrow as the decade digit, and the digit from the opposite side as the year digit.\n"
-        "     - *Example:* If the arrow points left, use the top digit as the decade and the bottom digit as the year unit.\n"
-        "     - Adjust appropriately for other orientations.\n\n"
-        "4. **Full Year Calculation:**\n"
-        "   - Combine the decade digit and the year digit to form the complete year (e.g., decade digit '2' and year digit '1' yield 2021).\n\n"
-        "5. **Validation:**\n"
-        "   - Redo all the above steps independently to ensure consistency in your result.\n\n"
-        "**Final Output Requirements:**\n"
-        "- The response must include only the final answer in both formats:\n"
-        "   - Textual: \"Month YYYY\" (e.g., February 2021)\n"
-        "   - Numeric: \"MM/YYYY\" (e.g., 02/2021)\n\n"
-        "Do not include any additional explanations, validations, or step-by-step reasoning in your output.\n\n"
-        "**Example Input:**\n"
-        "[Image provided below]\n\n"
-        "**Example Final Answer:**\n"
-        "02/2021"
-    )
-    
-    dataset_entries = []
-    
-    # Generate images for years 2020-2024 and months 1-12
-    for year in range(2020, 2025):
-        for month in range(1, 13):
-            # Generate a random suffix for the file name
-            suffix = random.randint(100000, 999999)
-            image_file_name = f"injection_mold_date_{suffix}.png"
-            save_path = os.path.join(image_folder, image_file_name)
-            
-            # Generate and save the image
-            img = draw_injection_mold_date(year=year, month=month, save_path=save_path)
-            
-            # Construct the image URL based on the GitHub repository structure
-            image_url = f"{base_url}/{image_folder}/{image_file_name}?raw=true"
-            
-            # Final answer in MM/YYYY format
-            final_answer = f"{month:02d}/{year}"
-            
-            # Create the JSON object following the provided structure
-            json_obj = {
-                "messages": [
+    # Final answer in MM/YYYY format
+    final_answer = f"{month:02d}/{year}"
+    
+    # Create the JSON object following the provided structure
+    return {
+        "messages": [
+            {
+                "role": "user",
+                "content": [
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": task_prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_url
-                                }
-                            }
-                        ]
+                        "type": "text",
+                        "text": task_prompt
                     },
                     {
-                        "role": "assistant",
-                        "content": final_answer
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url
+                        }
                     }
                 ]
+            },
+            {
+                "role": "assistant",
+                "content": final_answer
             }
-            dataset_entries.append(json_obj)
-    
-    # Shuffle and write the dataset entries to the JSONL file
-    create_and_write_jsonl(dataset_entries, jsonl_path)
+        ]
+    }
+
+def sample_label(index, years):
+    """
+    (year, month) of sample `index`: cycles through every month of every year, so any
+    run of len(years) * 12 consecutive samples is balanced
+    """
+    return years[(index // 12) % len(years)], index % 12 + 1
+
+def sample_rng(seed, index):
+    """
+    Independent RNG for one sample, so output does not depend on the worker or chunk it ran in
+    """
+    return random.Random(f"{seed}:{index}")
+
+def sample_file_name(seed, index, prefix="injection_mold_date"):
+    return f"{prefix}_{seed}_{index:07d}.png"
+
+def draw_randomized_date(year, month, rng, distributions=None, img_size=300, save_path=None):
+    """
+    Domain-randomized sample: stamp geometry, pose, plastic surface, relief, clutter and camera
+    effects are drawn from `distributions` (see domain_randomization.DEFAULT_DISTRIBUTIONS)
+    with `rng`. The stamp is drawn unrotated as a mask; rotation and perspective are applied
+    at the output size together with the other effects.
+    """
+    params = domain_randomization.sample_parameters(rng, distributions)
+    stamp = draw_injection_mold_date(year, month, img_size=img_size, angle=0, **domain_randomization.stamp_geometry(params))
+    stroke_mask = stamp.convert("L").point(lambda value: 255 - value)
+    img = domain_randomization.render_plastic(stroke_mask, params, rng)
+    if save_path:
+        img.save(save_path)
+    return img
+
+def load_distributions(config_path):
+    """
+    Parameter distributions for the randomized generator from a JSON file, e.g.
+        {"circle_radius": [50, 60], "blur": [0.5, 2.0], "relief": "sunken"}
+    Keys not in the file keep their defaults.
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        distributions = json.load(f)
+    unknown = sorted(set(distributions) - set(domain_randomization.DEFAULT_DISTRIBUTIONS))
+    if unknown:
+        raise ValueError(f"Unknown randomization parameters: {', '.join(unknown)}")
+    return distributions
+
+def image_data_url(img, image_format="PNG", quality=90):
+    """
+    Encode an image in memory as a base64 data URL (JPEG at `quality`)
+    """
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        img.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    else:
+        img.save(buffer, format=image_format)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return f"data:{Image.MIME[image_format]};base64,{encoded}"
+
+def _render_chunk(indices, seed, years, image_folder, render_kwargs, randomization=None, inline_format=None, quality=90):
+    """
+    Worker: render the samples of one chunk and save them to image_folder, or with
+    inline_format encode them as data URLs; returns [(index, file_name, year, month, data_url)]
+    (data_url is None for saved images)
+    """
+    rendered = []
+    for index in indices:
+        year, month = sample_label(index, years)
+        file_name = sample_file_name(seed, index)
+        save_path = os.path.join(image_folder, file_name) if image_folder and not inline_format else None
+        if randomization is not None:
+            img = draw_randomized_date(year, month, sample_rng(seed, index), randomization, save_path=save_path, **render_kwargs)
+        else:
+            img = draw_injection_mold_date(year=year, month=month, save_path=save_path, rng=sample_rng(seed, index), **render_kwargs)
+        data_url = image_data_url(img, inline_format, quality) if inline_format else None
+        rendered.append((index, file_name, year, month, data_url))
+    return rendered
+
+def iter_rendered(count, seed, image_folder, years=range(2020, 2025), workers=None, shuffle=True, chunk_size=CHUNK_SIZE,
+                  randomization=None, inline_format=None, quality=90, **render_kwargs):
+    """
+    Render `count` samples on a process pool and yield (index, file_name, year, month, data_url)
+    in output order. With shuffle the output order is a seeded permutation of the sample
+    indices; only the indices are shuffled, and only a few chunks per worker are in flight,
+    so memory use does not grow with count even when the images are kept inline.
+    With `randomization` (a dict of parameter distributions, {} for the defaults) the samples
+    are domain-randomized with draw_randomized_date. With inline_format ("PNG" or "JPEG")
+    nothing is written to disk and each sample carries its image as a data URL.
+    """
+    years = list(years)
+    order = list(range(count))
+    if shuffle:
+        random.Random(seed).shuffle(order)
+    chunks = [order[start:start + chunk_size] for start in range(0, count, chunk_size)]
+    
+    chunk_args = (seed, years, image_folder, render_kwargs, randomization, inline_format, quality)
+    
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in chunks:
+            yield from _render_chunk(chunk, *chunk_args)
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_render_chunk, chunk, *chunk_args))
+            if len(pending) >= workers * CHUNKS_AHEAD_PER_WORKER:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+class ShardedJsonlWriter:
+    """
+    Writes JSONL lines to jsonl_path, or with max_bytes to <name>-00000.jsonl, <name>-00001.jsonl, ...
+    starting a new shard before a line would push the current one past max_bytes (a single
+    larger line gets a shard of its own)
+    """
+    def __init__(self, jsonl_path, max_bytes=None):
+        self.jsonl_path = jsonl_path
+        self.max_bytes = max_bytes
+        self.paths = []
+        self._file = None
+        self._size = 0
+    
+    def _open_next(self):
+        if self._file:
+            self._file.close()
+        if self.max_bytes:
+            base, ext = os.path.splitext(self.jsonl_path)
+            path = f"{base}-{len(self.paths):05d}{ext}"
+        else:
+            path = self.jsonl_path
+        self._file = open(path, "wb")
+        self._size = 0
+        self.paths.append(path)
+    
+    def write(self, entry):
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        if self._file is None or (self.max_bytes and self._size and self._size + len(line) > self.max_bytes):
+            self._open_next()
+        self._file.write(line)
+        self._size += len(line)
+    
+    def close(self):
+        if self._file is None:
+            self._open_next()  # An empty dataset still gets its (empty) file
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def generate_dataset(count, image_folder, jsonl_path, seed=None, base_url=BASE_URL, years=range(2020, 2025), workers=None, shuffle=True,
+                     randomization=None, inline_format=None, quality=90, shard_bytes=None, **render_kwargs):
+    """
+    Generate `count` images into image_folder and stream their entries to jsonl_path.
+    With inline_format ("PNG" or "JPEG") no image files are written: every entry carries its
+    image as a base64 data URL, so the JSONL is self-contained. With shard_bytes the JSONL is
+    split into shards of at most that size (see ShardedJsonlWriter).
+    The same seed reproduces the same images, file names and JSONL regardless of `workers`.
+    Returns the seed and the path of the last image (None when inline).
+    """
+    if seed is None:
+        seed = random.randrange(2**32)
+    if not inline_format:
+        os.makedirs(image_folder, exist_ok=True)
+    
+    last_path = None
+    start = time.perf_counter()
+    with ShardedJsonlWriter(jsonl_path, shard_bytes) as writer:
+        for written, (index, file_name, year, month, data_url) in enumerate(
+                iter_rendered(count, seed, image_folder, years, workers, shuffle, randomization=randomization,
+                              inline_format=inline_format, quality=quality, **render_kwargs), start=1):
+            if data_url:
+                image_url = data_url
+            else:
+                # Construct the image URL based on the GitHub repository structure
+                image_url = f"{base_url}/{image_folder}/{file_name}?raw=true"
+                last_path = os.path.join(image_folder, file_name)
+            writer.write(make_dataset_entry(image_url, year, month))
+            if written % 1000 == 0:
+                print(f"{written}/{count} images ({written / (time.perf_counter() - start):.1f} images/sec)")
+    destination = ", ".join(writer.paths) if len(writer.paths) <= 3 else f"{len(writer.paths)} shards of {jsonl_path}"
+    if inline_format:
+        print(f"Generated {count} inline {inline_format} images in {destination} (seed {seed})")
+    else:
+        print(f"Generated {count} images in {image_folder} and {destination} (seed {seed})")
+    return seed, last_path
+
+def benchmark(count=200, workers=None, seed=0, randomization=None):
+    """
+    Images/sec of the serial loop and of the process pool, saving into a temporary folder
+    """
+    workers = workers or os.cpu_count() or 1
+    results = {}
+    for label, worker_count in (("serial", 1), (f"{workers} workers", workers)):
+        with tempfile.TemporaryDirectory() as image_folder:
+            start = time.perf_counter()
+            for _ in iter_rendered(count, seed, image_folder, workers=worker_count, randomization=randomization):
+                pass
+            results[label] = count / (time.perf_counter() - start)
+        print(f"{label}: {results[label]:.1f} images/sec")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic injection mold date images and a JSONL dataset")
+    parser.add_argument("--count", type=int, default=60, help="Number of images to generate")
+    parser.add_argument("--image_folder", default="IM_data_generation/images", help="Folder for the generated images")
+    parser.add_argument("--jsonl", default="IM_data_generation/dataset.jsonl", help="JSONL dataset file to write")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed (a random one is chosen and printed by default)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to all cores)")
+    parser.add_argument("--base_url", default=BASE_URL, help="Base URL the image_url entries point to")
+    parser.add_argument("--no_shuffle", action="store_true", help="Keep the JSONL in generation order")
+    parser.add_argument("--benchmark", action="store_true", help="Measure images/sec (serial vs. process pool) for --count images and exit")
+    parser.add_argument("--show", action="store_true", help="Show the last generated image")
+    parser.add_argument("--randomize", action="store_true", help="Domain-randomize geometry, pose, surface, clutter and camera effects")
+    parser.add_argument("--randomization", default=None, help="JSON file overriding the parameter distributions (implies --randomize)")
+    parser.add_argument("--inline", choices=["png", "jpeg"], default=None, help="Embed the images in the JSONL as base64 data URLs instead of writing files")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality for --inline jpeg")
+    parser.add_argument("--shard_size_mb", type=float, default=None, help="Split the JSONL into shards of at most this many MB")
+    
+    args = parser.parse_args()
+    
+    randomization = None
+    if args.randomization:
+        randomization = load_distributions(args.randomization)
+    elif args.randomize:
+        randomization = {}
+    
+    if args.benchmark:
+        benchmark(args.count, args.workers, args.seed or 0, randomization)
+        return
+    
+    _, last_path = generate_dataset(args.count, args.image_folder, args.jsonl, args.seed, args.base_url,
+                                    workers=args.workers, shuffle=not args.no_shuffle, randomization=randomization,
+                                    inline_format=args.inline.upper() if args.inline else None, quality=args.quality,
+                                    shard_bytes=int(args.shard_size_mb * 1024 * 1024) if args.shard_size_mb else None)
     
     # For demonstration, show the last generated image
-    img.show()
\ No newline at end of file
+    if args.show and last_path:
+        Image.open(last_path).show()
+
+if __name__ == "__main__":
+    main()
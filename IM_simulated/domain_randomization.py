@@ -0,0 +1,214 @@
+import io
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# Parameter distributions of the randomized generator. Same spec format as the augmentation
+# configs: [low, high] is a uniform range (integers if both ends are integers),
+# {"choice": [...]} picks one option, anything else is used as is.
+DEFAULT_DISTRIBUTIONS = {
+    # Stamp geometry (draw_injection_mold_date arguments, in output pixels)
+    "circle_radius": [44, 66],
+    "font_size": [15, 24],
+    "line_offset": [9, 14],
+    "digit_offset": [14, 24],
+    "arrow_width": [7, 13],
+    "arrow_margin": [3, 8],
+    "arrow_head_length": [10, 18],
+    # Pose: rotation in degrees, zoom, shift as a fraction of the image size, and the largest
+    # corner displacement of the perspective warp as a fraction of the image size
+    "rotation": [0, 359],
+    "zoom": [0.8, 1.2],
+    "shift": [-0.08, 0.08],
+    "perspective": [0.0, 0.12],
+    # Moulded plastic: grey level, colour tint, relief height and softness, light direction,
+    # darkening (negative: lightening) of the stamped strokes, lighting gradient
+    "plastic_level": [60, 200],
+    "tint": [-0.08, 0.08],
+    "relief": {"choice": ["raised", "sunken"]},
+    "emboss_depth": [1.0, 3.0],
+    "emboss_softness": [0.8, 2.2],
+    "light_angle": [0, 359],
+    "stroke_shade": [-15, 35],
+    "lighting": [0.0, 0.35],
+    # Surface texture (mottling and grain amplitude in grey levels) and background clutter
+    "texture": [2.0, 14.0],
+    "grain": [0.0, 6.0],
+    "clutter": [0, 8],
+    # Camera: blur radius, sensor noise sigma, JPEG quality
+    "blur": [0.0, 1.5],
+    "noise": [0.0, 8.0],
+    "jpeg_quality": [35, 95],
+}
+
+def resolve_value(value, rng):
+    """
+    Draw one concrete value from a distribution spec (see DEFAULT_DISTRIBUTIONS). Same
+    semantics as augmentations.resolve_value at the repository root, which this folder's
+    scripts cannot import; test_domain_randomization.py checks that the two agree.
+    """
+    if isinstance(value, list) and len(value) == 2 and all(isinstance(v, (int, float)) for v in value):
+        low, high = value
+        if isinstance(low, int) and isinstance(high, int):
+            return rng.randint(low, high)
+        return round(rng.uniform(low, high), 4)
+    if isinstance(value, dict) and "choice" in value:
+        return rng.choice(value["choice"])
+    return value
+
+def sample_parameters(rng, distributions=None):
+    """
+    One concrete parameter set: DEFAULT_DISTRIBUTIONS overridden by `distributions`, drawn
+    from `rng` in a fixed key order so the same rng state always gives the same parameters
+    """
+    merged = dict(DEFAULT_DISTRIBUTIONS, **(distributions or {}))
+    return {key: resolve_value(merged[key], rng) for key in sorted(merged)}
+
+def stamp_geometry(params):
+    """
+    draw_injection_mold_date keyword arguments from sampled parameters, adjusted so the arrow
+    and year digits stay inside the inner circle whatever the combination
+    """
+    circle_radius = params["circle_radius"]
+    line_offset = min(params["line_offset"], circle_radius // 3)
+    inner_radius = circle_radius - line_offset
+    arrow_margin = params["arrow_margin"]
+    arrow_head_length = min(params["arrow_head_length"], (inner_radius - arrow_margin) // 2)
+    # The year digits are 1.5 * font_size tall; keep them off the inner circle
+    font_size = min(params["font_size"], int(inner_radius / 1.5))
+    digit_offset = min(params["digit_offset"], max(params["arrow_width"], int(inner_radius - 0.8 * font_size * 1.5)))
+    return {
+        "circle_radius": circle_radius,
+        "font_size": font_size,
+        "line_offset": line_offset,
+        "digit_offset": digit_offset,
+        "arrow_width": params["arrow_width"],
+        "arrow_margin": arrow_margin,
+        "arrow_head_length": arrow_head_length,
+    }
+
+def perspective_coefficients(source_quad, target_quad):
+    """
+    Image.transform PERSPECTIVE coefficients that map target_quad (output corners) onto
+    source_quad (input corners)
+    """
+    rows = []
+    for (x, y), (u, v) in zip(target_quad, source_quad):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+    return np.linalg.solve(np.array(rows, dtype=float), np.array(source_quad, dtype=float).ravel()).tolist()
+
+def warp(img, params, rng, fill=0):
+    """
+    Rotate, zoom, shift and perspective-distort img about its centre in one resampling pass
+    """
+    width, height = img.size
+    size = max(width, height)
+    angle = math.radians(params["rotation"])
+    cos_a, sin_a = math.cos(angle) * params["zoom"], math.sin(angle) * params["zoom"]
+    center_x = width / 2 + params["shift"] * size * rng.choice((-1, 1)) * rng.random()
+    center_y = height / 2 + params["shift"] * size * rng.choice((-1, 1)) * rng.random()
+    corners = [(0, 0), (width, 0), (width, height), (0, height)]
+    target = []
+    for x, y in corners:
+        dx, dy = x - width / 2, y - height / 2
+        jitter = params["perspective"] * size
+        target.append((center_x + cos_a * dx + sin_a * dy + rng.uniform(-jitter, jitter),
+                       center_y - sin_a * dx + cos_a * dy + rng.uniform(-jitter, jitter)))
+    coefficients = perspective_coefficients(corners, target)
+    return img.transform(img.size, Image.Transform.PERSPECTIVE, coefficients, resample=Image.Resampling.BICUBIC, fillcolor=fill)
+
+def smooth_noise(np_rng, size, cells):
+    """
+    Low-frequency noise in [-1, 1]: a cells x cells random grid upsampled bicubically
+    """
+    grid = ((np_rng.random((cells, cells)) * 255)).astype(np.uint8)
+    upsampled = Image.fromarray(grid, "L").resize(size, Image.Resampling.BICUBIC)
+    return np.asarray(upsampled, dtype=np.float32) / 127.5 - 1.0
+
+def clutter_layer(size, count, rng):
+    """
+    Background clutter as signed grey-level offsets: scratches, mould seams, blobs and
+    partial rings around the stamp
+    """
+    layer = Image.new("L", size, 128)
+    draw = ImageDraw.Draw(layer)
+    width, height = size
+    for _ in range(count):
+        kind = rng.choice(("scratch", "seam", "blob", "arc"))
+        # Blobs are kept faint so they never hide the stamp
+        shade = 128 + rng.choice((-1, 1)) * rng.randint(5, 15 if kind == "blob" else 40)
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        if kind == "scratch":
+            length, angle = rng.uniform(0.1, 0.5) * width, rng.uniform(0, math.pi)
+            draw.line([(x, y), (x + length * math.cos(angle), y + length * math.sin(angle))], fill=shade, width=rng.randint(1, 2))
+        elif kind == "seam":
+            if rng.random() < 0.5:
+                draw.line([(x, 0), (x + rng.uniform(-20, 20), height)], fill=shade, width=rng.randint(2, 5))
+            else:
+                draw.line([(0, y), (width, y + rng.uniform(-20, 20))], fill=shade, width=rng.randint(2, 5))
+        elif kind == "blob":
+            radius = rng.uniform(3, 0.12 * width)
+            draw.ellipse([x - radius, y - radius, x + radius, y + radius * rng.uniform(0.5, 1.5)], fill=shade)
+        else:
+            radius = rng.uniform(0.3, 0.7) * width
+            start = rng.uniform(0, 360)
+            draw.arc([width / 2 - radius, height / 2 - radius, width / 2 + radius, height / 2 + radius],
+                     start, start + rng.uniform(30, 180), fill=shade, width=rng.randint(2, 6))
+    return np.asarray(layer.filter(ImageFilter.GaussianBlur(1)), dtype=np.float32) - 128.0
+
+def emboss(height_map, params):
+    """
+    Shading of a height map lit from params["light_angle"]: the directional derivative of the
+    blurred height, so stamped strokes get a lit and a shadowed edge like moulded plastic
+    """
+    angle = math.radians(params["light_angle"])
+    gradient_y, gradient_x = np.gradient(height_map)
+    sign = 1.0 if params["relief"] == "raised" else -1.0
+    return sign * params["emboss_depth"] * 40.0 * (gradient_x * math.cos(angle) - gradient_y * math.sin(angle))
+
+def render_plastic(stroke_mask, params, rng):
+    """
+    Turn a stamp mask (L image, 255 on the strokes) into a photo-like RGB image of a date stamp
+    moulded into plastic. Every random choice comes from rng (a random.Random).
+    """
+    size = stroke_mask.size
+    np_rng = np.random.default_rng(rng.getrandbits(64))
+    mask = warp(stroke_mask, params, rng)
+    strokes = np.asarray(mask, dtype=np.float32) / 255.0
+    height_map = np.asarray(mask.filter(ImageFilter.GaussianBlur(params["emboss_softness"])), dtype=np.float32) / 255.0
+
+    # Plastic surface: base grey, mottling, grain, lighting gradient across the part
+    surface = np.full(strokes.shape, float(params["plastic_level"]), dtype=np.float32)
+    surface += params["texture"] * smooth_noise(np_rng, size, 6)
+    surface += params["grain"] * smooth_noise(np_rng, size, max(8, size[0] // 3))
+    if params["lighting"]:
+        angle = rng.uniform(0, 2 * math.pi)
+        ramp_x = np.linspace(-1.0, 1.0, size[0], dtype=np.float32)
+        ramp_y = np.linspace(-1.0, 1.0, size[1], dtype=np.float32)
+        ramp = ramp_x[None, :] * math.cos(angle) + ramp_y[:, None] * math.sin(angle)
+        surface *= 1.0 + params["lighting"] * 0.5 * ramp
+    if params["clutter"]:
+        surface += clutter_layer(size, params["clutter"], rng)
+
+    # Stamp: relief shading plus the dirt/shine of the strokes themselves
+    surface += emboss(height_map, params)
+    surface -= params["stroke_shade"] * strokes
+
+    tint = np.array([1.0 + rng.uniform(-1, 1) * params["tint"] for _ in range(3)], dtype=np.float32)
+    rgb = surface[:, :, None] * tint[None, None, :]
+    if params["noise"]:
+        rgb += np_rng.normal(0.0, params["noise"], rgb.shape).astype(np.float32)
+    img = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), "RGB")
+
+    if params["blur"] > 0.05:
+        img = img.filter(ImageFilter.GaussianBlur(params["blur"]))
+
+    # Camera compression artefacts
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=int(params["jpeg_quality"]))
+    buffer.seek(0)
+    with Image.open(buffer) as compressed:
+        compressed.load()
+        return compressed
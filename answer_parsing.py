@@ -0,0 +1,452 @@
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+MONTHS = ["january", "february", "march", "april", "may", "june", "july",
+          "august", "september", "october", "november", "december"]
+
+# (compiled pattern, literal the text must contain for the pattern to possibly match)
+FINAL_ANSWER_PATTERNS = [
+    (re.compile(r'[*]*Final Answer:\s*(.*?)\s*(\(.*?\))[*]*', re.IGNORECASE | re.DOTALL), "final answer:"),  # "Final Answer: Month YYYY (YYYY-MM)"
+    (re.compile(r'[*]*Final Answer:\s*(.*?)[*]*$', re.IGNORECASE | re.DOTALL), "final answer:"),             # "Final Answer: X"
+    (re.compile(r'[*]*Final Output:\s*(.*?)[*]*$', re.IGNORECASE | re.DOTALL), "final output:"),             # "Final Output: X"
+    (re.compile(r'Formatted result:\s*(.*?)$', re.IGNORECASE | re.DOTALL), "formatted result:"),             # "Formatted result: X"
+]
+# Case-insensitive search for each literal, used for text where lower() is not exact
+LITERAL_PATTERNS = {literal: re.compile(re.escape(literal), re.IGNORECASE) for _, literal in FINAL_ANSWER_PATTERNS}
+DATE_ANSWER_PATTERN = re.compile(r'([A-Z][a-z]+\s+\d{4}\s+\(\d{4}-\d{2}\))')
+DATE_CODE_PATTERN = re.compile(r'(\d{4})-(\d{2})')
+YEAR_PATTERN = re.compile(r'\b(20\d{2})\b')
+
+# Any "YYYY-MM", "MM-YYYY", "MM/YYYY" or "YYYY/MM" numeric date
+NUMERIC_DATE_PATTERN = re.compile(r'\b(?:(?P<y1>(?:19|20)\d{2})[-/](?P<m1>\d{1,2})|(?P<m2>\d{1,2})[-/](?P<y2>(?:19|20)\d{2}))\b')
+MONTH_NAME_PATTERN = re.compile(r'\b(' + '|'.join(MONTHS) + r')\b', re.IGNORECASE)
+
+DateParse = namedtuple("DateParse", ["year", "month", "confidence"])
+
+def _find_literal(response_text, lowered, literal):
+    if lowered is not None:
+        return lowered.find(literal)
+    match = LITERAL_PATTERNS[literal].search(response_text)
+    return match.start() if match else -1
+
+def extract_final_answer(response_text):
+    """
+    Extract the final answer from a response. Same result as the original
+    test_prompts.extract_final_answer, but each pattern is only matched once, at the first
+    occurrence of its literal ("final answer:" etc.), instead of being tried at every position.
+    """
+    # For ASCII text lower() finds exactly what IGNORECASE would; otherwise search case-insensitively
+    lowered = response_text.lower() if response_text.isascii() else None
+    positions = {}
+    for pattern, literal in FINAL_ANSWER_PATTERNS:
+        if literal not in positions:
+            positions[literal] = _find_literal(response_text, lowered, literal)
+        position = positions[literal]
+        if position < 0:
+            continue
+        # The leftmost match starts at the first occurrence, including any '*' right before it.
+        # If the pattern fails there it fails at every later occurrence too.
+        start = position
+        while start > 0 and response_text[start - 1] == '*':
+            start -= 1
+        match = pattern.match(response_text, start)
+        if match:
+            # For the first pattern that has capture groups for both parts
+            if len(match.groups()) > 1 and '(' in match.group(0):
+                return match.group(0).strip()
+            return match.group(1).strip()
+
+    # If no match found, try to find any answer format like Month YYYY (YYYY-MM)
+    match = DATE_ANSWER_PATTERN.search(response_text)
+    if match:
+        return match.group(1).strip()
+
+    # If all else fails, return the last 100 characters as a fallback
+    return response_text[-100:].strip()
+
+def parse_date(text):
+    """
+    Normalize an answer to a DateParse(year, month, confidence).
+    Numeric dates (YYYY-MM, MM-YYYY, MM/YYYY) give confidence 1.0, a month name with a year 0.9,
+    and a lone month or year 0.5. Missing parts are None; nothing recognizable gives confidence 0.0.
+    """
+    if not text:
+        return DateParse(None, None, 0.0)
+
+    match = NUMERIC_DATE_PATTERN.search(text)
+    if match:
+        year = match.group("y1") or match.group("y2")
+        month = int(match.group("m1") or match.group("m2"))
+        if 1 <= month <= 12:
+            return DateParse(int(year), month, 1.0)
+
+    month_match = MONTH_NAME_PATTERN.search(text)
+    year_match = YEAR_PATTERN.search(text)
+    month = MONTHS.index(month_match.group(1).lower()) + 1 if month_match else None
+    year = int(year_match.group(1)) if year_match else None
+    if month and year:
+        return DateParse(year, month, 0.9)
+    if month or year:
+        return DateParse(year, month, 0.5)
+    return DateParse(None, None, 0.0)
+
+def _month_and_year(norm):
+    # First month of the list (not of the text) that occurs, and a year only when a month was found
+    for month in MONTHS:
+        if month in norm:
+            year_match = YEAR_PATTERN.search(norm)
+            return month, year_match.group(1) if year_match else None
+    return None, None
+
+def calculate_precision(extracted_result, expected_result):
+    """
+    Precision score (1.0 / 0.5 / 0.0) of an extracted date against the expected one.
+    Same result as the original test_prompts.calculate_precision, with precompiled patterns.
+    """
+    if not extracted_result or not expected_result:
+        return 0.0
+
+    extracted_norm = extracted_result.lower().strip()
+    expected_norm = expected_result.lower().strip()
+    if extracted_norm == expected_norm:
+        return 1.0
+
+    extracted_code = DATE_CODE_PATTERN.search(extracted_norm)
+    expected_code = DATE_CODE_PATTERN.search(expected_norm)
+    extracted_month_name, extracted_year_text = _month_and_year(extracted_norm)
+    expected_month_name, expected_year_text = _month_and_year(expected_norm)
+
+    if extracted_code and expected_code:
+        year_match = extracted_code.group(1) == expected_code.group(1)
+        month_match = extracted_code.group(2) == expected_code.group(2)
+        if year_match and month_match:
+            return 1.0
+        elif year_match or month_match:
+            return 0.5
+
+    if extracted_month_name and expected_month_name and extracted_year_text and expected_year_text:
+        month_match = extracted_month_name == expected_month_name
+        year_match = extracted_year_text == expected_year_text
+        if month_match and year_match:
+            return 1.0
+        elif month_match or year_match:
+            return 0.5
+
+    if extracted_code and expected_month_name and expected_year_text:
+        year_match = extracted_code.group(1) == expected_year_text
+        month_match = int(extracted_code.group(2)) == MONTHS.index(expected_month_name) + 1
+        if year_match and month_match:
+            return 1.0
+        elif year_match or month_match:
+            return 0.5
+
+    if expected_code and extracted_month_name and extracted_year_text:
+        year_match = extracted_year_text == expected_code.group(1)
+        month_match = MONTHS.index(extracted_month_name) + 1 == int(expected_code.group(2))
+        if year_match and month_match:
+            return 1.0
+        elif year_match or month_match:
+            return 0.5
+
+    return 0.0
+
+def _date_parts(norms):
+    """
+    The pieces calculate_precision looks at, as parallel arrays over a list of normalized strings
+    """
+    count = len(norms)
+    parts = {
+        "code_year": np.empty(count, dtype=object),
+        "code_month": np.empty(count, dtype=object),
+        "code_month_number": np.full(count, -1),
+        "month_number": np.zeros(count, dtype=int),
+        "year": np.empty(count, dtype=object),
+    }
+    for index, norm in enumerate(norms):
+        code = DATE_CODE_PATTERN.search(norm)
+        if code:
+            parts["code_year"][index] = code.group(1)
+            parts["code_month"][index] = code.group(2)
+            parts["code_month_number"][index] = int(code.group(2))
+        month_name, year = _month_and_year(norm)
+        if month_name:
+            parts["month_number"][index] = MONTHS.index(month_name) + 1
+            parts["year"][index] = year
+    parts["has_code"] = np.array([value is not None for value in parts["code_year"]], dtype=bool)
+    parts["has_month_year"] = (parts["month_number"] > 0) & np.array([value is not None for value in parts["year"]], dtype=bool)
+    return parts
+
+def score_batch(extracted_results, expected_results):
+    """
+    Vectorized calculate_precision over two equally long sequences of answers.
+    Returns a float NumPy array with the same scores the scalar function gives.
+
+    Every distinct answer is parsed once and every distinct (extracted, expected) pair is
+    scored once with array operations, so re-scoring large, repetitive result sets is cheap.
+    """
+    extracted = [value if isinstance(value, str) else "" for value in extracted_results]
+    expected = [value if isinstance(value, str) else "" for value in expected_results]
+    if len(extracted) != len(expected):
+        raise ValueError("extracted_results and expected_results must have the same length")
+    if not extracted:
+        return np.zeros(0)
+
+    # Distinct raw strings on each side, and the distinct pairs of them
+    extracted_codes, extracted_unique = pd.factorize(np.array(extracted, dtype=object))
+    expected_codes, expected_unique = pd.factorize(np.array(expected, dtype=object))
+    pair_keys, pair_inverse = np.unique(
+        extracted_codes.astype(np.int64) * len(expected_unique) + expected_codes, return_inverse=True
+    )
+    xi = pair_keys // len(expected_unique)
+    ei = pair_keys % len(expected_unique)
+
+    # Normalized strings share one id space so exact matches are an integer comparison
+    extracted_norms = [value.lower().strip() for value in extracted_unique]
+    expected_norms = [value.lower().strip() for value in expected_unique]
+    norm_codes, _ = pd.factorize(np.array(extracted_norms + expected_norms, dtype=object))
+    extracted_norm_ids = norm_codes[:len(extracted_norms)][xi]
+    expected_norm_ids = norm_codes[len(extracted_norms):][ei]
+
+    x = {name: values[xi] for name, values in _date_parts(extracted_norms).items()}
+    e = {name: values[ei] for name, values in _date_parts(expected_norms).items()}
+
+    empty = (np.array([len(value) == 0 for value in extracted_unique], dtype=bool)[xi] |
+             np.array([len(value) == 0 for value in expected_unique], dtype=bool)[ei])
+    scores = np.zeros(len(pair_keys))
+    undecided = ~empty
+
+    def decide(applies, both_match, either_match):
+        # One `if` block of calculate_precision: 1.0 / 0.5 where it decides, otherwise fall through
+        full = undecided & applies & both_match
+        half = undecided & applies & ~both_match & either_match
+        scores[full] = 1.0
+        scores[half] = 0.5
+        undecided[full | half] = False
+
+    exact = extracted_norm_ids == expected_norm_ids
+    decide(exact, exact, exact)
+
+    year_match = x["code_year"] == e["code_year"]
+    month_match = x["code_month"] == e["code_month"]
+    decide(x["has_code"] & e["has_code"], year_match & month_match, year_match | month_match)
+
+    year_match = x["year"] == e["year"]
+    month_match = x["month_number"] == e["month_number"]
+    decide(x["has_month_year"] & e["has_month_year"], year_match & month_match, year_match | month_match)
+
+    year_match = x["code_year"] == e["year"]
+    month_match = x["code_month_number"] == e["month_number"]
+    decide(x["has_code"] & e["has_month_year"], year_match & month_match, year_match | month_match)
+
+    year_match = x["year"] == e["code_year"]
+    month_match = x["month_number"] == e["code_month_number"]
+    decide(e["has_code"] & x["has_month_year"], year_match & month_match, year_match | month_match)
+
+    return scores[pair_inverse.reshape(-1)]
+
+def extract_batch(response_texts):
+    """
+    extract_final_answer over a sequence of responses, returned as a list.
+    Repeated responses are only parsed once.
+    """
+    response_texts = list(response_texts)
+    extracted = {}
+    for text in response_texts:
+        if text not in extracted:
+            extracted[text] = extract_final_answer(text)
+    return [extracted[text] for text in response_texts]
+
+# Original implementations, kept as the reference for the equivalence check and benchmark
+
+def extract_final_answer_reference(response_text):
+    patterns = [
+        r'[*]*Final Answer:\s*(.*?)\s*(\(.*?\))[*]*',
+        r'[*]*Final Answer:\s*(.*?)[*]*$',
+        r'[*]*Final Output:\s*(.*?)[*]*$',
+        r'Formatted result:\s*(.*?)$'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, response_text, re.IGNORECASE | re.DOTALL)
+        if match:
+            if len(match.groups()) > 1 and '(' in match.group(0):
+                return match.group(0).strip()
+            return match.group(1).strip()
+    match = re.search(r'([A-Z][a-z]+\s+\d{4}\s+\(\d{4}-\d{2}\))', response_text)
+    if match:
+        return match.group(1).strip()
+    return response_text[-100:].strip()
+
+def calculate_precision_reference(extracted_result, expected_result):
+    if not extracted_result or not expected_result:
+        return 0.0
+    extracted_norm = extracted_result.lower().strip()
+    expected_norm = expected_result.lower().strip()
+    if extracted_norm == expected_norm:
+        return 1.0
+    extracted_date_code = re.search(r'(\d{4})-(\d{2})', extracted_norm)
+    expected_date_code = re.search(r'(\d{4})-(\d{2})', expected_norm)
+    months = MONTHS
+    extracted_month_name = None
+    extracted_year_text = None
+    for month in months:
+        if month in extracted_norm:
+            extracted_month_name = month
+            year_match = re.search(r'\b(20\d{2})\b', extracted_norm)
+            if year_match:
+                extracted_year_text = year_match.group(1)
+            break
+    expected_month_name = None
+    expected_year_text = None
+    for month in months:
+        if month in expected_norm:
+            expected_month_name = month
+            year_match = re.search(r'\b(20\d{2})\b', expected_norm)
+            if year_match:
+                expected_year_text = year_match.group(1)
+            break
+    if extracted_date_code and expected_date_code:
+        extracted_year = extracted_date_code.group(1)
+        extracted_month = extracted_date_code.group(2)
+        expected_year = expected_date_code.group(1)
+        expected_month = expected_date_code.group(2)
+        if extracted_year == expected_year and extracted_month == expected_month:
+            return 1.0
+        elif extracted_year == expected_year or extracted_month == expected_month:
+            return 0.5
+    if extracted_month_name and expected_month_name and extracted_year_text and expected_year_text:
+        month_match = extracted_month_name == expected_month_name
+        year_match = extracted_year_text == expected_year_text
+        if month_match and year_match:
+            return 1.0
+        elif month_match or year_match:
+            return 0.5
+    if extracted_date_code and expected_month_name and expected_year_text:
+        extracted_year = extracted_date_code.group(1)
+        extracted_month = int(extracted_date_code.group(2))
+        expected_year = expected_year_text
+        expected_month = months.index(expected_month_name) + 1
+        if extracted_year == expected_year and extracted_month == expected_month:
+            return 1.0
+        elif extracted_year == expected_year or extracted_month == expected_month:
+            return 0.5
+    if expected_date_code and extracted_month_name and extracted_year_text:
+        expected_year = expected_date_code.group(1)
+        expected_month = int(expected_date_code.group(2))
+        extracted_year = extracted_year_text
+        extracted_month = months.index(extracted_month_name) + 1
+        if extracted_year == expected_year and extracted_month == expected_month:
+            return 1.0
+        elif extracted_year == expected_year or extracted_month == expected_month:
+            return 0.5
+    return 0.0
+
+def load_repo_answers(root):
+    """
+    Every message text in the repository's JSONL files: assistant answers first, then user prompts
+    """
+    answers = []
+    prompts = []
+    paths = glob.glob(os.path.join(root, "**", "*.jsonl"), recursive=True) + \
+        glob.glob(os.path.join(root, "**", "*.JSONL"), recursive=True)
+    for path in sorted(set(paths)):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                for message in data.get("messages", []) if isinstance(data, dict) else []:
+                    content = message.get("content")
+                    if message.get("role") == "assistant" and isinstance(content, str):
+                        answers.append(content)
+                    elif isinstance(content, list):
+                        prompts.extend(item["text"] for item in content if item.get("type") == "text")
+    return answers, prompts
+
+def check_equivalence(root):
+    """
+    Compare the fast functions with the reference ones on every answer in the repository.
+    Returns the number of mismatches.
+    """
+    answers, prompts = load_repo_answers(root)
+    # Plus a few edge cases: case folding outside ASCII, markdown, several or unterminated answers
+    edge_cases = [
+        "FINAL ANSWER: May 2021 (2021-05)", "**Final Answer:** June 2022 (2022-06)**",
+        "fınal answer: July 2020", "Final Anſwer: 2021-03", "ﬁnal answer: 2021-03",
+        "Final Answer: (2021-03", "Final answer: A\nFinal Answer: B (2020-01)", "Final Output: **03/2021**",
+        "Formatted result: 2021-02", "No answer here, March 2023 (2023-03) maybe", "",
+    ]
+    texts = answers + prompts + edge_cases
+    mismatches = 0
+    for text in texts:
+        if extract_final_answer(text) != extract_final_answer_reference(text):
+            mismatches += 1
+            print(f"extract mismatch: {text[:80]!r}")
+
+    # Score every distinct extracted answer against every distinct expected answer
+    extracted = sorted(set(extract_final_answer_reference(text) for text in texts)) + ["", "May 2021", "2021-13"]
+    expected = sorted(set(extract_final_answer_reference(text) for text in answers))
+    pairs = [(x, e) for x in extracted for e in expected]
+    reference = np.array([calculate_precision_reference(x, e) for x, e in pairs])
+    scalar = np.array([calculate_precision(x, e) for x, e in pairs])
+    batch = score_batch([x for x, _ in pairs], [e for _, e in pairs])
+    mismatches += int((scalar != reference).sum() + (batch != reference).sum())
+    print(f"Checked {len(texts)} texts and {len(pairs)} answer pairs: {mismatches} mismatches")
+    return mismatches
+
+def benchmark(root, repeat=20):
+    """
+    Time the reference and fast extraction/scoring on the repository answers, one call per
+    input (scalar) and through the batch functions
+    """
+    answers, prompts = load_repo_answers(root)
+    texts = (answers + prompts) * repeat
+    expected = [extract_final_answer_reference(text) for text in answers] * repeat
+    extracted = extract_batch(answers) * repeat
+
+    def timed(fn):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    # The corpus is repeated, so the batch rows also show what skipping repeated inputs saves
+    extract_reference = timed(lambda: [extract_final_answer_reference(t) for t in texts])
+    rows = [
+        ("extract_final_answer (scalar)", len(texts), extract_reference,
+         timed(lambda: [extract_final_answer(t) for t in texts])),
+        ("extract_final_answer (batch)", len(texts), extract_reference,
+         timed(lambda: extract_batch(texts))),
+        ("calculate_precision (scalar)", len(expected),
+         timed(lambda: [calculate_precision_reference(x, e) for x, e in zip(extracted, expected[::-1])]),
+         timed(lambda: [calculate_precision(x, e) for x, e in zip(extracted, expected[::-1])])),
+        ("calculate_precision (batch)", len(expected),
+         timed(lambda: [calculate_precision_reference(x, e) for x, e in zip(extracted, expected[::-1])]),
+         timed(lambda: score_batch(extracted, expected[::-1]))),
+    ]
+    print(f"{'function':32} {'calls':>8} {'reference':>12} {'fast':>12} {'speedup':>8}")
+    for name, calls, reference_time, fast_time in rows:
+        print(f"{name:32} {calls:>8} {reference_time:>11.4f}s {fast_time:>11.4f}s {reference_time / fast_time:>7.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the fast answer parser and scorer")
+    parser.add_argument("--root", default=os.path.dirname(os.path.abspath(__file__)), help="Directory to search for JSONL files")
+    parser.add_argument("--repeat", type=int, default=20, help="How many times to repeat the corpus in the benchmark")
+    parser.add_argument("--check_only", action="store_true", help="Only run the equivalence check")
+
+    args = parser.parse_args()
+
+    mismatches = check_equivalence(args.root)
+    if not args.check_only:
+        benchmark(args.root, args.repeat)
+    raise SystemExit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
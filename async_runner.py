@@ -0,0 +1,159 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+# HTTP status codes that are worth retrying with backoff
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Token bucket that refills continuously at `rate_per_minute` tokens per minute
+    and holds at most `capacity` tokens (defaults to one minute's worth).
+    """
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        """
+        Wait until `amount` tokens are available and take them.
+        Requests larger than the bucket are clamped so they can still go through.
+        """
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate_per_second)
+                self._refill()
+            self.tokens -= amount
+
+class RateLimiter:
+    """
+    Combined requests/min and tokens/min limiter. Either limit may be None to disable it.
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, tokens=0):
+        if self.request_bucket is not None:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket is not None and tokens:
+            await self.token_bucket.acquire(tokens)
+
+def get_retry_after(exception):
+    """
+    Return the Retry-After delay (in seconds) carried by an HTTP error, or None.
+    Supports both the delta-seconds and the HTTP-date forms of the header.
+    """
+    response = getattr(exception, "response", None)
+    if response is None:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def is_retryable(exception):
+    """
+    Decide whether a failed request should be retried.
+    HTTP errors are retried on throttling/server status codes, connection errors and timeouts always.
+    """
+    response = getattr(exception, "response", None)
+    if response is not None:
+        return getattr(response, "status_code", None) in RETRYABLE_STATUS_CODES
+    return isinstance(exception, (ConnectionError, TimeoutError)) or \
+        type(exception).__name__ in (
+            "ConnectionError", "ConnectError", "ChunkedEncodingError", "RemoteProtocolError",
+            "Timeout", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+        )
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0, retry_after=None):
+    """
+    Full-jitter exponential backoff. A server supplied Retry-After always wins
+    as a lower bound so we never come back earlier than we were told to.
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+async def _run_one(index, item, request_fn, semaphore, limiter, token_estimator,
+                   max_retries, base_delay, max_delay, on_result):
+    tokens = token_estimator(item) if token_estimator else 0
+    attempt = 0
+    while True:
+        await limiter.acquire(tokens)
+        retry_delay = None
+        async with semaphore:
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(None, request_fn, item)
+            except Exception as e:
+                result = e
+                if attempt < max_retries and is_retryable(e):
+                    retry_delay = backoff_delay(attempt, base_delay, max_delay, get_retry_after(e))
+                    print(f"  Request {index + 1} failed ({e}), retrying in {retry_delay:.1f}s")
+                    attempt += 1
+        # Sleep outside the semaphore so other requests can use the slot meanwhile
+        if retry_delay is not None:
+            await asyncio.sleep(retry_delay)
+            continue
+        if on_result is not None:
+            on_result(index, item, result)
+        return result
+
+async def run_concurrently_async(items, request_fn, max_in_flight=8, requests_per_minute=None,
+                                 tokens_per_minute=None, token_estimator=None, max_retries=5,
+                                 base_delay=1.0, max_delay=60.0, on_result=None):
+    """
+    Run the blocking `request_fn(item)` for every item with at most `max_in_flight`
+    calls running at once, throttled by the request and token rate limits.
+
+    Returns a list with one entry per item, in the same order as `items`. Calls that
+    still fail after `max_retries` attempts (or fail with a non retryable error) have
+    the exception object in their slot instead of raising.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    loop.set_default_executor(executor)
+    semaphore = asyncio.Semaphore(max_in_flight)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    try:
+        tasks = [
+            _run_one(index, item, request_fn, semaphore, limiter, token_estimator,
+                     max_retries, base_delay, max_delay, on_result)
+            for index, item in enumerate(items)
+        ]
+        return await asyncio.gather(*tasks)
+    finally:
+        executor.shutdown(wait=False)
+
+def run_concurrently(items, request_fn, **kwargs):
+    """
+    Synchronous entry point for `run_concurrently_async`.
+    """
+    return asyncio.run(run_concurrently_async(list(items), request_fn, **kwargs))
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = ".augmentation_manifest.json"
+MANIFEST_VERSION = 1
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AugmentationManifest:
+    """
+    Record of generated (augmented) files in an output directory: for every output, the
+    content hash of its source and the augmentation parameters it was made with.
+
+    An output is up to date when it still exists, its recorded size and mtime match, and it
+    was made from the same source content with the same parameters. Source hashes are
+    cached by size and mtime, so an unchanged tree is checked with stat calls only.
+    Outputs of the previous run that are not recorded again before finish() are stale and
+    deleted.
+    """
+    def __init__(self, output_dir, path=None):
+        self.output_dir = os.path.abspath(output_dir)
+        self.path = path or os.path.join(self.output_dir, MANIFEST_FILENAME)
+        self.sources = {}
+        self.previous_outputs = {}
+        self.outputs = {}
+        self.extra = {}
+        self.hashed = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.sources = data.get("sources", {})
+                self.previous_outputs = data.get("outputs", {})
+                self.extra = data.get("extra", {})
+        except (OSError, ValueError):
+            pass
+
+    def _relative(self, output_path):
+        return os.path.relpath(os.path.abspath(output_path), self.output_dir)
+
+    def source_hash(self, source_path):
+        """
+        SHA-256 of a source file, re-hashed only when its size or mtime changed
+        """
+        source_path = os.path.abspath(source_path)
+        stat = os.stat(source_path)
+        entry = self.sources.get(source_path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(source_path)}
+            self.sources[source_path] = entry
+            self.hashed += 1
+        return entry["sha256"]
+
+    def is_current(self, output_path, source_sha256, params):
+        """
+        True when output_path exists unchanged and was made from this source content with
+        these parameters. A current output is kept by the next finish().
+        """
+        relative = self._relative(output_path)
+        entry = self.outputs.get(relative) or self.previous_outputs.get(relative)
+        if entry is None or entry["source_sha256"] != source_sha256 or entry["params"] != params:
+            return False
+        try:
+            stat = os.stat(output_path)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime_ns"]:
+            return False
+        self.outputs[relative] = entry
+        return True
+
+    def record(self, output_path, source_path, source_sha256, params):
+        """
+        Register a freshly written output
+        """
+        stat = os.stat(output_path)
+        self.outputs[self._relative(output_path)] = {
+            "source": os.path.abspath(source_path),
+            "source_sha256": source_sha256,
+            "params": params,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    def stale_outputs(self):
+        return [relative for relative in self.previous_outputs if relative not in self.outputs]
+
+    def finish(self, delete_stale=True):
+        """
+        Delete outputs of the previous run that were not produced or confirmed in this run,
+        then save the manifest. Returns the number of deleted files.
+        """
+        deleted = 0
+        if delete_stale:
+            for relative in self.stale_outputs():
+                try:
+                    os.remove(os.path.join(self.output_dir, relative))
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Could not delete stale output {relative}: {e}")
+        else:
+            for relative in self.stale_outputs():
+                self.outputs[relative] = self.previous_outputs[relative]
+        self.previous_outputs = dict(self.outputs)
+        self.save()
+        return deleted
+
+    def save(self):
+        # Forget sources that no longer exist
+        self.sources = {path: entry for path, entry in self.sources.items() if os.path.exists(path)}
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "sources": self.sources,
+                "outputs": self.outputs,
+                "extra": self.extra,
+            }, f)
+        os.replace(temporary_path, self.path)
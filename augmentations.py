@@ -0,0 +1,211 @@
+import io
+import json
+import os
+import random
+
+from PIL import Image, ImageEnhance, ImageOps
+
+# JPEG quality of every augmented image, written to a file or rendered in memory (PIL's
+# default, which the materialized files have always been saved with)
+JPEG_QUALITY = 75
+
+# Lossless equivalents of Image.rotate(degrees, expand=True) for right angles
+ROTATION_TRANSPOSES = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+def _enhanceable(img):
+    # ImageEnhance and JPEG encoding need a true-colour or greyscale image
+    if img.mode in ("RGB", "L"):
+        return img
+    return img.convert("RGB")
+
+def op_rotate(img, degrees, expand=True, fill=None):
+    """Rotate counter-clockwise; right angles use a lossless transpose."""
+    transpose = ROTATION_TRANSPOSES.get(degrees % 360) if expand else None
+    if transpose is not None:
+        return img.transpose(transpose)
+    if degrees % 360 == 0:
+        return img.copy()
+    fillcolor = tuple(fill) if isinstance(fill, list) else fill
+    return img.rotate(degrees, resample=Image.Resampling.BICUBIC, expand=expand, fillcolor=fillcolor)
+
+def op_pad(img, pixels=None, fraction=None, fill="black"):
+    """Add a border of `pixels`, or of `fraction` of the longer side (zoomed_padded uses 30px black)."""
+    if pixels is None:
+        pixels = round(max(img.size) * (fraction or 0.0))
+    fill = tuple(fill) if isinstance(fill, list) else fill
+    return ImageOps.expand(img, border=int(pixels), fill=fill)
+
+def op_sharpen(img, factor=2.0):
+    return ImageEnhance.Sharpness(_enhanceable(img)).enhance(factor)
+
+def op_crop(img, fraction=0.9, x=0.5, y=0.5):
+    """Keep `fraction` of the width and height; x/y place the window (0 = left/top, 1 = right/bottom)."""
+    width, height = img.size
+    crop_width, crop_height = max(1, round(width * fraction)), max(1, round(height * fraction))
+    left = round((width - crop_width) * x)
+    top = round((height - crop_height) * y)
+    return img.crop((left, top, left + crop_width, top + crop_height))
+
+def op_zoom(img, factor=1.2, fill="black"):
+    """Zoom in (factor > 1) or out (factor < 1) around the centre, keeping the image size."""
+    width, height = img.size
+    if factor >= 1:
+        return op_crop(img, 1 / factor).resize((width, height), Image.Resampling.LANCZOS)
+    scaled = img.resize((max(1, round(width * factor)), max(1, round(height * factor))), Image.Resampling.LANCZOS)
+    fill = tuple(fill) if isinstance(fill, list) else fill
+    canvas = Image.new(img.mode, (width, height), fill)
+    canvas.paste(scaled, ((width - scaled.width) // 2, (height - scaled.height) // 2))
+    return canvas
+
+def op_brightness(img, factor=1.0):
+    return ImageEnhance.Brightness(_enhanceable(img)).enhance(factor)
+
+def op_contrast(img, factor=1.0):
+    return ImageEnhance.Contrast(_enhanceable(img)).enhance(factor)
+
+def op_jpeg(img, quality=75):
+    """Round-trip through JPEG at `quality` in memory to add compression artefacts."""
+    buffer = io.BytesIO()
+    _enhanceable(img).save(buffer, format="JPEG", quality=int(quality))
+    buffer.seek(0)
+    with Image.open(buffer) as recompressed:
+        recompressed.load()
+        return recompressed
+
+OPERATIONS = {
+    "rotate": op_rotate,
+    "pad": op_pad,
+    "sharpen": op_sharpen,
+    "crop": op_crop,
+    "zoom": op_zoom,
+    "brightness": op_brightness,
+    "contrast": op_contrast,
+    "jpeg": op_jpeg,
+}
+
+def resolve_value(value, rng):
+    """
+    Draw one concrete value from a spec value: [low, high] is a uniform range (integers if both
+    ends are integers), {"choice": [...]} picks one option, anything else is used as is
+    """
+    if isinstance(value, list) and len(value) == 2 and all(isinstance(v, (int, float)) for v in value):
+        low, high = value
+        if isinstance(low, int) and isinstance(high, int):
+            return rng.randint(low, high)
+        return round(rng.uniform(low, high), 4)
+    if isinstance(value, dict) and "choice" in value:
+        return rng.choice(value["choice"])
+    return value
+
+def variant_rng(seed, variant_name, source_name):
+    """
+    RNG for one variant of one source image. Seeded from the names rather than the position
+    in the run, so results do not depend on ordering or on the number of workers.
+    """
+    return random.Random(f"{seed}:{variant_name}:{source_name}")
+
+def resolve_steps(steps, rng):
+    """Concrete [{"op": ..., <params>}] steps for one image; ranges are drawn from rng."""
+    resolved = []
+    for step in steps:
+        if step["op"] not in OPERATIONS:
+            raise ValueError(f"Unknown augmentation op {step['op']!r} (known: {', '.join(OPERATIONS)})")
+        resolved.append({key: (value if key == "op" else resolve_value(value, rng)) for key, value in step.items()})
+    return resolved
+
+def apply_steps(img, steps):
+    for step in steps:
+        params = {key: value for key, value in step.items() if key != "op"}
+        img = OPERATIONS[step["op"]](img, **params)
+    return img
+
+class Variant:
+    """
+    One named augmentation: a list of steps, the output folder name and the filename suffix.
+    With copies > 1 the variant expands into several randomized copies (<name>_<k>).
+    """
+    def __init__(self, name, steps, suffix=None, copies=1):
+        self.name = name
+        self.steps = steps
+        self.suffix = suffix if suffix is not None else name
+        self.copies = copies
+
+    def expand(self):
+        if self.copies <= 1:
+            return [self]
+        return [Variant(f"{self.name}_{k}", self.steps, f"{self.suffix}{k}") for k in range(self.copies)]
+
+    def output_filename(self, source_filename):
+        filename_without_ext, ext = os.path.splitext(os.path.basename(source_filename))
+        return f"{filename_without_ext}_{self.suffix}{ext}"
+
+def rotation_variants(degrees_list=(90, 180, 270)):
+    """The fixed rotations inflate_zoomed_dataset has always produced (<degrees>_degrees/<stem>_<degrees>.<ext>)."""
+    return [Variant(f"{degrees}_degrees", [{"op": "rotate", "degrees": degrees}], str(degrees)) for degrees in degrees_list]
+
+def load_variants(config_path):
+    """
+    Variants from a JSON file:
+        {"seed": 0, "variants": [{"name": "tilted", "copies": 2,
+                                  "steps": [{"op": "rotate", "degrees": [-20, 20], "fill": "white"},
+                                            {"op": "jpeg", "quality": [40, 90]}]}]}
+    Returns (variants, seed).
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    variants = []
+    for spec in config["variants"]:
+        variant = Variant(spec["name"], spec["steps"], spec.get("suffix"), spec.get("copies", 1))
+        resolve_steps(variant.steps, random.Random(0))  # Validate op names up front
+        variants.extend(variant.expand())
+    return variants, config.get("seed", 0)
+
+def plan_variants(variants, source_path, seed):
+    """(variant, resolved steps) for every variant of one source image."""
+    source_name = os.path.basename(source_path)
+    return [(variant, resolve_steps(variant.steps, variant_rng(seed, variant.name, source_name))) for variant in variants]
+
+def _save_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    return Image.registered_extensions().get(ext)
+
+def _saveable(img, image_format):
+    if image_format == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+        return img.convert("RGB")
+    return img
+
+def _save(img, target, image_format):
+    """Encode an augmented image with the same options on the file and the in-memory path."""
+    params = {"quality": JPEG_QUALITY} if image_format == "JPEG" else {}
+    _saveable(img, image_format).save(target, format=image_format, **params)
+
+def save_augmented(source_path, jobs):
+    """
+    Decode source_path once and write every job; jobs are (output_path, resolved_steps).
+    Returns the list of written paths.
+    """
+    with Image.open(source_path) as img:
+        img.load()
+        for output_path, steps in jobs:
+            _save(apply_steps(img, steps), output_path, _save_format(output_path))
+    return [output_path for output_path, _ in jobs]
+
+def render_augmented(source_path, jobs, image_format=None):
+    """
+    Decode source_path once and encode every job in memory instead of writing files; jobs are
+    (key, resolved_steps). Returns {key: (image_bytes, mime_type)}. image_format defaults to
+    the source's own format, which gives the same bytes as the file save_augmented writes.
+    """
+    rendered = {}
+    with Image.open(source_path) as img:
+        img.load()
+        image_format = image_format or img.format or "PNG"
+        for key, steps in jobs:
+            buffer = io.BytesIO()
+            _save(apply_steps(img, steps), buffer, image_format)
+            rendered[key] = (buffer.getvalue(), Image.MIME.get(image_format, "application/octet-stream"))
+    return rendered
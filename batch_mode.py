@@ -0,0 +1,79 @@
+import hashlib
+import json
+import re
+
+# Relative URL of the chat completions endpoint inside a batch request line
+BATCH_REQUEST_URL = "/chat/completions"
+
+CUSTOM_ID_PATTERN = re.compile(r'^prompt-(?P<prompt_id>.+)-case-(?P<case_index>\d+)-(?P<digest>[0-9a-f]{12})$')
+
+def request_digest(prompt_text, image_url):
+    """
+    Short digest of the prompt and image a batch request was built from
+    """
+    return hashlib.sha256(json.dumps([prompt_text, image_url]).encode("utf-8")).hexdigest()[:12]
+
+def make_custom_id(prompt_id, case_index, prompt_text, image_url):
+    """
+    Stable custom ID for one prompt x test case request, e.g. "prompt-3-case-17-1a2b3c4d5e6f".
+    The digest lets the import step notice prompts or images that changed since the export.
+    """
+    return f"prompt-{prompt_id}-case-{case_index}-{request_digest(prompt_text, image_url)}"
+
+def parse_custom_id(custom_id):
+    """
+    Split a custom ID back into (prompt_id, case_index, digest). prompt_id is returned as a string.
+    """
+    match = CUSTOM_ID_PATTERN.match(custom_id)
+    if not match:
+        raise ValueError(f"Unrecognized batch custom_id: {custom_id}")
+    return match.group("prompt_id"), int(match.group("case_index")), match.group("digest")
+
+def write_batch_requests(batch_requests, batch_input_path):
+    """
+    Stream (custom_id, body) pairs into a batch input JSONL file, one request per line.
+    Returns the number of requests written.
+    """
+    count = 0
+    with open(batch_input_path, "w", encoding="utf-8") as f:
+        for custom_id, body in batch_requests:
+            f.write(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_REQUEST_URL,
+                "body": body,
+            }) + "\n")
+            count += 1
+    return count
+
+def read_batch_results(batch_output_path):
+    """
+    Stream a batch output JSONL file, yielding (custom_id, response_text, error) per line.
+    Exactly one of response_text and error is None.
+    """
+    with open(batch_output_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Error parsing batch output line {line_number}")
+                continue
+
+            custom_id = data.get("custom_id")
+            error = data.get("error")
+            response = data.get("response") or {}
+            body = response.get("body") or {}
+            if error is None and response.get("status_code", 200) != 200:
+                error = body.get("error") or f"HTTP {response.get('status_code')}"
+            if error is not None:
+                if isinstance(error, dict):
+                    error = error.get("message") or json.dumps(error)
+                yield custom_id, None, str(error)
+                continue
+
+            try:
+                yield custom_id, body["choices"][0]["message"]["content"], None
+            except (KeyError, IndexError, TypeError):
+                yield custom_id, None, "Malformed response body"
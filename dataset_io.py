@@ -0,0 +1,251 @@
+import argparse
+import array
+import json
+import os
+import random
+import struct
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library parser
+    orjson = None
+
+# Sidecar index: magic, source size, source mtime (ns), record count, then the offsets and line numbers
+INDEX_MAGIC = b"JSONLIDX1"
+INDEX_HEADER = struct.Struct("<9sQqQ")
+
+def loads(data):
+    """
+    Parse one JSON document (str or bytes) with the fastest available backend
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def iter_jsonl_lines(jsonl_path, report_errors=True):
+    """
+    Stream a JSONL file, yielding (line_number, raw_line, record) for every non-blank line.
+    Malformed lines are skipped and, with report_errors, reported with their line number.
+    """
+    with open(jsonl_path, "rb") as f:
+        for line_number, raw_line in enumerate(f, start=1):
+            if not raw_line.strip():
+                continue
+            try:
+                record = loads(raw_line)
+            except ValueError as e:
+                if report_errors:
+                    print(f"{jsonl_path}:{line_number}: malformed JSON line skipped ({e})")
+                continue
+            yield line_number, raw_line.decode("utf-8").rstrip("\r\n"), record
+
+def iter_jsonl(jsonl_path, report_errors=True):
+    """
+    Stream the records of a JSONL file as (line_number, record) pairs
+    """
+    for line_number, _, record in iter_jsonl_lines(jsonl_path, report_errors):
+        yield line_number, record
+
+def iter_image_urls(record):
+    """
+    Yield (message_index, content_index, url) for every image in a chat-format record
+    """
+    messages = record.get("messages", []) if isinstance(record, dict) else []
+    for message_index, message in enumerate(messages):
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for content_index, item in enumerate(content):
+            if isinstance(item, dict) and item.get("type") == "image_url":
+                url = (item.get("image_url") or {}).get("url")
+                if url:
+                    yield message_index, content_index, url
+
+def get_image_url(record):
+    """
+    URL of the last image in the last user message, or None
+    """
+    image_url = None
+    for message in record.get("messages", []) if isinstance(record, dict) else []:
+        if message.get("role") != "user":
+            continue
+        image_url = None
+        content = message.get("content")
+        for item in content if isinstance(content, list) else []:
+            if isinstance(item, dict) and item.get("type") == "image_url":
+                image_url = (item.get("image_url") or {}).get("url")
+    return image_url
+
+def get_assistant_answer(record):
+    """
+    Content of the last assistant message, or None
+    """
+    answer = None
+    for message in record.get("messages", []) if isinstance(record, dict) else []:
+        if message.get("role") == "assistant":
+            answer = message.get("content", "")
+    return answer
+
+def with_image_url(record, message_index, content_index, url):
+    """
+    Copy of `record` with one image URL replaced. Only the containers on the path to the URL
+    are copied; everything else (prompt text, other messages) is shared with the original.
+    """
+    messages = list(record["messages"])
+    message = dict(messages[message_index])
+    content = list(message["content"])
+    item = dict(content[content_index])
+    item["image_url"] = dict(item["image_url"], url=url)
+    content[content_index] = item
+    message["content"] = content
+    messages[message_index] = message
+    return dict(record, messages=messages)
+
+def index_path_for(jsonl_path):
+    return jsonl_path + ".idx"
+
+class JsonlIndex:
+    """
+    Byte-offset index over the non-blank lines of a JSONL file, persisted in a sidecar file
+    (<file>.idx) and rebuilt automatically when the JSONL file's size or mtime changes.
+
+    Gives random access to records without parsing the rest of the file, which makes
+    sampling and train/val slicing of large datasets cheap.
+    """
+    def __init__(self, jsonl_path, index_path=None):
+        self.jsonl_path = jsonl_path
+        self.index_path = index_path or index_path_for(jsonl_path)
+        stat = os.stat(jsonl_path)
+        if not self._load(stat):
+            self._build(stat)
+            self._save(stat)
+
+    def _load(self, stat):
+        try:
+            with open(self.index_path, "rb") as f:
+                magic, size, mtime_ns, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                if magic != INDEX_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                    return False
+                self.offsets = array.array("Q")
+                self.offsets.fromfile(f, count)
+                self.line_numbers = array.array("Q")
+                self.line_numbers.fromfile(f, count)
+            return True
+        except (OSError, EOFError, struct.error):
+            return False
+
+    def _build(self, stat):
+        self.offsets = array.array("Q")
+        self.line_numbers = array.array("Q")
+        offset = 0
+        with open(self.jsonl_path, "rb") as f:
+            for line_number, raw_line in enumerate(f, start=1):
+                if raw_line.strip():
+                    self.offsets.append(offset)
+                    self.line_numbers.append(line_number)
+                offset += len(raw_line)
+
+    def _save(self, stat):
+        temporary_path = self.index_path + ".tmp"
+        try:
+            with open(temporary_path, "wb") as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(self.offsets)))
+                self.offsets.tofile(f)
+                self.line_numbers.tofile(f)
+            os.replace(temporary_path, self.index_path)
+        except OSError as e:
+            # A read-only dataset folder only costs us the persisted index
+            print(f"Could not write JSONL index {self.index_path}: {e}")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def read_line(self, position, f=None):
+        """
+        Raw text of the record at `position` (0-based among the non-blank lines)
+        """
+        if f is None:
+            with open(self.jsonl_path, "rb") as f:
+                return self.read_line(position, f)
+        f.seek(self.offsets[position])
+        return f.readline().decode("utf-8").rstrip("\r\n")
+
+    def __getitem__(self, position):
+        """
+        Parsed record at `position`. Malformed lines raise ValueError naming the line number.
+        """
+        raw_line = self.read_line(position)
+        try:
+            return loads(raw_line)
+        except ValueError as e:
+            raise ValueError(f"{self.jsonl_path}:{self.line_numbers[position]}: malformed JSON line ({e})") from e
+
+    def iter_positions(self, positions, report_errors=True):
+        """
+        Stream (line_number, raw_line, record) for the given positions, in the given order
+        """
+        with open(self.jsonl_path, "rb") as f:
+            for position in positions:
+                raw_line = self.read_line(position, f)
+                try:
+                    record = loads(raw_line)
+                except ValueError as e:
+                    if report_errors:
+                        print(f"{self.jsonl_path}:{self.line_numbers[position]}: malformed JSON line skipped ({e})")
+                    continue
+                yield self.line_numbers[position], raw_line, record
+
+    def sample(self, count, seed=None):
+        """
+        Positions of `count` records drawn without replacement, in file order
+        """
+        rng = random.Random(seed)
+        return sorted(rng.sample(range(len(self)), min(count, len(self))))
+
+    def split(self, validation_fraction, seed=None):
+        """
+        Random (train_positions, validation_positions) split of the records, each in file order
+        """
+        positions = list(range(len(self)))
+        random.Random(seed).shuffle(positions)
+        validation_count = int(round(len(positions) * validation_fraction))
+        return sorted(positions[validation_count:]), sorted(positions[:validation_count])
+
+    def write_subset(self, positions, output_path):
+        """
+        Copy the raw lines at `positions` to a new JSONL file without parsing them
+        """
+        with open(self.jsonl_path, "rb") as source, open(output_path, "w", encoding="utf-8") as output:
+            for position in positions:
+                output.write(self.read_line(position, source) + "\n")
+        return len(positions)
+
+def main():
+    parser = argparse.ArgumentParser(description="Index, sample or split a JSONL dataset")
+    parser.add_argument("--dataset", required=True, help="Path to the JSONL dataset")
+    parser.add_argument("--sample", type=int, default=None, help="Write this many randomly chosen records to --output")
+    parser.add_argument("--validation_fraction", type=float, default=None, help="Split into <name>_train.jsonl and <name>_val.jsonl")
+    parser.add_argument("--output", default=None, help="Output file for --sample")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for sampling and splitting")
+
+    args = parser.parse_args()
+
+    index = JsonlIndex(args.dataset)
+    print(f"{args.dataset}: {len(index)} records (index {index.index_path})")
+
+    if args.sample is not None:
+        if not args.output:
+            parser.error("--sample needs --output")
+        count = index.write_subset(index.sample(args.sample, args.seed), args.output)
+        print(f"Wrote {count} sampled records to {args.output}")
+
+    if args.validation_fraction is not None:
+        train_positions, validation_positions = index.split(args.validation_fraction, args.seed)
+        base, ext = os.path.splitext(args.dataset)
+        for suffix, positions in (("train", train_positions), ("val", validation_positions)):
+            output_path = f"{base}_{suffix}{ext}"
+            index.write_subset(positions, output_path)
+            print(f"Wrote {len(positions)} records to {output_path}")
+
+if __name__ == "__main__":
+    main()
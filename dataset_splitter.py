@@ -0,0 +1,215 @@
+import argparse
+import hashlib
+import os
+import re
+from collections import Counter
+from urllib.parse import unquote
+
+from answer_parsing import extract_final_answer, parse_date
+from dataset_io import get_assistant_answer, iter_image_urls, iter_jsonl_lines
+
+# Part ID of the date-code photos, e.g. 506525-1-3 in "FULL_CROPPED/506525-1-3 (1).jpeg"
+PART_ID_PATTERN = re.compile(r"\d{6}-\d+-\d+")
+# Suffixes that mark a copy or a variant of the same photo: " (1)" from downloads and
+# "_90"/"_180"/"_270" from process_dataset's rotations
+COPY_SUFFIX = re.compile(r" \(\d+\)$")
+ROTATION_SUFFIX = re.compile(r"_(?:90|180|270)$")
+
+UNKNOWN_STRATUM = "unknown"
+
+def part_id(image_url, pattern=PART_ID_PATTERN):
+    """
+    Group key of an image: the part ID in its filename, or failing that the filename stem
+    without copy and rotation suffixes. None for data URLs.
+    """
+    if image_url.startswith("data:"):
+        return None
+    # Plain string splitting: urlsplit would dominate the cost of the streaming pass
+    filename = unquote(image_url.split("?", 1)[0].split("#", 1)[0].rsplit("/", 1)[-1])
+    match = pattern.search(filename)
+    if match:
+        return match.group(0)
+    stem = os.path.splitext(filename)[0]
+    return ROTATION_SUFFIX.sub("", COPY_SUFFIX.sub("", stem))
+
+def answer_stratum(record):
+    """
+    "YYYY-MM" of the record's expected answer, or "unknown" when it has no month and year
+    """
+    answer = get_assistant_answer(record)
+    if not isinstance(answer, str):
+        return UNKNOWN_STRATUM
+    date = parse_date(extract_final_answer(answer))
+    if date.year is None or date.month is None:
+        return UNKNOWN_STRATUM
+    return f"{date.year}-{date.month:02d}"
+
+def _rank(seed, key):
+    # Stable across runs and Python processes, unlike hash()
+    return hashlib.sha256(f"{seed}:{key}".encode("utf-8")).digest()
+
+class SplitPlan:
+    """
+    Per-record metadata gathered in one streaming pass over a JSONL file: the line number, the
+    group (records sharing a part ID) and the stratum (answer month/year) of every record.
+    Record text and images are not kept, so the plan stays small for very large files.
+    """
+    def __init__(self, jsonl_path, pattern=PART_ID_PATTERN):
+        self.jsonl_path = jsonl_path
+        self.line_numbers = []
+        self.record_groups = []
+        self.record_strata = []
+        group_ids = {}
+        for line_number, _, record in iter_jsonl_lines(jsonl_path):
+            urls = [url for _, _, url in iter_image_urls(record)]
+            keys = [key for key in (part_id(url, pattern) for url in urls) if key]
+            group = keys[0] if keys else f"line:{line_number}"
+            self.line_numbers.append(line_number)
+            self.record_groups.append(group_ids.setdefault(group, len(group_ids)))
+            self.record_strata.append(answer_stratum(record))
+        self.groups = list(group_ids)
+
+    def __len__(self):
+        return len(self.line_numbers)
+
+    def merge_groups(self, record_pairs):
+        """
+        Merge the groups of records that must stay together, e.g. near-duplicate images under
+        different part IDs; record_pairs are (position_a, position_b). Every merged group is
+        renumbered to the smallest of its groups.
+        """
+        # Imported here: image_dedup needs numpy and is only used on request
+        from image_dedup import connected_groups
+
+        merged = connected_groups(range(len(self.groups)),
+                                  [(self.record_groups[a], self.record_groups[b]) for a, b in record_pairs])
+        self.record_groups = [merged[group] for group in self.record_groups]
+
+    def assign(self, validation_fraction, seed=0):
+        """
+        Side of every record (True = validation). Each group goes to one side as a whole; within
+        every stratum, groups are taken in a seeded order until the stratum's share of the
+        validation target is reached. The rounding remainder is carried from stratum to stratum,
+        so the total matches the target and small strata still reach validation.
+        """
+        group_sizes = Counter(self.record_groups)
+        group_strata = {}
+        for group, strata in self._group_strata().items():
+            # A group whose records disagree on the answer goes with its most common stratum
+            group_strata[group] = min(strata.items(), key=lambda item: (-item[1], item[0]))[0]
+
+        strata = {}
+        for group, stratum in group_strata.items():
+            strata.setdefault(stratum, []).append(group)
+
+        validation_groups = set()
+        carry = 0.0
+        for stratum in sorted(strata, key=lambda stratum: _rank(seed, stratum)):
+            groups = sorted(strata[stratum], key=lambda group: _rank(seed, self.groups[group]))
+            target = validation_fraction * sum(group_sizes[group] for group in groups) + carry
+            taken = 0
+            for group in groups:
+                size = group_sizes[group]
+                # Take the group when that brings the count closer to the target
+                if abs(taken + size - target) < abs(taken - target):
+                    validation_groups.add(group)
+                    taken += size
+            carry = target - taken
+        return [group in validation_groups for group in self.record_groups]
+
+    def _group_strata(self):
+        strata = {}
+        for group, stratum in zip(self.record_groups, self.record_strata):
+            strata.setdefault(group, Counter())[stratum] += 1
+        return strata
+
+def write_split(jsonl_path, line_numbers, sides, train_path, validation_path):
+    """
+    Copy every planned line of jsonl_path to train_path or validation_path in one sequential
+    read, without parsing it again. Returns (train_count, validation_count).
+    """
+    side_by_line = dict(zip(line_numbers, sides))
+    counts = [0, 0]
+    with open(jsonl_path, "rb") as source, open(train_path, "wb") as train, open(validation_path, "wb") as validation:
+        for line_number, raw_line in enumerate(source, start=1):
+            side = side_by_line.get(line_number)
+            if side is None:
+                continue
+            if not raw_line.endswith(b"\n"):
+                raw_line += b"\n"
+            (validation if side else train).write(raw_line)
+            counts[side] += 1
+    return counts[0], counts[1]
+
+def near_duplicate_record_pairs(plan, threshold, cache_path=None, workers=None):
+    """
+    (position_a, position_b) for records whose images are near-duplicates (see image_dedup).
+    The images come from a second pass with image_dedup.load_records, which keeps only line
+    offsets and image keys and leaves inline images to the hashing workers.
+    """
+    # Imported here: perceptual hashing needs numpy and is only used on request
+    import image_dedup
+
+    records, sources = image_dedup.load_records([plan.jsonl_path])
+    position_by_line = {line_number: position for position, line_number in enumerate(plan.line_numbers)}
+    positions_by_key = {}
+    for record in records:
+        position = position_by_line.get(record.line_number)
+        if position is None:
+            continue
+        for key in record.image_keys:
+            positions_by_key.setdefault(key, []).append(position)
+    cache = image_dedup.HashCache(cache_path or os.path.join(image_dedup.REPO_ROOT, image_dedup.HASH_CACHE_FILENAME))
+    hashes = image_dedup.hash_images(sources, cache, workers)
+    record_pairs = []
+    for positions in positions_by_key.values():
+        record_pairs.extend((positions[0], other) for other in positions[1:])
+    for key_a, key_b, _ in image_dedup.near_duplicate_pairs(hashes, threshold):
+        record_pairs.append((positions_by_key[key_a][0], positions_by_key[key_b][0]))
+    return record_pairs
+
+def split_report(plan, sides):
+    """
+    Print record and group counts per side and how evenly the strata were split
+    """
+    validation_count = sum(sides)
+    validation_groups = {group for group, side in zip(plan.record_groups, sides) if side}
+    train_groups = set(plan.record_groups) - validation_groups
+    print(f"{len(plan)} records in {len(set(plan.record_groups))} groups: "
+          f"{len(plan) - validation_count} train ({len(train_groups)} groups), "
+          f"{validation_count} validation ({len(validation_groups)} groups)")
+    totals, validation = Counter(plan.record_strata), Counter(stratum for stratum, side in zip(plan.record_strata, sides) if side)
+    if len(plan) and validation_count:
+        overall = validation_count / len(plan)
+        largest = max(totals, key=lambda stratum: totals[stratum])
+        print(f"{len(totals)} month/year strata; validation share {overall:.1%} overall, "
+              f"{validation[largest] / totals[largest]:.1%} in the largest stratum ({largest}, {totals[largest]} records)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Split a JSONL dataset into train/validation by part ID, stratified by answer month/year")
+    parser.add_argument("--dataset", required=True, help="Source JSONL file")
+    parser.add_argument("--validation_fraction", type=float, default=0.2, help="Share of records for validation")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the split; the same seed gives the same split")
+    parser.add_argument("--train_output", default=None, help="Train file (default <dataset>_train.jsonl)")
+    parser.add_argument("--val_output", default=None, help="Validation file (default <dataset>_val.jsonl)")
+    parser.add_argument("--group_pattern", default=PART_ID_PATTERN.pattern, help="Regex for the part ID in image filenames")
+    parser.add_argument("--near_duplicates", type=int, default=None, metavar="THRESHOLD",
+                        help="Also keep near-duplicate images (perceptual hash distance <= THRESHOLD) on one side")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --near_duplicates hashing")
+
+    args = parser.parse_args()
+
+    base, ext = os.path.splitext(args.dataset)
+    train_path = args.train_output or f"{base}_train{ext}"
+    validation_path = args.val_output or f"{base}_val{ext}"
+
+    plan = SplitPlan(args.dataset, re.compile(args.group_pattern))
+    if args.near_duplicates is not None:
+        plan.merge_groups(near_duplicate_record_pairs(plan, args.near_duplicates, workers=args.workers))
+    sides = plan.assign(args.validation_fraction, args.seed)
+    split_report(plan, sides)
+    train_count, validation_count = write_split(args.dataset, plan.line_numbers, sides, train_path, validation_path)
+    print(f"Wrote {train_count} records to {train_path} and {validation_count} to {validation_path}")
+
+if __name__ == "__main__":
+    main()
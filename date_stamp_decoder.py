@@ -0,0 +1,392 @@
+import argparse
+import csv
+import glob
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+import numpy as np
+
+from answer_parsing import DateParse, extract_final_answer, parse_date
+from dataset_io import get_assistant_answer, get_image_url, iter_jsonl
+from inference_backends import DEFAULT_IMAGE_SIZE, read_grayscale
+
+# Month m sits at 90 - (m - 1) * 30 degrees on the dial (counterclockwise from the +x axis,
+# y pointing up), the arrow points at it along the same axis (IM_date_generator)
+MONTH_STEP = 30.0
+# Months whose label has two digits; their heavier ink on the number ring fixes the dial rotation
+TWO_DIGIT_MONTHS = (10, 11, 12)
+
+# Working resolution and sampling of the polar unwrap
+DECODE_SIZE = DEFAULT_IMAGE_SIZE
+ANGLE_BINS = 180
+RADIUS_STEPS = 48
+# Edge pixels voting for the centre, and how many pixels around the winner the centre is refined
+HOUGH_EDGES = 1000
+HOUGH_RADII = 16
+CENTER_SEARCH = 2
+# Inner / outer circle radius of a dial (generator: 0.5 - 0.8)
+RING_RATIO = (0.45, 0.85)
+# A circle counts as inked where this share of its angles is
+CIRCLE_COVERAGE = 0.3
+# Mean ink of a number ring with legible labels (generator: about 0.3) and without them
+# (labels drawn as specks by an unsized bitmap font: about 0.09)
+LABEL_INK = (0.1, 0.2)
+# Images per vectorized batch in decode_files
+CHUNK_SIZE = 64
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+# month: 1-12; orientation: direction the arrow points in the image, degrees counterclockwise
+# from the +x axis; confidence in [0, 1]
+StampReading = namedtuple("StampReading", ["month", "orientation", "confidence"])
+
+def box_blur(images, radius):
+    """
+    Mean over a (2 * radius + 1)^2 window of every image in an (N, H, W) batch, with
+    edge padding, from one summed-area table
+    """
+    padded = np.pad(images, ((0, 0), (radius + 1, radius), (radius + 1, radius)), mode="edge")
+    table = padded.cumsum(axis=1).cumsum(axis=2)
+    size = 2 * radius + 1
+    window = table[:, size:, size:] - table[:, :-size, size:] - table[:, size:, :-size] + table[:, :-size, :-size]
+    return window / (size * size)
+
+def ink_map(images):
+    """
+    Stroke strength of (N, H, W) grey images in [0, 1]: the local contrast against a blurred
+    background, normalized per image. Sign-agnostic, so dark print on a light background and
+    embossed plastic with lit and shadowed edges both show up.
+    """
+    radius = max(1, images.shape[-1] // 48)
+    ink = np.abs(images - box_blur(images, radius)).reshape(len(images), -1)
+    # Background texture and noise sit below the median, strokes far above it
+    low, high = np.percentile(ink, [50, 99], axis=1)
+    ink = np.clip((ink - low[:, None]) / np.maximum(high - low, 1e-6)[:, None], 0, 1)
+    return ink.reshape(images.shape)
+
+def unwrap(ink, centers, radii, angles):
+    """
+    Polar unwrap: ink sampled (nearest pixel) at centers (N, C, 2) as (x, y), radii (R,) and
+    angles (T,) in radians. Returns (N, C, R, T).
+    """
+    n, height, width = ink.shape
+    dx = radii[:, None] * np.cos(angles)[None, :]
+    dy = -radii[:, None] * np.sin(angles)[None, :]
+    x = np.rint(centers[:, :, 0, None, None] + dx).astype(np.intp).clip(0, width - 1)
+    y = np.rint(centers[:, :, 1, None, None] + dy).astype(np.intp).clip(0, height - 1)
+    return ink[np.arange(n)[:, None, None, None], y, x]
+
+def unwrap_circle(ink, centers, radii, angles):
+    """
+    Ink along one circle per image: centers (N, 2), radii (N,), angles (T,) or per image (N, T).
+    Returns (N, T).
+    """
+    n, height, width = ink.shape
+    x = np.rint(centers[:, 0, None] + radii[:, None] * np.cos(angles)).astype(np.intp).clip(0, width - 1)
+    y = np.rint(centers[:, 1, None] - radii[:, None] * np.sin(angles)).astype(np.intp).clip(0, height - 1)
+    return ink[np.arange(n)[:, None], y, x]
+
+def circle_profiles(samples):
+    """
+    How completely each circle of a polar unwrap (..., R, T) is inked: a low quantile over the
+    angles, so only rings that go all the way round score high, not dense patches of digits.
+    The max over neighbouring radii tolerates thick strokes and slightly elliptical rings.
+    """
+    pooled = samples.copy()
+    pooled[..., 1:, :] = np.maximum(pooled[..., 1:, :], samples[..., :-1, :])
+    pooled[..., :-1, :] = np.maximum(pooled[..., :-1, :], samples[..., 1:, :])
+    k = int(CIRCLE_COVERAGE * (samples.shape[-1] - 1))
+    return np.partition(pooled, k, axis=-1)[..., k]
+
+def ring_pairs(profiles, radii):
+    """
+    Best (inner, outer) pair of circles in radial ink profiles (..., R): the two radii with the
+    most ink above the profile's mean whose ratio is plausible for the dial. Returns the pair
+    score and the inner and outer radius index, each shaped like profiles[..., 0].
+    """
+    ratio = radii[:, None] / radii[None, :]
+    valid = (ratio >= RING_RATIO[0]) & (ratio <= RING_RATIO[1])
+    excess = profiles - profiles.mean(axis=-1, keepdims=True)
+    pair = excess[..., :, None] + excess[..., None, :]
+    pair = np.where(valid, pair, -np.inf).reshape(profiles.shape[:-1] + (-1,))
+    best = pair.argmax(axis=-1)
+    return np.take_along_axis(pair, best[..., None], axis=-1)[..., 0], best // len(radii), best % len(radii)
+
+def hough_centers(images):
+    """
+    Centre (N, 2) of the dial in every image by gradient voting: the strongest edge pixels vote
+    along their gradient (both ways) at every plausible radius, so the points where concentric
+    circles converge collect the most votes, while straight clutter lines spread theirs out
+    """
+    n, size = len(images), images.shape[-1]
+    gradient_y, gradient_x = np.gradient(box_blur(images, 1), axis=(1, 2))
+    magnitude = np.hypot(gradient_x, gradient_y)
+    magnitude[:, :2], magnitude[:, -2:], magnitude[:, :, :2], magnitude[:, :, -2:] = 0, 0, 0, 0
+    count = min(HOUGH_EDGES, size * size)
+    edges = np.argpartition(magnitude.reshape(n, -1), -count, axis=1)[:, -count:]
+    rows = np.arange(n)[:, None]
+    y, x = np.divmod(edges, size)
+    norm = np.maximum(magnitude.reshape(n, -1)[rows, edges], 1e-6)
+    unit_x, unit_y = gradient_x.reshape(n, -1)[rows, edges] / norm, gradient_y.reshape(n, -1)[rows, edges] / norm
+    radii = np.linspace(0.08, 0.45, HOUGH_RADII) * size
+    radii = np.concatenate([-radii, radii])
+    vote_x = np.rint(x[:, :, None] + unit_x[:, :, None] * radii).astype(np.intp)
+    vote_y = np.rint(y[:, :, None] + unit_y[:, :, None] * radii).astype(np.intp)
+    inside = (vote_x >= 0) & (vote_x < size) & (vote_y >= 0) & (vote_y < size)
+    cells = (np.arange(n)[:, None, None] * size + vote_y) * size + vote_x
+    votes = np.bincount(cells[inside], minlength=n * size * size).reshape(n, size, size).astype(np.float32)
+    peak = box_blur(votes, 1).reshape(n, -1).argmax(axis=1)
+    return np.stack([peak % size, peak // size], axis=1).astype(float)
+
+def locate_rings(ink, images):
+    """
+    Centre (N, 2), inner and outer circle radius (N,) of the dial in every image: the
+    hough_centers estimate, refined to where two concentric circles are inked all the way round
+    """
+    n, size = len(ink), ink.shape[-1]
+    radii = np.linspace(0.1, 0.48, RADIUS_STEPS) * size
+    angles = np.linspace(0, 2 * np.pi, ANGLE_BINS // 3, endpoint=False)
+    rows = np.arange(n)
+    centers = hough_centers(images)
+    # Whole pixels around the vote peak, then half pixels around the best of those
+    for span, step in ((CENTER_SEARCH, 1.0), (0.5, 0.5)):
+        offsets = np.arange(-span, span + step / 2, step)
+        grid = np.stack(np.meshgrid(offsets, offsets), axis=-1).reshape(-1, 2)
+        candidates = centers[:, None, :] + grid[None, :, :]
+        scores, inner, outer = ring_pairs(circle_profiles(unwrap(ink, candidates, radii, angles)), radii)
+        best = scores.argmax(axis=1)
+        centers = candidates[rows, best]
+    return centers, radii[inner[rows, best]], radii[outer[rows, best]]
+
+def sample_bands(ink, centers, inner, angles, along, across):
+    """
+    Ink in rotated strips through the dial centre: for every angle (A,) in radians, points at
+    along * inner on the axis and across * inner beside it. Returns (N, A, len(along), len(across)).
+    """
+    n, height, width = ink.shape
+    cos_a, sin_a = np.cos(angles)[:, None, None], np.sin(angles)[:, None, None]
+    t, s = along[None, :, None], across[None, None, :]
+    # Axis u = (cos, -sin) and its normal v = (sin, cos) in image coordinates (y down)
+    dx = t * cos_a + s * sin_a
+    dy = -t * sin_a + s * cos_a
+    scale = inner[:, None, None, None]
+    x = np.rint(centers[:, 0, None, None, None] + scale * dx[None]).astype(np.intp).clip(0, width - 1)
+    y = np.rint(centers[:, 1, None, None, None] + scale * dy[None]).astype(np.intp).clip(0, height - 1)
+    return ink[np.arange(n)[:, None, None, None], y, x]
+
+def _segment_distance(points, p, q):
+    # Distance of (..., 2) points to the segment p-q
+    p, q = np.asarray(p, dtype=float), np.asarray(q, dtype=float)
+    d = q - p
+    t = np.clip(((points - p) @ d) / (d @ d), 0, 1)
+    return np.linalg.norm(points - (p + t[..., None] * d), axis=-1)
+
+def arrow_template(along, across, width=0.06):
+    """
+    Zero-mean (len(along), len(across)) template of the hollow arrow in units of the inner
+    circle radius, pointing towards +along. Default IM_date_generator geometry: inner radius
+    43, margin 5, width 10, head length 15.
+    """
+    tip, head_start, half, head_half = 38 / 43, (38 - 15) / 43, 5 / 43, 10 / 43
+    body = [(-tip, -half), (-tip, half), (head_start, half), (head_start, -half)]
+    head = [(tip, 0.0), (head_start, head_half), (head_start, -head_half)]
+    points = np.stack(np.meshgrid(along, across, indexing="ij"), axis=-1)
+    distance = np.min([_segment_distance(points, a, b)
+                       for polygon in (body, head) for a, b in zip(polygon, polygon[1:] + polygon[:1])], axis=0)
+    template = np.exp(-0.5 * (distance / width) ** 2)
+    return template - template.mean()
+
+def arrow_orientation(ink, centers, inner):
+    """
+    Direction of the arrow (degrees) with the strength of its axis and of its head (0..1):
+    strips through the dial centre at every angle are matched against arrow_template in
+    both directions, and the best of the 2 * 90 hypotheses wins
+    """
+    angles = np.radians(np.arange(0, 180, 2.0))
+    along = np.linspace(-0.95, 0.95, 39)
+    across = np.linspace(-0.4, 0.4, 17)
+    bands = sample_bands(ink, centers, inner, angles, along, across)
+    # Normalized correlation, so scores compare across images and contrasts
+    bands = bands - bands.mean(axis=(2, 3), keepdims=True)
+    bands /= np.maximum(np.sqrt((bands ** 2).sum(axis=(2, 3), keepdims=True)), 1e-6)
+    template = arrow_template(along, across)
+    template /= np.sqrt((template ** 2).sum())
+    forward = np.einsum("natc,tc->na", bands, template)
+    backward = np.einsum("natc,tc->na", bands, template[::-1])
+    scores = np.concatenate([forward, backward], axis=1)
+    best = scores.argmax(axis=1)
+    rows = np.arange(len(ink))
+    axis = best % len(angles)
+    direction = np.degrees(angles[axis]) + np.where(best >= len(angles), 180.0, 0.0)
+    # Axis: correlation of the best strip with the arrow; head: how much better it fits than
+    # the same strip the other way round
+    axis_strength = scores[rows, best]
+    flipped = np.where(best >= len(angles), forward[rows, axis], backward[rows, axis])
+    head_strength = axis_strength - flipped
+    return direction % 360.0, np.clip(axis_strength, 0, 1), np.clip(head_strength, 0, 1)
+
+def month_templates(width=6.0):
+    """
+    (12, ANGLE_BINS) zero-mean angular ink templates of the number ring, relative to the
+    arrow: for month m, where the two-digit labels sit if the arrow points at m
+    """
+    step = 360.0 / ANGLE_BINS
+    relative = np.arange(ANGLE_BINS) * step
+    templates = np.zeros((12, ANGLE_BINS))
+    for m in range(1, 13):
+        for k in TWO_DIGIT_MONTHS:
+            # Label k is (k - m) month steps clockwise from the arrow
+            center = (-(k - m) * MONTH_STEP) % 360.0
+            distance = np.abs((relative - center + 180.0) % 360.0 - 180.0)
+            templates[m - 1] += np.exp(-0.5 * (distance / width) ** 2)
+    return templates - templates.mean(axis=1, keepdims=True)
+
+def ring_months(ink, centers, inner, outer, orientation):
+    """
+    Month (N,), its margin over the runner-up (0..1) and the mean ink of the number ring: the
+    ring between the circles is unwrapped starting at the arrow direction and matched against
+    month_templates
+    """
+    # Relative angles: bin 0 is the arrow direction, increasing counterclockwise
+    angles = np.linspace(0, 2 * np.pi, ANGLE_BINS, endpoint=False)[None, :] + np.radians(orientation)[:, None]
+    fractions = np.linspace(0.25, 0.75, 6)
+    profile = np.zeros((len(ink), ANGLE_BINS))
+    for fraction in fractions:
+        profile += unwrap_circle(ink, centers, inner + (outer - inner) * fraction, angles)
+    label_ink = profile.mean(axis=1) / len(fractions)
+    profile = profile - profile.mean(axis=1, keepdims=True)
+    scores = profile @ month_templates().T
+    order = np.argsort(scores, axis=1)
+    best, runner_up = order[:, -1], order[:, -2]
+    rows = np.arange(len(ink))
+    spread = np.maximum(scores.max(axis=1) - scores.min(axis=1), 1e-6)
+    return best + 1, (scores[rows, best] - scores[rows, runner_up]) / spread, label_ink
+
+def decode_batch(images):
+    """
+    StampReading for every image of an (N, H, W) float batch of grey square images in [0, 1]
+    """
+    images = np.asarray(images, dtype=np.float32)
+    ink = ink_map(images)
+    centers, inner, outer = locate_rings(ink, images)
+    orientation, axis_strength, head_strength = arrow_orientation(ink, centers, inner)
+    months, margin, label_ink = ring_months(ink, centers, inner, outer, orientation)
+    # Each cue scaled to [0, 1]: how arrow-like the arrow is, how clearly it points one way, how
+    # clearly the number ring picks the month and whether the ring holds legible labels at all.
+    # Photos that do not look like the generator's stamps score low on the first and fall
+    # through to a better model.
+    confidence = (np.clip((axis_strength - 0.3) / 0.15, 0, 1) * np.clip(head_strength / 0.04, 0, 1)
+                  * np.clip(margin / 0.15, 0, 1)
+                  * np.clip((label_ink - LABEL_INK[0]) / (LABEL_INK[1] - LABEL_INK[0]), 0, 1))
+    return [StampReading(int(m), float(o), float(c)) for m, o, c in zip(months, orientation, confidence)]
+
+def predict_dates(images):
+    """
+    Batch predictor for inference_backends.LocalBackend. Month only: the year digits are not
+    read, so run_tests does not accept it (see inference_backends.MONTH_ONLY_PREDICTORS)
+    """
+    return [DateParse(None, reading.month, reading.confidence) for reading in decode_batch(images)]
+
+def _decode_chunk(paths):
+    images, readable = [], []
+    for path in paths:
+        try:
+            images.append(read_grayscale(path, DECODE_SIZE))
+            readable.append(path)
+        except (OSError, ValueError) as e:
+            print(f"Could not read {path}: {e}")
+    readings = decode_batch(np.stack(images)) if images else []
+    return dict(zip(readable, readings))
+
+def decode_files(paths, workers=None):
+    """
+    {path: StampReading} for image files, decoded in CHUNK_SIZE batches on a process pool.
+    Unreadable files are left out.
+    """
+    chunks = [paths[start:start + CHUNK_SIZE] for start in range(0, len(paths), CHUNK_SIZE)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) <= 1:
+        results = [_decode_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = list(executor.map(_decode_chunk, chunks))
+    readings = {}
+    for result in results:
+        readings.update(result)
+    return readings
+
+def image_files(paths):
+    """
+    Image files in the given files and directories (searched recursively), sorted
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for name in glob.glob(os.path.join(path, "**", "*"), recursive=True):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.add(name)
+        else:
+            files.add(path)
+    return sorted(files)
+
+def label_months(jsonl_paths):
+    """
+    {file name: expected month} of the images in dataset JSONL files, for checking labels
+    """
+    months = {}
+    for jsonl_path in jsonl_paths:
+        for _, record in iter_jsonl(jsonl_path):
+            image_url, answer = get_image_url(record), get_assistant_answer(record)
+            if not image_url or not isinstance(answer, str):
+                continue
+            month = parse_date(extract_final_answer(answer)).month
+            if month:
+                months[unquote(image_url.split("?", 1)[0].rsplit("/", 1)[-1])] = month
+    return months
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the month from date-stamp dial images without a model (e.g. CROPPED_NO_OBJ, zoomed)")
+    parser.add_argument("images", nargs="+", help="Image files or directories")
+    parser.add_argument("--labels", nargs="*", default=[], help="Dataset JSONL files to check the readings against (matched by file name)")
+    parser.add_argument("--min_confidence", type=float, default=0.5, help="Readings at least this confident count as confident")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to all cores)")
+    parser.add_argument("--output", default=None, help="CSV file for the readings (file, month, orientation, confidence)")
+    parser.add_argument("--show", type=int, default=20, help="Confident disagreements with the labels to list")
+
+    args = parser.parse_args()
+
+    paths = image_files(args.images)
+    start = time.perf_counter()
+    readings = decode_files(paths, args.workers)
+    seconds = time.perf_counter() - start
+    confident = {path: reading for path, reading in readings.items() if reading.confidence >= args.min_confidence}
+    print(f"Decoded {len(readings)} of {len(paths)} images in {seconds:.2f}s "
+          f"({len(readings) / seconds * 60 if seconds else 0:.0f} images/min); "
+          f"{len(confident)} at confidence >= {args.min_confidence}")
+
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["file", "month", "orientation", "confidence"])
+            for path, reading in readings.items():
+                writer.writerow([path, reading.month, f"{reading.orientation:.1f}", f"{reading.confidence:.3f}"])
+        print(f"Wrote the readings to {args.output}")
+
+    if args.labels:
+        months = label_months(args.labels)
+        labelled = {path: reading for path, reading in readings.items() if os.path.basename(path) in months}
+        agree = [reading.month == months[os.path.basename(path)] for path, reading in labelled.items()]
+        disagreements = [(path, reading) for path, reading in labelled.items()
+                         if path in confident and reading.month != months[os.path.basename(path)]]
+        confident_labelled = sum(path in confident for path in labelled)
+        print(f"{len(labelled)} images have labels: month agrees for {sum(agree)}; "
+              f"{confident_labelled - len(disagreements)} of {confident_labelled} confident readings agree")
+        for path, reading in disagreements[:args.show]:
+            print(f"  {path}: label {months[os.path.basename(path)]}, read {reading.month} ({reading.confidence:.2f})")
+        if len(disagreements) > args.show:
+            print(f"  ... and {len(disagreements) - args.show} more")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import math
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import httpx
+except ImportError:  # HTTP/2 support is optional
+    httpx = None
+
+# Per-request latency breakdown, in seconds. `connect` is 0.0 when a pooled connection was reused.
+RequestTiming = namedtuple("RequestTiming", ["connect", "ttfb", "total"])
+
+# Exceptions a ChatCompletionClient call can raise for network/HTTP failures
+REQUEST_EXCEPTIONS = (requests.exceptions.RequestException,)
+if httpx is not None:
+    REQUEST_EXCEPTIONS += (httpx.HTTPError,)
+
+_connect_times = threading.local()
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_times.value = getattr(_connect_times, "value", 0.0) + time.perf_counter() - start
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # Includes the TLS handshake
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_times.value = getattr(_connect_times, "value", 0.0) + time.perf_counter() - start
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    requests adapter whose pooled connections record how long connecting (TCP + TLS) took
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of numbers (None for an empty list)
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+class ChatCompletionClient:
+    """
+    Keep-alive HTTP client for the chat completions endpoint.
+
+    Connections are pooled (up to `pool_size` of them) and reused across calls, every call
+    has a connect and a read timeout, and the latency of each call is recorded split into
+    connect / time-to-first-byte / total. With http2=True (and httpx + h2 installed) calls
+    are multiplexed over HTTP/2 instead.
+    """
+    def __init__(self, connect_timeout=10.0, read_timeout=120.0, pool_size=16, http2=False, verify=True):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.http2 = http2
+        self.timings = []
+        self.lock = threading.Lock()
+
+        if http2:
+            if httpx is None:
+                raise ImportError("HTTP/2 support requires httpx: pip install 'httpx[http2]'")
+            self.client = httpx.Client(
+                http2=True,
+                verify=verify,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            )
+        else:
+            self.client = requests.Session()
+            self.client.verify = verify
+            adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+            self.client.mount("http://", adapter)
+            self.client.mount("https://", adapter)
+
+    def post_json(self, url, headers, payload):
+        """
+        POST `payload` as JSON and return (response_data, RequestTiming).
+        HTTP error statuses raise, with the response attached to the exception.
+        """
+        if self.http2:
+            return self._post_json_httpx(url, headers, payload)
+
+        _connect_times.value = 0.0
+        start = time.perf_counter()
+        response = self.client.post(
+            url, headers=headers, json=payload, timeout=(self.connect_timeout, self.read_timeout)
+        )
+        # response.elapsed stops when the headers have been parsed, before the body is read
+        ttfb = response.elapsed.total_seconds()
+        total = time.perf_counter() - start
+        timing = RequestTiming(_connect_times.value, ttfb, total)
+        self._record(timing)
+        response.raise_for_status()
+        return response.json(), timing
+
+    def _post_json_httpx(self, url, headers, payload):
+        marks = {}
+
+        def trace(event_name, info):
+            marks[event_name] = time.perf_counter()
+
+        start = time.perf_counter()
+        response = self.client.post(url, headers=headers, json=payload, extensions={"trace": trace})
+        total = time.perf_counter() - start
+        connect_end = max(
+            (t for name, t in marks.items() if name.endswith(("connect_tcp.complete", "start_tls.complete"))),
+            default=None,
+        )
+        connect_start = marks.get("connection.connect_tcp.started")
+        connect = connect_end - connect_start if connect_end and connect_start else 0.0
+        headers_received = max(
+            (t for name, t in marks.items() if name.endswith("receive_response_headers.complete")),
+            default=start + total,
+        )
+        timing = RequestTiming(connect, headers_received - start, total)
+        self._record(timing)
+        response.raise_for_status()
+        return response.json(), timing
+
+    def _record(self, timing):
+        with self.lock:
+            self.timings.append(timing)
+
+    def latency_summary(self):
+        """
+        Return p50/p95/max of connect, TTFB and total latency over all recorded calls
+        """
+        with self.lock:
+            timings = list(self.timings)
+        summary = {"requests": len(timings)}
+        for field in RequestTiming._fields:
+            values = [getattr(t, field) for t in timings]
+            summary[field] = {
+                "p50": percentile(values, 0.50),
+                "p95": percentile(values, 0.95),
+                "max": max(values) if values else None,
+            }
+        summary["new_connections"] = sum(1 for t in timings if t.connect > 0)
+        return summary
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,418 @@
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from dataset_io import JsonlIndex, iter_image_urls, loads
+from image_preprocessing import REPO_ROOT, image_key
+
+HASH_CACHE_FILENAME = ".phash_cache.json"
+HASH_CACHE_VERSION = 1
+
+# Largest Hamming distance (of 64 bits) between the perceptual hashes of near-duplicates
+DEFAULT_THRESHOLD = 6
+
+# Images hashed per worker task
+HASH_CHUNK_SIZE = 16
+
+# Clusters listed per section of the report
+REPORT_LIMIT = 20
+
+# Where an inline image lives: the URL at url_index of the record at offset, decoded on demand
+InlineImage = namedtuple("InlineImage", ["jsonl_path", "offset", "url_index"])
+
+@lru_cache(maxsize=None)
+def _dct_matrix(size):
+    """
+    Orthonormal DCT-II matrix; D @ x @ D.T is the 2-D DCT of a size x size block
+    """
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+def _phash(pixels, hash_size=8):
+    """
+    64-bit perceptual hash of a square greyscale block: signs of the low DCT frequencies
+    (DC excluded) against their median
+    """
+    dct = _dct_matrix(pixels.shape[0])
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size].ravel()[1:]
+    bits = low > np.median(low)
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def image_hashes(source, size=32):
+    """
+    Perceptual hashes of an image (a path or encoded bytes) at 0, 90, 180 and 270 degrees,
+    so copies rotated by process_dataset are found as well
+    """
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        img = ImageOps.exif_transpose(img)
+        pixels = np.asarray(img.convert("L").resize((size, size), Image.Resampling.LANCZOS), dtype=np.float64)
+    return [_phash(np.rot90(pixels, k)) for k in range(4)]
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def _read_inline_image(source, files):
+    """
+    Decoded bytes of an InlineImage, re-read from its JSONL line
+    """
+    f = files.get(source.jsonl_path)
+    if f is None:
+        f = files[source.jsonl_path] = open(source.jsonl_path, "rb")
+    f.seek(source.offset)
+    urls = [url for _, _, url in iter_image_urls(loads(f.readline()))]
+    _, data = image_key(urls[source.url_index])
+    if data is None:
+        raise ValueError(f"{source.jsonl_path}: image {source.url_index} at offset {source.offset} is not a data URL")
+    return data
+
+def _hash_chunk(sources):
+    hashes = []
+    files = {}
+    try:
+        for source in sources:
+            try:
+                if isinstance(source, InlineImage):
+                    source = _read_inline_image(source, files)
+                hashes.append(image_hashes(source))
+            except (OSError, ValueError, IndexError) as e:
+                label = source if isinstance(source, str) else "inline image"
+                print(f"Could not hash {label}: {e}")
+                hashes.append(None)
+    finally:
+        for f in files.values():
+            f.close()
+    return hashes
+
+class HashCache:
+    """
+    Persisted perceptual hashes: files by absolute path (re-hashed when their size or mtime
+    changes), inline images by the SHA-256 of their bytes
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == HASH_CACHE_VERSION:
+                self.entries = data.get("entries", {})
+        except (OSError, ValueError):
+            pass
+
+    def get(self, key, stat=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if stat is not None and (entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns):
+            return None
+        return entry["hashes"]
+
+    def put(self, key, hashes, stat=None):
+        entry = {"hashes": hashes}
+        if stat is not None:
+            entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        self.entries[key] = entry
+
+    def save(self):
+        temporary_path = self.path + ".tmp"
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump({"version": HASH_CACHE_VERSION, "entries": self.entries}, f)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            print(f"Could not write hash cache {self.path}: {e}")
+
+def hash_images(sources, cache=None, workers=None):
+    """
+    Perceptual hashes for {key: source}, where a source is a path, encoded bytes or an
+    InlineImage read by the worker that hashes it. Takes what it can from the cache and hashing the
+    rest on a process pool. Returns {key: hashes}; images that cannot be read are left out.
+    """
+    hashes = {}
+    missing = []
+    for key, source in sources.items():
+        stat = os.stat(source) if isinstance(source, str) else None
+        cached = cache.get(key, stat) if cache else None
+        if cached is not None:
+            hashes[key] = cached
+        else:
+            missing.append((key, source, stat))
+
+    chunks = [missing[start:start + HASH_CHUNK_SIZE] for start in range(0, len(missing), HASH_CHUNK_SIZE)]
+    workers = workers or os.cpu_count() or 1
+    source_chunks = [[source for _, source, _ in chunk] for chunk in chunks]
+    if workers == 1 or len(chunks) <= 1:
+        results = [_hash_chunk(chunk) for chunk in source_chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = list(executor.map(_hash_chunk, source_chunks))
+
+    for chunk, chunk_hashes in zip(chunks, results):
+        for (key, _, stat), value in zip(chunk, chunk_hashes):
+            if value is None:
+                continue
+            hashes[key] = value
+            if cache:
+                cache.put(key, value, stat)
+    if cache and missing:
+        cache.save()
+    return hashes
+
+class MultiIndexHash:
+    """
+    Index of 64-bit hashes for Hamming radius queries (multi-index hashing). Every hash is
+    split into `bands` bands with a lookup table each. Two hashes within distance r differ in
+    at most r // bands bits in at least one band, so a query only probes the band values
+    within that distance of its own, instead of comparing against every stored hash.
+    """
+    def __init__(self, radius, bands=4, bits=64):
+        self.radius = radius
+        self.band_bits = bits // bands
+        self.band_radius = radius // bands
+        self.mask = (1 << self.band_bits) - 1
+        self.tables = [{} for _ in range(bands)]
+        # Every pattern of at most band_radius flipped bits within a band
+        self.flips = [sum(1 << bit for bit in bits)
+                      for count in range(self.band_radius + 1)
+                      for bits in itertools.combinations(range(self.band_bits), count)]
+
+    def _bands(self, value):
+        return [(value >> (band * self.band_bits)) & self.mask for band in range(len(self.tables))]
+
+    def add(self, value, item):
+        for table, band_value in zip(self.tables, self._bands(value)):
+            table.setdefault(band_value, []).append((value, item))
+
+    def search(self, value):
+        """
+        {item: distance} for every stored item within the radius of value
+        """
+        found = {}
+        for table, band_value in zip(self.tables, self._bands(value)):
+            for flip in self.flips:
+                for stored, item in table.get(band_value ^ flip, ()):
+                    if item not in found:
+                        distance = hamming(value, stored)
+                        if distance <= self.radius:
+                            found[item] = distance
+        return found
+
+def near_duplicate_pairs(hashes, threshold=DEFAULT_THRESHOLD):
+    """
+    [(key_a, key_b, distance)] for every pair of images within threshold of each other in any
+    right-angle rotation
+    """
+    index = MultiIndexHash(threshold)
+    pairs = {}
+    for key in sorted(hashes):
+        rotations = hashes[key]
+        for rotation in rotations:
+            for other, distance in index.search(rotation).items():
+                pair = (other, key)
+                pairs[pair] = min(distance, pairs.get(pair, distance))
+        index.add(rotations[0], key)
+    return [(a, b, distance) for (a, b), distance in sorted(pairs.items())]
+
+def connected_groups(keys, pairs):
+    """
+    {key: group} where group is the smallest key of its connected component of pairs
+    """
+    parent = {key: key for key in keys}
+
+    def find(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    for a, b, *_ in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    return {key: find(key) for key in keys}
+
+class DatasetRecord:
+    """
+    One JSONL record: the split (file) it belongs to, its line number and byte offset, and
+    the keys of the images it references
+    """
+    __slots__ = ("split", "line_number", "offset", "image_keys")
+
+    def __init__(self, split, line_number, offset, image_keys):
+        self.split = split
+        self.line_number = line_number
+        self.offset = offset
+        self.image_keys = image_keys
+
+def load_records(jsonl_paths, repo_root=REPO_ROOT):
+    """
+    Records of every file (labelled by its path) and {image key: source} for all referenced
+    images. Only line offsets and image keys are kept: inline images are decoded once for
+    their key and read again by the hashing workers (see InlineImage). URLs that are neither
+    repository images nor data URLs are counted and reported.
+    """
+    records = []
+    sources = {}
+    unresolved = 0
+    for jsonl_path in jsonl_paths:
+        index = JsonlIndex(jsonl_path)
+        with open(jsonl_path, "rb") as f:
+            for position in range(len(index)):
+                line_number = index.line_numbers[position]
+                try:
+                    record = loads(index.read_line(position, f))
+                except ValueError as e:
+                    print(f"{jsonl_path}:{line_number}: malformed JSON line skipped ({e})")
+                    continue
+                image_keys = []
+                for url_index, (_, _, image_url) in enumerate(iter_image_urls(record)):
+                    key, source = image_key(image_url, repo_root)
+                    if key is None:
+                        unresolved += 1
+                        continue
+                    if isinstance(source, bytes):
+                        source = InlineImage(jsonl_path, index.offsets[position], url_index)
+                    sources.setdefault(key, source)
+                    image_keys.append(key)
+                records.append(DatasetRecord(jsonl_path, line_number, index.offsets[position], image_keys))
+    if unresolved:
+        print(f"{unresolved} image URLs are neither local repository images nor data URLs and were not checked")
+    return records, sources
+
+def record_groups(records, image_groups):
+    """
+    Group of every record: records sharing a near-duplicate image end up in the same group.
+    Records without a checked image form a group of their own.
+    """
+    record_keys = [f"record:{index}" for index in range(len(records))]
+    pairs = []
+    for record_key, record in zip(record_keys, records):
+        pairs.extend((record_key, "image:" + image_groups[key]) for key in record.image_keys if key in image_groups)
+    image_nodes = {"image:" + group for group in image_groups.values()}
+    groups = connected_groups(record_keys + sorted(image_nodes), pairs)
+    return [groups[record_key] for record_key in record_keys]
+
+def _describe(key, repo_root=REPO_ROOT):
+    if key.startswith("sha256:"):
+        return f"inline image {key[7:19]}"
+    return os.path.relpath(key, repo_root)
+
+def _print_limited(lines, limit):
+    for line in lines[:limit]:
+        print("  " + line)
+    if len(lines) > limit:
+        print(f"  (+{len(lines) - limit} more)")
+
+def duplicate_report(records, pairs, groups, repo_root=REPO_ROOT, limit=REPORT_LIMIT):
+    """
+    Print the near-duplicate clusters, and the clusters referenced from more than one split
+    (leakage). Returns the number of leaked records: records of a split that share a cluster
+    with a record of another split.
+    """
+    clusters = {}
+    for key, group in groups.items():
+        clusters.setdefault(group, []).append(key)
+    duplicates = [sorted(members) for members in clusters.values() if len(members) > 1]
+    print(f"{len(groups)} images, {len(pairs)} near-duplicate pairs in {len(duplicates)} clusters")
+    _print_limited([" ~ ".join(_describe(key, repo_root) for key in members) for members in sorted(duplicates)], limit)
+
+    splits_by_group = {}
+    for record in records:
+        for key in record.image_keys:
+            if key in groups:
+                splits_by_group.setdefault(groups[key], {}).setdefault(record.split, []).append(record.line_number)
+    leaked_groups = {group: splits for group, splits in splits_by_group.items() if len(splits) > 1}
+    leaked_records = sum(len(lines) for splits in leaked_groups.values() for lines in splits.values())
+    if leaked_groups:
+        print(f"Cross-split leakage: {len(leaked_groups)} image clusters in more than one file ({leaked_records} records)")
+        entries = []
+        for group in sorted(leaked_groups):
+            where = "; ".join(f"{split} lines {', '.join(map(str, lines))}" for split, lines in sorted(leaked_groups[group].items()))
+            entries.append(f"{_describe(group, repo_root)}: {where}")
+        _print_limited(entries, limit)
+    elif len({record.split for record in records}) > 1:
+        print("No cross-split leakage")
+    return leaked_records
+
+def group_split(groups, validation_fraction, seed=None):
+    """
+    (train_positions, validation_positions) over records with the given groups, with whole
+    groups assigned to one side; validation takes shuffled groups until it holds
+    validation_fraction of the records
+    """
+    members = {}
+    for position, group in enumerate(groups):
+        members.setdefault(group, []).append(position)
+    ordered = sorted(members)
+    random.Random(seed).shuffle(ordered)
+    target = round(len(groups) * validation_fraction)
+    train, validation = [], []
+    for group in ordered:
+        # A group larger than the whole target may still seed an empty validation side
+        fits = len(validation) + len(members[group]) <= target or (not validation and target > 0)
+        (validation if fits else train).extend(members[group])
+    return sorted(train), sorted(validation)
+
+def write_records(records, positions, output_path):
+    """
+    Copy the lines of the records at `positions` to a new JSONL file, read back by offset
+    """
+    files = {}
+    try:
+        with open(output_path, "wb") as output:
+            for position in positions:
+                record = records[position]
+                source = files.get(record.split)
+                if source is None:
+                    source = files[record.split] = open(record.split, "rb")
+                source.seek(record.offset)
+                output.write(source.readline().rstrip(b"\r\n") + b"\n")
+    finally:
+        for source in files.values():
+            source.close()
+    return len(positions)
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate images and train/val leakage across JSONL datasets")
+    parser.add_argument("datasets", nargs="+", help="JSONL files to check (e.g. TRAIN_DATASET.jsonl VAL_DATASET.jsonl)")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD, help="Largest Hamming distance (of 64 bits) between near-duplicates")
+    parser.add_argument("--cache", default=os.path.join(REPO_ROOT, HASH_CACHE_FILENAME), help="Perceptual hash cache file")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to all cores)")
+    parser.add_argument("--validation_fraction", type=float, default=None, help="Write a group-aware split of all records to <output_prefix>_train.jsonl and _val.jsonl")
+    parser.add_argument("--output_prefix", default=None, help="Prefix of the split files (defaults to the first dataset without .jsonl)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the split")
+    parser.add_argument("--show", type=int, default=REPORT_LIMIT, help="Clusters to list per section of the report")
+
+    args = parser.parse_args()
+
+    records, sources = load_records(args.datasets)
+    hashes = hash_images(sources, HashCache(args.cache), args.workers)
+    pairs = near_duplicate_pairs(hashes, args.threshold)
+    groups = connected_groups(list(hashes), pairs)
+    duplicate_report(records, pairs, groups, limit=args.show)
+
+    if args.validation_fraction is not None:
+        train_positions, validation_positions = group_split(record_groups(records, groups), args.validation_fraction, args.seed)
+        prefix = args.output_prefix or os.path.splitext(args.datasets[0])[0]
+        for suffix, positions in (("train", train_positions), ("val", validation_positions)):
+            output_path = f"{prefix}_{suffix}.jsonl"
+            write_records(records, positions, output_path)
+            print(f"Wrote {len(positions)} records to {output_path}")
+
+if __name__ == "__main__":
+    main()
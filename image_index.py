@@ -0,0 +1,138 @@
+import json
+import os
+
+INDEX_FILENAME = ".image_index.json"
+INDEX_VERSION = 1
+
+def filename_stem(filename):
+    """
+    Part of a filename before the first dot (the stem find_image_in_directory has always used)
+    """
+    return filename.split(".")[0]
+
+class ImageIndex:
+    """
+    In-memory filename index over a directory tree: exact name -> path and stem -> candidate
+    paths. The tree is scanned once; with an index_path the per-directory listings are
+    persisted, and refresh() only re-lists directories whose mtime changed.
+    """
+    def __init__(self, root, index_path=None):
+        self.root = os.path.abspath(root)
+        self.index_path = index_path
+        # directory (relative to root) -> {"mtime_ns": ..., "files": [...], "dirs": [...]}
+        self.directories = {}
+        self.ambiguous = {}
+        if index_path:
+            self._load()
+        self.refresh()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == INDEX_VERSION and data.get("root") == self.root:
+            self.directories = data.get("directories", {})
+
+    def save(self):
+        if not self.index_path:
+            return
+        # Written in place rather than through a renamed temporary file: replacing the file would
+        # change the mtime of its directory and force a re-listing on every run. A torn write
+        # only costs a full rescan next time.
+        try:
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "root": self.root, "directories": self.directories}, f)
+        except OSError as e:
+            print(f"Could not write image index {self.index_path}: {e}")
+
+    def refresh(self):
+        """
+        Bring the index up to date with the directory tree. Directories whose mtime is unchanged
+        keep their cached listing, so a refresh of an unchanged tree costs one stat per directory.
+        Returns the number of directories that had to be re-listed.
+        """
+        directories = {}
+        relisted = 0
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            path = os.path.join(self.root, relative) if relative else self.root
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            entry = self.directories.get(relative)
+            if entry is None or entry["mtime_ns"] != mtime_ns:
+                entry = self._list_directory(path, mtime_ns)
+                relisted += 1
+            directories[relative] = entry
+            pending.extend(os.path.join(relative, name) if relative else name for name in entry["dirs"])
+
+        self.directories = directories
+        self._build_lookups()
+        if relisted:
+            self.save()
+        return relisted
+
+    def _list_directory(self, path, mtime_ns):
+        files, dirs = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif entry.name != INDEX_FILENAME:
+                        files.append(entry.name)
+        except OSError as e:
+            print(f"Could not list {path}: {e}")
+        return {"mtime_ns": mtime_ns, "files": sorted(files), "dirs": sorted(dirs)}
+
+    def _build_lookups(self):
+        # Shallow directories first, like the top-down os.walk this replaces
+        ordered = sorted(self.directories, key=lambda relative: (relative.count(os.sep) if relative else -1, relative))
+        self.by_name = {}
+        self.by_stem = {}
+        self.paths = []
+        for relative in ordered:
+            directory = os.path.join(self.root, relative) if relative else self.root
+            for name in self.directories[relative]["files"]:
+                path = os.path.join(directory, name)
+                self.paths.append((name, path))
+                self.by_name.setdefault(name, path)
+                self.by_stem.setdefault(filename_stem(name), []).append(path)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def candidates(self, filename):
+        """
+        Fuzzy candidates for a filename without an exact match: files with the same stem, or
+        failing that, files whose name contains the stem
+        """
+        stem = filename_stem(filename)
+        if stem in self.by_stem:
+            return list(self.by_stem[stem])
+        return [path for name, path in self.paths if stem in name]
+
+    def find(self, filename, strict=False):
+        """
+        Path of `filename` in the tree, or None. Without an exact match the fuzzy candidates are
+        used; when there are several, they are recorded in `ambiguous` and reported, and the first
+        (shallowest) one is returned, or None when strict.
+        """
+        path = self.by_name.get(filename)
+        if path is not None:
+            return path
+
+        candidates = self.candidates(filename)
+        if len(candidates) > 1:
+            if filename not in self.ambiguous:
+                self.ambiguous[filename] = candidates
+                shown = ", ".join(os.path.relpath(candidate, self.root) for candidate in candidates[:5])
+                more = f" (+{len(candidates) - 5} more)" if len(candidates) > 5 else ""
+                print(f"Ambiguous match for {filename}: {shown}{more}")
+            if strict:
+                return None
+        return candidates[0] if candidates else None
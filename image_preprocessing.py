@@ -0,0 +1,106 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+from functools import lru_cache
+from urllib.parse import unquote
+
+from PIL import Image, ImageOps
+
+# Root of this repository; GitHub URLs to files in it are served from here instead
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Matches github.com/<owner>/<repo>/blob|raw/<branch>/<path> and raw.githubusercontent.com URLs
+GITHUB_FILE_URL = re.compile(
+    r'^https?://(?:github\.com/[^/]+/[^/]+/(?:blob|raw)/[^/]+|raw\.githubusercontent\.com/[^/]+/[^/]+/[^/]+)/(?P<path>[^?#]+)'
+)
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+def resolve_local_image(image_url, repo_root=REPO_ROOT):
+    """
+    Map a GitHub URL of an image in this repository to the local file path.
+    Returns None for other URLs or when the file is not present locally.
+    """
+    match = GITHUB_FILE_URL.match(image_url)
+    if not match:
+        return None
+    relative_path = unquote(match.group("path"))
+    local_path = os.path.normpath(os.path.join(repo_root, *relative_path.split("/")))
+    # Never follow a URL outside of the repository tree
+    if os.path.commonpath([local_path, os.path.abspath(repo_root)]) != os.path.abspath(repo_root):
+        return None
+    return local_path if os.path.isfile(local_path) else None
+
+def image_key(image_url, repo_root=REPO_ROOT):
+    """
+    (key, source) for an image URL: the local path for repository images, or "sha256:<digest>"
+    and the decoded bytes for base64 data URLs. (None, None) for anything else.
+    """
+    if image_url.startswith("data:"):
+        header, _, payload = image_url.partition(",")
+        if not header.endswith(";base64"):
+            return None, None
+        try:
+            data = base64.b64decode(payload, validate=True)
+        except (binascii.Error, ValueError):
+            return None, None
+        return "sha256:" + hashlib.sha256(data).hexdigest(), data
+    local_path = resolve_local_image(image_url, repo_root)
+    return (local_path, local_path) if local_path else (None, None)
+
+def encode_image(image_path, max_side=1024, image_format="JPEG", quality=85):
+    """
+    Downscale an image so its longest side is at most max_side (None keeps the size),
+    re-encode it in image_format at the given quality and return the encoded bytes.
+    """
+    with Image.open(image_path) as img:
+        # Apply the EXIF orientation now, since the metadata is dropped on re-encoding
+        img = ImageOps.exif_transpose(img)
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image_format in ("JPEG", "WEBP") and img.mode != "RGB":
+            # Flatten transparency onto white, like the images are displayed
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+@lru_cache(maxsize=1024)
+def _encode_data_url(image_path, mtime_ns, file_size, max_side, image_format, quality):
+    # mtime_ns/file_size are only part of the memoization key, so edited files are re-encoded
+    data = encode_image(image_path, max_side, image_format, quality)
+    return bytes_to_data_url(data, MIME_TYPES[image_format])
+
+def bytes_to_data_url(data, mime_type):
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+def image_to_data_url(image_path, max_side=1024, image_format="JPEG", quality=85):
+    """
+    Return the preprocessed image as a base64 data URL, memoized by (path, mtime, settings)
+    """
+    stat = os.stat(image_path)
+    return _encode_data_url(
+        os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, max_side, image_format.upper(), quality
+    )
+
+def prepare_image_url(image_url, max_side=1024, image_format="JPEG", quality=85, repo_root=REPO_ROOT):
+    """
+    Replace a GitHub URL of a local repository image by an inline, recompressed data URL.
+    Any other URL (remote images, existing data URLs) is returned unchanged.
+    """
+    local_path = resolve_local_image(image_url, repo_root)
+    if local_path is None:
+        return image_url
+    return image_to_data_url(local_path, max_side, image_format, quality)
+
+def encoding_cache_info():
+    """
+    Hit/miss statistics of the encoded image memo
+    """
+    return _encode_data_url.cache_info()
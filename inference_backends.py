@@ -0,0 +1,245 @@
+import argparse
+import io
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from answer_parsing import MONTHS, DateParse, calculate_precision, extract_final_answer, parse_date
+from image_preprocessing import REPO_ROOT, image_key
+
+# Answer of a backend for one image: year and month (None when not read) and how sure the
+# backend is, in [0, 1]
+Prediction = namedtuple("Prediction", ["year", "month", "confidence"])
+
+DEFAULT_IMAGE_SIZE = 128
+DEFAULT_BATCH_SIZE = 64
+
+# How local answers are phrased; calculate_precision only matches like with like, so pick the
+# style of the dataset's labels (FULL_DATASET.jsonl is numeric, the zoomed datasets are named)
+ANSWER_FORMATS = ("named", "numeric")
+
+def format_answer(year, month, answer_format="named"):
+    """
+    Response text for a date: "Final Answer: March 2021 (2021-03)", or with
+    answer_format="numeric" "Final Answer: 03-2021"
+    """
+    if year and month and answer_format == "numeric":
+        return f"Final Answer: {month:02d}-{year}"
+    if year and month:
+        return f"Final Answer: {MONTHS[month - 1].capitalize()} {year} ({year}-{month:02d})"
+    if month:
+        return f"Final Answer: {MONTHS[month - 1].capitalize()}"
+    if year:
+        return f"Final Answer: {year}"
+    return "Final Answer: unknown"
+
+def read_grayscale(source, size=DEFAULT_IMAGE_SIZE):
+    """
+    Decode an image file path or encoded bytes to a size x size float32 array in [0, 1]
+    """
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        # Let JPEG decode at reduced scale; the image is downscaled anyway
+        img.draft("L", (size, size))
+        img = ImageOps.exif_transpose(img).convert("L")
+        img = img.resize((size, size), Image.Resampling.BILINEAR)
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+def load_grayscale(image_url, size=DEFAULT_IMAGE_SIZE, repo_root=REPO_ROOT):
+    """
+    read_grayscale for a repository image or base64 data URL, or None when the image is not
+    available locally
+    """
+    _, source = image_key(image_url, repo_root)
+    if source is None:
+        return None
+    try:
+        return read_grayscale(source, size)
+    except OSError:
+        return None
+
+class InferenceBackend:
+    """
+    Answers date-stamp images without the remote model. predict() returns one Prediction per
+    image URL, in order; images a backend cannot read get confidence 0.0.
+    """
+    name = "backend"
+
+    def predict(self, image_urls):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class LocalBackend(InferenceBackend):
+    """
+    In-process CPU backend around a batch predictor: a function that takes a float32 array of
+    shape (N, image_size, image_size) and returns N DateParse(year, month, confidence).
+    Images are decoded on a thread pool (PIL releases the GIL while decoding), and the next
+    batch is decoded while the predictor runs on the current one. month_only marks predictors
+    that never read the year.
+    """
+    def __init__(self, batch_predictor, name="local", image_size=DEFAULT_IMAGE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, decode_workers=None, repo_root=REPO_ROOT, month_only=False):
+        self.batch_predictor = batch_predictor
+        self.name = name
+        self.month_only = month_only
+        self.image_size = image_size
+        self.batch_size = batch_size
+        self.repo_root = repo_root
+        self.executor = ThreadPoolExecutor(max_workers=decode_workers or min(8, (os.cpu_count() or 1) + 1))
+
+    def _submit(self, image_urls):
+        return [self.executor.submit(load_grayscale, url, self.image_size, self.repo_root) for url in image_urls]
+
+    def predict(self, image_urls):
+        image_urls = list(image_urls)
+        predictions = []
+        pending = self._submit(image_urls[:self.batch_size])
+        for start in range(0, len(image_urls), self.batch_size):
+            images = [future.result() for future in pending]
+            pending = self._submit(image_urls[start + self.batch_size:start + 2 * self.batch_size])
+            readable = [image for image in images if image is not None]
+            dates = iter(self.batch_predictor(np.stack(readable)) if readable else [])
+            for image in images:
+                if image is None:
+                    predictions.append(Prediction(None, None, 0.0))
+                else:
+                    date = next(dates)
+                    predictions.append(Prediction(date.year, date.month, float(date.confidence)))
+        return predictions
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def onnx_classifier(model_path, labels_path=None):
+    """
+    Batch predictor for an ONNX image classifier (requires onnxruntime). The model takes a
+    float32 (N, 1, H, W) input in [0, 1] and returns (N, K) logits; labels_path lists the K
+    class labels, one date per line (e.g. "2021-03", or "03" for a month-only classifier),
+    defaulting to <model>.labels.txt. The confidence is the softmax probability of the label.
+    """
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("The ONNX backend requires onnxruntime: pip install onnxruntime")
+
+    labels_path = labels_path or os.path.splitext(model_path)[0] + ".labels.txt"
+    with open(labels_path, encoding="utf-8") as f:
+        labels = [line.strip() for line in f if line.strip()]
+    classes = [_label_date(label) for label in labels]
+    session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    def predict_batch(images):
+        logits = session.run(None, {input_name: images[:, None, :, :]})[0]
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        return [DateParse(classes[k].year, classes[k].month, float(probabilities[i, k])) for i, k in enumerate(best)]
+
+    return predict_batch
+
+def _label_date(label):
+    if label.isdigit() and 1 <= int(label) <= 12:
+        return DateParse(None, int(label), 1.0)
+    return parse_date(label)
+
+def dial_reader():
+    """
+    Batch predictor of date_stamp_decoder: reads the month from the arrow and number ring of
+    the dial, no model file needed
+    """
+    # Imported here: date_stamp_decoder imports this module
+    from date_stamp_decoder import predict_dates
+    return predict_dates
+
+# name -> factory(args) of the batch predictors the command line and run_tests can select
+BATCH_PREDICTORS = {
+    "dial": lambda args: dial_reader(),
+    "onnx": lambda args: onnx_classifier(args.model, args.labels),
+}
+
+# Batch predictors that read the month but not the year; every label of the datasets is a
+# complete date, so their answers can never replace an API call
+MONTH_ONLY_PREDICTORS = {"dial"}
+
+def add_backend_arguments(parser):
+    parser.add_argument("--backend", choices=sorted(BATCH_PREDICTORS), default=None, help="Local CPU backend: dial (classical dial reader, month only) or onnx (classifier model, needs --model)")
+    parser.add_argument("--model", default=None, help="Model file of the backend (onnx)")
+    parser.add_argument("--labels", default=None, help="Class labels of the ONNX model (default <model>.labels.txt)")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help="Images per forward pass")
+    parser.add_argument("--decode_workers", type=int, default=None, help="Threads decoding images")
+    parser.add_argument("--answer_format", choices=ANSWER_FORMATS, default="named", help="Phrasing of local answers: named (March 2021 (2021-03)) or numeric (03-2021), as the dataset's labels")
+
+def check_backend_arguments(parser, args, complete_dates=False):
+    """
+    Exit with a usage error for backend options that cannot work; with complete_dates, also
+    for month-only backends (answers that must match dated labels)
+    """
+    if args.backend == "onnx" and not args.model:
+        parser.error("--backend onnx needs --model (an ONNX classifier with its <model>.labels.txt)")
+    if complete_dates and args.backend in MONTH_ONLY_PREDICTORS:
+        parser.error(f"--backend {args.backend} reads the month only, so it cannot answer any test case in place of "
+                     f"the API; score it with inference_backends.py or date_stamp_decoder.py instead")
+
+def backend_from_args(args):
+    """
+    LocalBackend selected by add_backend_arguments' options, or None without --backend
+    """
+    if not args.backend:
+        return None
+    return LocalBackend(BATCH_PREDICTORS[args.backend](args), name=args.backend,
+                        batch_size=args.batch_size, decode_workers=args.decode_workers,
+                        month_only=args.backend in MONTH_ONLY_PREDICTORS)
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a local CPU backend on the images of a JSONL dataset")
+    parser.add_argument("--jsonl", required=True, help="JSONL file with the test cases")
+    parser.add_argument("--min_confidence", type=float, default=0.9, help="Report precision of the predictions at least this confident")
+    add_backend_arguments(parser)
+
+    args = parser.parse_args()
+    if not args.backend:
+        parser.error("--backend is required")
+    check_backend_arguments(parser, args)
+
+    # Imported here: test_prompts loads the API configuration at import time
+    from test_prompts import read_jsonl_data
+
+    test_cases = read_jsonl_data(args.jsonl)
+    with backend_from_args(args) as backend:
+        start = time.perf_counter()
+        predictions = backend.predict([test_case['image_url'] for test_case in test_cases])
+        seconds = time.perf_counter() - start
+
+    scores, months, confident = [], [], []
+    for prediction, test_case in zip(predictions, test_cases):
+        expected = test_case['expected_answer']
+        if not prediction.month and not prediction.year:
+            continue
+        score = calculate_precision(extract_final_answer(format_answer(prediction.year, prediction.month, args.answer_format)), expected)
+        scores.append(score)
+        months.append(prediction.month is not None and prediction.month == parse_date(expected).month)
+        if prediction.confidence >= args.min_confidence:
+            confident.append((score, months[-1]))
+    print(f"{len(test_cases)} images in {seconds:.2f}s ({len(test_cases) / seconds * 60 if seconds else 0:.0f} images/min), "
+          f"{len(scores)} readable")
+    if scores:
+        print(f"Mean precision: {sum(scores) / len(scores):.3f}, month right for {sum(months)}")
+    if confident:
+        print(f"Confidence >= {args.min_confidence}: {len(confident)} images, mean precision "
+              f"{sum(score for score, _ in confident) / len(confident):.3f}, month right for {sum(month for _, month in confident)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,25 @@
 import os
 import json
 import argparse
+import hashlib
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from PIL import Image
-import shutil
-from pathlib import Path
+from dataset_io import iter_jsonl_lines, iter_image_urls, with_image_url
+from image_index import ImageIndex, INDEX_FILENAME
+from augmentation_manifest import AugmentationManifest
+from augmentations import rotation_variants, load_variants, plan_variants, save_augmented, render_augmented
+from image_preprocessing import bytes_to_data_url
+
+# Filename indexes per images directory, built on first use
+_image_indexes = {}
+
+ROTATION_DEGREES = (90, 180, 270)
+
+# Dataset lines waiting for their augmented images before they are written (or yielded)
+MAX_PENDING_LINES = 256
 
 def rotate_image(image_path, output_dir, degrees):
     """Rotate an image by specified degrees and save to output directory."""
@@ -20,105 +36,291 @@ def rotate_image(image_path, output_dir, degrees):
     
     return rotated_filename
 
-def process_dataset(dataset_path, images_dir, output_dir):
-    """Process the dataset, rotate images, and create new dataset entries."""
+def _completed(fn, *args):
+    """Run fn inline and wrap the outcome in a Future, for runs without a process pool."""
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def _iter_image_references(dataset_path, image_index, strict_matching=False):
+    """Stream (line_number, line, data, [(content_index, image_url, image_path)]) for every dataset line."""
+    for line_number, line, data in iter_jsonl_lines(dataset_path):
+        references = []
+        
+        # Check if the line contains image references
+        if "messages" in data and len(data["messages"]) > 0:
+            user_message = data["messages"][0]
+            if "content" in user_message and isinstance(user_message["content"], list):
+                # Find image reference in the content
+                for i, content_item in enumerate(user_message["content"]):
+                    if content_item.get("type") == "image_url":
+                        image_url = content_item["image_url"]["url"]
+                        
+                        # Extract image filename from GitHub URL
+                        image_filename = image_url.split("/")[-1].split("?")[0]
+                        
+                        # Find the image in the images directory
+                        image_path = image_index.find(image_filename, strict=strict_matching)
+                        
+                        if image_path:
+                            references.append((i, image_url, image_path))
+        
+        yield line_number, line, data, references
+
+def _write_entries(write, line, data, references, augmented, variants):
+    write(line.strip() + "\n")  # Add original line to new dataset
+    for i, image_url, image_path in references:
+        augmented[image_path].result()  # Wait for the augmented files (and surface failures)
+        for variant in variants:
+            # Update the image URL in a copy of the original data
+            github_base_url = "/".join(image_url.split("/")[:-1])
+            new_url = f"{github_base_url}/{variant.name}/{variant.output_filename(image_path)}?raw=true"
+            augmented_data = with_image_url(data, 0, i, new_url)
+            
+            # Add the augmented data to the new dataset
+            write(json.dumps(augmented_data) + "\n")
+
+def process_dataset(dataset_path, images_dir, output_dir, strict_matching=False, workers=None, degrees_list=ROTATION_DEGREES, variants=None, seed=0):
+    """
+    Process the dataset, augment images, and create new dataset entries.
+    Without `variants` the images are rotated by each of degrees_list; otherwise every variant
+    (see augmentations.load_variants) is written to output_dir/<variant name>/. Random
+    parameters are drawn per image from `seed`, so runs are reproducible.
+    
+    Every image is decoded once for all variants; images are augmented in a process pool
+    (workers=1 works inline) while the output keeps the order of the input dataset.
+    
+    A manifest in output_dir records the source hash and parameters of every augmented file:
+    up-to-date files are skipped, files that are no longer produced are deleted,
+    and inflated_dataset.jsonl is only replaced when its content changes.
+    """
+    variants = variants or rotation_variants(degrees_list)
+    
+    # Scan the images directory once (or refresh the persisted index) instead of per image
+    image_index = get_image_index(images_dir)
+    
     # Create output directories
     os.makedirs(output_dir, exist_ok=True)
     
-    rotated_dirs = {}
-    for degree in [90, 180, 270]:
-        rotated_dirs[degree] = os.path.join(output_dir, f"{degree}_degrees")
-        os.makedirs(rotated_dirs[degree], exist_ok=True)
+    variant_dirs = {}
+    for variant in variants:
+        variant_dirs[variant.name] = os.path.join(output_dir, variant.name)
+        os.makedirs(variant_dirs[variant.name], exist_ok=True)
     
     # Create a new dataset file
     output_dataset_path = os.path.join(output_dir, "inflated_dataset.jsonl")
     
-    # Read the original dataset
-    with open(dataset_path, 'r', encoding="UTF-8") as f:
-        lines = f.readlines()
+    manifest = AugmentationManifest(output_dir)
+    
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    submit = executor.submit if executor else _completed
+    
+    # image path -> Future of the written paths; each image is augmented once
+    augmented = {}
+    # (image path, source hash, [(output_path, params)]) of the files being regenerated
+    regenerated = []
+    # (line, data, [(content_index, image_url, image_path)]) in input order
+    pending = deque()
+    
+    # Stream the original dataset into the new one; write to a temporary file first so the
+    # input may also be the output
+    temporary_path = output_dataset_path + ".tmp"
+    output_digest = hashlib.sha256()
+    
+    def write(text):
+        out.write(text)
+        output_digest.update(text.encode("utf-8"))
     
-    # Process each line in the dataset
-    new_dataset_lines = []
-    for line in lines:
-        if not line.strip():
-            continue
+    try:
+        with open(temporary_path, 'w', encoding="UTF-8") as out:
+            for _, line, data, references in _iter_image_references(dataset_path, image_index, strict_matching):
+                for _, _, image_path in references:
+                    if image_path in augmented:
+                        continue
+                    source_sha256 = manifest.source_hash(image_path)
+                    outdated = []
+                    for variant, steps in plan_variants(variants, image_path, seed):
+                        output_path = os.path.join(variant_dirs[variant.name], variant.output_filename(image_path))
+                        params = {"steps": steps}
+                        if not manifest.is_current(output_path, source_sha256, params):
+                            outdated.append((output_path, params))
+                    if outdated:
+                        jobs = [(output_path, params["steps"]) for output_path, params in outdated]
+                        augmented[image_path] = submit(save_augmented, image_path, jobs)
+                        regenerated.append((image_path, source_sha256, outdated))
+                    else:
+                        augmented[image_path] = _completed(list)
+                
+                pending.append((line, data, references))
+                # Write finished lines in order; block on the oldest one when too many are waiting
+                while pending and (len(pending) > MAX_PENDING_LINES or all(augmented[path].done() for _, _, path in pending[0][2])):
+                    _write_entries(write, *pending.popleft(), augmented, variants)
             
-        try:
-            data = json.loads(line)
-            new_dataset_lines.append(line.strip())  # Add original line to new dataset
+            while pending:
+                _write_entries(write, *pending.popleft(), augmented, variants)
+        
+        for image_path, source_sha256, outdated in regenerated:
+            augmented[image_path].result()
+            for output_path, params in outdated:
+                manifest.record(output_path, image_path, source_sha256, params)
+        
+        # Leave an unchanged dataset file (and its mtime) alone
+        previous = manifest.extra.get("inflated_dataset")
+        if previous and previous["sha256"] == output_digest.hexdigest() and _same_stat(output_dataset_path, previous):
+            dataset_changed = False
+        else:
+            os.replace(temporary_path, output_dataset_path)
+            stat = os.stat(output_dataset_path)
+            manifest.extra["inflated_dataset"] = {"sha256": output_digest.hexdigest(), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            dataset_changed = True
+        deleted = manifest.finish()
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    
+    written_count = sum(len(outdated) for _, _, outdated in regenerated)
+    print(f"Inflated dataset {'saved to' if dataset_changed else 'unchanged at'} {output_dataset_path}")
+    print(f"Augmented images saved to directories: {', '.join(variant_dirs.values())}")
+    print(f"{written_count} augmented images written, {len(augmented) * len(variants) - written_count} up to date, {deleted} stale removed")
+    if image_index.ambiguous:
+        skipped = " (skipped)" if strict_matching else " (first candidate used)"
+        print(f"{len(image_index.ambiguous)} image references had ambiguous matches{skipped}")
+    return len(augmented)
+
+def iter_augmented_dataset(dataset_path, images_dir, variants=None, seed=0, workers=None, strict_matching=False, image_format=None, prefetch=MAX_PENDING_LINES):
+    """
+    On-the-fly mode: yield (line_number, variant_name, record) for the original entries
+    (variant_name None) and their augmented copies, with the augmented images embedded as
+    data URLs. Images are rendered in a process pool at most `prefetch` lines ahead of the
+    consumer and are never written to disk. Same order and pixels as process_dataset.
+    """
+    variants = variants or rotation_variants()
+    image_index = get_image_index(images_dir)
+    
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    submit = executor.submit if executor else _completed
+    
+    pending = deque()
+    try:
+        for line_number, _, data, references in _iter_image_references(dataset_path, image_index, strict_matching):
+            futures = []
+            for i, image_url, image_path in references:
+                jobs = [(variant.name, steps) for variant, steps in plan_variants(variants, image_path, seed)]
+                futures.append((i, submit(render_augmented, image_path, jobs, image_format)))
+            pending.append((line_number, data, futures))
             
-            # Check if the line contains image references
-            if "messages" in data and len(data["messages"]) > 0:
-                user_message = data["messages"][0]
-                if "content" in user_message and isinstance(user_message["content"], list):
-                    # Find image reference in the content
-                    for i, content_item in enumerate(user_message["content"]):
-                        if content_item.get("type") == "image_url":
-                            image_url = content_item["image_url"]["url"]
-                            
-                            # Extract image filename from GitHub URL
-                            image_filename = image_url.split("/")[-1].split("?")[0]
-                            
-                            # Find the image in the images directory
-                            image_path = find_image_in_directory(images_dir, image_filename)
-                            
-                            if image_path:
-                                # Create rotated versions for each degree
-                                for degree in [90, 180, 270]:
-                                    # Create a deep copy of the original data
-                                    rotated_data = json.loads(line)
-                                    
-                                    # Rotate the image and get the new filename
-                                    rotated_filename = rotate_image(image_path, rotated_dirs[degree], degree)
-                                    
-                                    # Update the image URL in the rotated data
-                                    github_base_url = "/".join(image_url.split("/")[:-1])
-                                    new_url = f"{github_base_url}/{degree}_degrees/{rotated_filename}?raw=true"
-                                    
-                                    rotated_data["messages"][0]["content"][i]["image_url"]["url"] = new_url
-                                    
-                                    # Add the rotated data to the new dataset
-                                    new_dataset_lines.append(json.dumps(rotated_data))
-        except json.JSONDecodeError:
-            print(f"Error parsing line: {line}")
-            continue
-    
-    # Write the new dataset
-    with open(output_dataset_path, 'w', encoding="UTF-8") as f:
-        for line in new_dataset_lines:
-            f.write(line + "\n")
-    
-    print(f"Inflated dataset saved to {output_dataset_path}")
-    print(f"Rotated images saved to directories: {', '.join(rotated_dirs.values())}")
-
-def find_image_in_directory(directory, filename):
-    """Search for an image file in the directory."""
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file == filename:
-                return os.path.join(root, file)
+            while len(pending) > prefetch or (pending and not pending[0][2]):
+                yield from _augmented_records(*pending.popleft(), variants)
+        
+        while pending:
+            yield from _augmented_records(*pending.popleft(), variants)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+def _augmented_records(line_number, data, futures, variants):
+    yield line_number, None, data
+    for i, future in futures:
+        rendered = future.result()
+        for variant in variants:
+            image_bytes, mime_type = rendered[variant.name]
+            yield line_number, variant.name, with_image_url(data, 0, i, bytes_to_data_url(image_bytes, mime_type))
+
+def _same_stat(path, recorded):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return stat.st_size == recorded["size"] and stat.st_mtime_ns == recorded["mtime_ns"]
+
+def benchmark(dataset_path, images_dir, workers=None):
+    """
+    Compare images/sec of the previous approach (one Image.open + rotate per rotation,
+    single core) with the decode-once pipeline, writing into temporary directories.
+    """
+    image_index = get_image_index(images_dir)
+    image_paths = []
+    for _, _, data in iter_jsonl_lines(dataset_path):
+        for message_index, _, image_url in iter_image_urls(data):
+            image_path = image_index.find(image_url.split("/")[-1].split("?")[0]) if message_index == 0 else None
+            if image_path and image_path not in image_paths:
+                image_paths.append(image_path)
+    if not image_paths:
+        print("No images found for the benchmark")
+        return
     
-    # If exact match not found, try to find a similar filename
-    filename_base = filename.split(".")[0]
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if filename_base in file:
-                return os.path.join(root, file)
+    with tempfile.TemporaryDirectory() as before_dir:
+        start = time.perf_counter()
+        for image_path in image_paths:
+            for degree in ROTATION_DEGREES:
+                rotate_image(image_path, before_dir, degree)
+        before = len(image_paths) / (time.perf_counter() - start)
     
-    return None
+    with tempfile.TemporaryDirectory() as after_dir:
+        start = time.perf_counter()
+        count = process_dataset(dataset_path, images_dir, after_dir, workers=workers)
+        after = count / (time.perf_counter() - start)
+    
+    print(f"{len(image_paths)} images x {len(ROTATION_DEGREES)} rotations")
+    print(f"Before (decode per rotation, 1 core): {before:.1f} images/sec")
+    print(f"After (decode once, workers={workers or os.cpu_count() or 1}): {after:.1f} images/sec ({after / before:.2f}x)")
+
+def get_image_index(directory, index_path=None):
+    """Filename index of a directory, persisted next to the images and refreshed by mtime."""
+    key = os.path.abspath(directory)
+    image_index = _image_indexes.get(key)
+    if image_index is None:
+        image_index = ImageIndex(directory, index_path or os.path.join(directory, INDEX_FILENAME))
+        _image_indexes[key] = image_index
+    else:
+        image_index.refresh()
+    return image_index
+
+def find_image_in_directory(directory, filename, strict=False):
+    """Search for an image file in the directory."""
+    return get_image_index(directory).find(filename, strict=strict)
 
 def main():
-    parser = argparse.ArgumentParser(description="Inflate dataset with rotated images")
+    parser = argparse.ArgumentParser(description="Inflate dataset with rotated (or otherwise augmented) images")
     parser.add_argument("--dataset", required=True, help="Path to the original JSONL dataset")
     parser.add_argument("--images_dir", required=True, help="Directory containing the original images")
     parser.add_argument("--output_dir", default="inflated_dataset", help="Output directory for rotated images and new dataset")
+    parser.add_argument("--strict_matching", action="store_true", help="Skip image references with several fuzzy filename matches")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes for augmenting images (defaults to all cores)")
+    parser.add_argument("--benchmark", action="store_true", help="Measure images/sec of the old and new rotation paths instead of inflating")
+    parser.add_argument("--augmentations", default=None, help="JSON file with augmentation variants (defaults to the 90/180/270 rotations)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for randomized augmentation parameters (overrides the file's seed)")
+    parser.add_argument("--on_the_fly", action="store_true", help="Write <output_dir>/inflated_dataset.jsonl with inline data-URL images and no image files")
     
     args = parser.parse_args()
     
-    process_dataset(args.dataset, args.images_dir, args.output_dir)
+    if args.benchmark:
+        benchmark(args.dataset, args.images_dir, args.workers)
+        return
+    
+    variants, seed = load_variants(args.augmentations) if args.augmentations else (None, 0)
+    if args.seed is not None:
+        seed = args.seed
+    
+    if args.on_the_fly:
+        os.makedirs(args.output_dir, exist_ok=True)
+        output_dataset_path = os.path.join(args.output_dir, "inflated_dataset.jsonl")
+        count = 0
+        with open(output_dataset_path, 'w', encoding="UTF-8") as out:
+            for _, _, record in iter_augmented_dataset(args.dataset, args.images_dir, variants, seed, args.workers, args.strict_matching):
+                out.write(json.dumps(record) + "\n")
+                count += 1
+        print(f"Wrote {count} entries with inline images to {output_dataset_path}")
+        return
+    
+    process_dataset(args.dataset, args.images_dir, args.output_dir, args.strict_matching, args.workers, variants=variants, seed=seed)
 
 if __name__ == "__main__":
-    dataset = r"C:\Users\osabidi\finetuning-garanti\zoomed_injection_mold_date_data.jsonl"
-    images_dir = r"C:\Users\osabidi\finetuning-garanti\zoomed"
-    output_dir = r"C:\Users\osabidi\finetuning-garanti\output"
-    process_dataset(dataset, images_dir, images_dir)
\ No newline at end of file
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import threading
+import time
+
+from answer_parsing import calculate_precision, extract_final_answer
+from http_client import percentile
+from mock_server import MockChatServer, add_behaviour_arguments, behaviour_from_args
+
+DEFAULT_PROMPT = "What is the production date (MM/YYYY) of the injection mold date stamp in this image?"
+
+def _percentiles(values):
+    return {name: percentile(values, fraction) for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))}
+
+def run_level(test_prompts, test_cases, prompt_text, concurrency, request_count, max_retries=5, base_delay=0.1):
+    """
+    Send request_count requests (cycling through test_cases) through test_prompts'
+    request_completion and run_concurrently with `concurrency` requests in flight.
+    Returns throughput, end-to-end latency per request (including retries and backoff),
+    latency per HTTP call and the precision of the answers.
+    """
+    from async_runner import run_concurrently
+
+    # A fresh client per level, so its timings cover this level only
+    test_prompts.close_http_client()
+    test_prompts.get_http_client(concurrency)
+    items = list(range(request_count))
+    started, finished = {}, {}
+    lock = threading.Lock()
+
+    def request_item(index):
+        with lock:
+            started.setdefault(index, time.perf_counter())
+        test_case = test_cases[index % len(test_cases)]
+        return test_prompts.request_completion(prompt_text, test_case['image_url'])
+
+    def record(index, item, result):
+        finished[index] = time.perf_counter()
+
+    start = time.perf_counter()
+    results = run_concurrently(items, request_item, max_in_flight=concurrency, max_retries=max_retries,
+                               base_delay=base_delay, on_result=record)
+    wall = time.perf_counter() - start
+
+    completed = [(index, result) for index, result in zip(items, results) if isinstance(result, dict)]
+    precision = [
+        calculate_precision(extract_final_answer(result['response']), test_cases[index % len(test_cases)]['expected_answer'])
+        for index, result in completed
+    ]
+    calls = [timing.total for timing in test_prompts.get_http_client().timings]
+    return {
+        "concurrency": concurrency,
+        "requests": request_count,
+        "completed": len(completed),
+        "failed": request_count - len(completed),
+        "http_calls": len(calls),
+        "seconds": wall,
+        "throughput": len(completed) / wall if wall else 0.0,
+        "end_to_end": _percentiles([finished[index] - started[index] for index in items if index in finished and index in started]),
+        "per_call": _percentiles(calls),
+        "prompt_tokens": sum(result.get('prompt_tokens') or 0 for _, result in completed),
+        "completion_tokens": sum(result.get('completion_tokens') or 0 for _, result in completed),
+        "precision": sum(precision) / len(precision) if precision else None,
+    }
+
+def print_report(levels):
+    print(f"{'in flight':>9} {'done':>6} {'failed':>6} {'calls':>6} {'req/s':>7} "
+          f"{'e2e p50':>8} {'p95':>7} {'p99':>7} {'call p50':>9} {'p95':>7} {'p99':>7} {'precision':>9}")
+    for level in levels:
+        e2e, call = level["end_to_end"], level["per_call"]
+        precision = f"{level['precision']:.3f}" if level["precision"] is not None else "-"
+        print(f"{level['concurrency']:>9} {level['completed']:>6} {level['failed']:>6} {level['http_calls']:>6} "
+              f"{level['throughput']:>7.2f} {e2e['p50'] or 0:>7.3f}s {e2e['p95'] or 0:>6.3f}s {e2e['p99'] or 0:>6.3f}s "
+              f"{call['p50'] or 0:>8.3f}s {call['p95'] or 0:>6.3f}s {call['p99'] or 0:>6.3f}s {precision:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the evaluation client against the local mock (or any) chat completions endpoint")
+    parser.add_argument("--dataset", default="FULL_DATASET.jsonl", help="JSONL file with the test cases (images and expected answers)")
+    parser.add_argument("--concurrency", default="1,4,8,16", help="Comma-separated numbers of requests in flight to test")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="Prompt text sent with every image")
+    parser.add_argument("--url", default=None, help="Endpoint to test instead of starting the bundled mock")
+    parser.add_argument("--max_retries", type=int, default=5, help="Retries per request for 429/5xx responses")
+    parser.add_argument("--base_delay", type=float, default=0.1, help="Base backoff delay in seconds")
+    add_behaviour_arguments(parser)
+
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        if not args.labels:
+            args.labels = [args.dataset]
+        server = MockChatServer(behaviour_from_args(args))
+        url = server.start()
+        print(f"Mock endpoint at {url} (latency {args.latency}, {args.rate_limit_fraction:.0%} 429s, "
+              f"{args.server_error_fraction:.0%} 5xx)")
+
+    # Imported here: test_prompts reads its API configuration at import time
+    import test_prompts
+
+    test_prompts.API_URL = url
+    test_cases = test_prompts.read_jsonl_data(args.dataset)
+    # Encode the images once up front so the first level does not pay for it
+    for test_case in test_cases[:args.requests]:
+        test_prompts.prepare_request_image(test_case['image_url'])
+    levels = []
+    try:
+        for concurrency in (int(value) for value in args.concurrency.split(",")):
+            levels.append(run_level(test_prompts, test_cases, args.prompt, concurrency, args.requests,
+                                    args.max_retries, args.base_delay))
+    finally:
+        test_prompts.close_http_client()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    print_report(levels)
+    if server is not None:
+        stats = server.behaviour.snapshot()
+        print(f"Mock served {stats['requests']} requests {stats['status']}, "
+              f"{stats['prompt_tokens']} prompt + {stats['completion_tokens']} completion tokens, "
+              f"{stats['labelled']} answered from labels")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dataset_io import get_assistant_answer, get_image_url, iter_jsonl
+from image_preprocessing import prepare_image_url
+
+# Token cost of one image input, the same estimate test_prompts budgets with
+IMAGE_TOKENS = 765
+
+def parse_latency(spec):
+    """
+    Latency distribution from a spec string; returns a function rng -> seconds.
+        constant:0.5            always 0.5s
+        uniform:0.2,1.5         uniform between 0.2s and 1.5s
+        normal:0.8,0.2          normal (mean, sd), clipped at 0
+        lognormal:0.8,0.5       log-normal with median 0.8s and sigma 0.5 (heavy right tail)
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",")] if args else []
+    if kind == "constant" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal" and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Unknown latency spec {spec!r} (constant:S, uniform:LO,HI, normal:MEAN,SD or lognormal:MEDIAN,SIGMA)")
+
+def _url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+class LabelBook:
+    """
+    Expected answers of dataset JSONL files, looked up by the image URL of a request. Every
+    image is registered both by its dataset URL and by the inline data URL test_prompts sends
+    for repository images, so requests match whether or not images are inlined.
+    """
+    def __init__(self, jsonl_paths=(), inline_images=True):
+        self.answers = {}
+        self.labels = []
+        for jsonl_path in jsonl_paths:
+            for _, record in iter_jsonl(jsonl_path):
+                image_url, answer = get_image_url(record), get_assistant_answer(record)
+                if not image_url or not answer:
+                    continue
+                self.labels.append(answer)
+                self.answers[_url_key(image_url)] = answer
+                if inline_images:
+                    self.answers.setdefault(_url_key(prepare_image_url(image_url)), answer)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def answer(self, image_url):
+        return self.answers.get(_url_key(image_url)) if image_url else None
+
+class MockBehaviour:
+    """
+    How the mock endpoint answers: latency, injected failures, a requests/min limit and the
+    answer text. Answers come from the LabelBook (with probability `accuracy` the true label,
+    otherwise another label), or `canned_answer` for unknown images.
+    """
+    def __init__(self, latency="lognormal:0.8,0.4", seconds_per_token=0.0, rate_limit_fraction=0.0,
+                 server_error_fraction=0.0, retry_after=1.0, requests_per_minute=None,
+                 labels=None, accuracy=1.0, canned_answer="Final Answer: 01-2020", seed=None):
+        self.latency = parse_latency(latency)
+        self.seconds_per_token = seconds_per_token
+        self.rate_limit_fraction = rate_limit_fraction
+        self.server_error_fraction = server_error_fraction
+        self.retry_after = retry_after
+        self.requests_per_minute = requests_per_minute
+        self.labels = labels or LabelBook()
+        self.accuracy = accuracy
+        self.canned_answer = canned_answer
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window = []
+        self.stats = {"requests": 0, "status": {}, "prompt_tokens": 0, "completion_tokens": 0, "labelled": 0}
+
+    def _count(self, status, prompt_tokens=0, completion_tokens=0, labelled=False):
+        with self.lock:
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+            self.stats["labelled"] += labelled
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, status=dict(self.stats["status"]))
+
+    def _throttled(self):
+        """
+        True when the request exceeds requests_per_minute over the last 60 seconds
+        """
+        if not self.requests_per_minute:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            self.window = [t for t in self.window if now - t < 60.0]
+            if len(self.window) >= self.requests_per_minute:
+                return True
+            self.window.append(now)
+            return False
+
+    def respond(self, payload):
+        """
+        (status, headers, body) for one chat completions request; sleeps for the drawn latency
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            number = self.stats["requests"]
+            roll, latency, correct = self.rng.random(), self.latency(self.rng), self.rng.random() < self.accuracy
+            other = self.rng.choice(self.labels.labels) if self.labels.labels else self.canned_answer
+
+        if self._throttled() or roll < self.rate_limit_fraction:
+            self._count(429)
+            # Azure sends both; Retry-After only has whole seconds
+            return 429, {"retry-after-ms": str(int(self.retry_after * 1000)),
+                         "Retry-After": str(math.ceil(self.retry_after))}, \
+                {"error": {"code": "429", "message": "Rate limit exceeded (mock)"}}
+        if roll < self.rate_limit_fraction + self.server_error_fraction:
+            time.sleep(latency / 2)
+            status = (500, 502, 503)[number % 3]
+            self._count(status)
+            return status, {}, {"error": {"code": str(status), "message": "Injected server error (mock)"}}
+
+        text_chars, images, image_url = 0, 0, None
+        for message in payload.get("messages", []):
+            content = message.get("content")
+            for item in content if isinstance(content, list) else [{"type": "text", "text": content or ""}]:
+                if item.get("type") == "text":
+                    text_chars += len(item.get("text") or "")
+                elif item.get("type") == "image_url":
+                    images += 1
+                    image_url = (item.get("image_url") or {}).get("url")
+        label = self.labels.answer(image_url)
+        answer = (label if correct else other) if label is not None else self.canned_answer
+
+        finish_reason = "stop"
+        max_tokens = payload.get("max_tokens")
+        if max_tokens and len(answer) > max_tokens * 4:
+            answer, finish_reason = answer[:max_tokens * 4], "length"
+        prompt_tokens = math.ceil(text_chars / 4) + images * IMAGE_TOKENS
+        completion_tokens = max(1, math.ceil(len(answer) / 4))
+
+        time.sleep(latency + completion_tokens * self.seconds_per_token)
+        self._count(200, prompt_tokens, completion_tokens, label is not None)
+        return 200, {}, {
+            "id": f"chatcmpl-mock-{number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoint
+
+    def _send(self, status, headers, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.split("?", 1)[0].endswith("/chat/completions"):
+            self._send(404, {}, {"error": {"code": "404", "message": f"No such endpoint {self.path}"}})
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._send(400, {}, {"error": {"code": "400", "message": "Request body is not JSON"}})
+            return
+        self._send(*self.server.behaviour.respond(payload))
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] == "/stats":
+            self._send(200, {}, self.server.behaviour.snapshot())
+        else:
+            self._send(404, {}, {"error": {"code": "404", "message": f"No such endpoint {self.path}"}})
+
+    def log_message(self, format, *args):
+        pass
+
+class MockChatServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the chat completions endpoint. Accepts both the Azure
+    (/openai/deployments/<name>/chat/completions?api-version=...) and the OpenAI
+    (/v1/chat/completions) paths; GET /stats returns the request and token counters.
+    """
+    daemon_threads = True
+
+    def __init__(self, behaviour, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.behaviour = behaviour
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/openai/deployments/mock/chat/completions?api-version=mock"
+
+    def start(self):
+        """
+        Serve from a background thread; returns the chat completions URL
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.url
+
+def add_behaviour_arguments(parser):
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="Latency distribution (see parse_latency)")
+    parser.add_argument("--seconds_per_token", type=float, default=0.0, help="Extra latency per completion token")
+    parser.add_argument("--rate_limit_fraction", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--server_error_fraction", type=float, default=0.0, help="Share of requests answered with 500/502/503")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After (seconds) sent with 429 responses")
+    parser.add_argument("--server_requests_per_minute", type=float, default=None, help="Answer 429 above this many requests per minute")
+    parser.add_argument("--labels", nargs="*", default=[], help="Dataset JSONL files whose expected answers are returned for their images")
+    parser.add_argument("--accuracy", type=float, default=1.0, help="Probability of answering with the true label")
+    parser.add_argument("--answer", default="Final Answer: 01-2020", help="Answer for images without a label")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latencies, failures and wrong answers")
+
+def behaviour_from_args(args):
+    labels = LabelBook(args.labels)
+    if args.labels:
+        print(f"Mock answers: {len(labels)} labelled images from {', '.join(args.labels)}")
+    return MockBehaviour(
+        latency=args.latency,
+        seconds_per_token=args.seconds_per_token,
+        rate_limit_fraction=args.rate_limit_fraction,
+        server_error_fraction=args.server_error_fraction,
+        retry_after=args.retry_after,
+        requests_per_minute=args.server_requests_per_minute,
+        labels=labels,
+        accuracy=args.accuracy,
+        canned_answer=args.answer,
+        seed=args.seed,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible chat completions mock for offline testing")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    add_behaviour_arguments(parser)
+
+    args = parser.parse_args()
+
+    server = MockChatServer(behaviour_from_args(args), args.host, args.port)
+    print(f"Mock chat completions endpoint: {server.url}")
+    print(f"Point test_prompts at it with CHAT_COMPLETIONS_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.behaviour.snapshot()))
+
+if __name__ == "__main__":
+    main()
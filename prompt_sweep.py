@@ -0,0 +1,233 @@
+import argparse
+import math
+import os
+import random
+from collections import namedtuple
+from statistics import NormalDist
+
+import test_prompts
+from async_runner import run_concurrently
+from results_journal import ResultsJournal, latest_records
+
+# Mean precision of a prompt over the cases scored so far, with its confidence interval
+PromptStats = namedtuple("PromptStats", ["prompt_id", "cases", "mean", "lower", "upper"])
+
+def wilson_interval(total, count, z):
+    """
+    Wilson score interval for the mean of `count` scores in [0, 1] that sum to `total`. Also
+    valid for the 0.5 partial scores: a score in [0, 1] with mean m has variance at most m(1 - m).
+    """
+    if count == 0:
+        return 0.0, 1.0
+    mean = total / count
+    denominator = 1 + z * z / count
+    center = (mean + z * z / (2 * count)) / denominator
+    half = z / denominator * math.sqrt(mean * (1 - mean) / count + z * z / (4 * count * count))
+    return max(0.0, center - half), min(1.0, center + half)
+
+def round_sizes(case_count, initial_cases=20, growth=2.0):
+    """
+    Test cases evaluated by the end of each round: initial_cases, growing by `growth` per round
+    up to all cases
+    """
+    sizes = []
+    size = max(1, initial_cases)
+    while size < case_count:
+        sizes.append(size)
+        size = max(size + 1, math.ceil(size * growth))
+    sizes.append(case_count)
+    return sizes
+
+def prompt_stats(prompt_id, scores, z):
+    lower, upper = wilson_interval(sum(scores), len(scores), z)
+    return PromptStats(prompt_id, len(scores), sum(scores) / len(scores) if scores else 0.0, lower, upper)
+
+def eliminate(stats, round_number, keep_fraction=None):
+    """
+    {prompt_id: reason} of the prompts to drop after a round. A prompt is dropped when the
+    upper bound of its interval is below the lower bound of the leader (highest mean); with
+    keep_fraction, successive halving also drops all but the best keep_fraction of the rest
+    by mean.
+    """
+    leader = max(stats, key=lambda s: (s.mean, s.lower))
+    dropped = {}
+    for s in stats:
+        if s is not leader and s.upper < leader.lower:
+            dropped[s.prompt_id] = (f"round {round_number} ({s.cases} cases): upper bound {s.upper:.3f} < lower bound "
+                                    f"{leader.lower:.3f} of leader {leader.prompt_id} (mean {leader.mean:.3f})")
+    if keep_fraction:
+        survivors = sorted((s for s in stats if s.prompt_id not in dropped), key=lambda s: (-s.mean, -s.lower))
+        keep = max(1, math.ceil(len(survivors) * keep_fraction))
+        for rank, s in enumerate(survivors[keep:], start=keep + 1):
+            dropped[s.prompt_id] = (f"round {round_number} ({s.cases} cases): successive halving, mean {s.mean:.3f} "
+                                    f"ranked {rank} of {len(survivors)} (kept {keep})")
+    return dropped
+
+def run_sweep(excel_file_path, jsonl_file_path, initial_cases=20, growth=2.0, confidence=0.95,
+              keep_fraction=None, seed=0, max_in_flight=test_prompts.MAX_IN_FLIGHT,
+              requests_per_minute=test_prompts.REQUESTS_PER_MINUTE, tokens_per_minute=test_prompts.TOKENS_PER_MINUTE,
+              cache_path=test_prompts.RESPONSE_CACHE_PATH, journal_path=None, resume=False, results_path=None):
+    """
+    Compare the prompts of the workbook in rounds instead of on the full matrix. Every round
+    evaluates the prompts still in the race on a larger prefix of one seeded random order of
+    the test cases (round_sizes), so the cases of earlier rounds are reused; then the prompts
+    whose confidence interval on mean precision lies entirely below the leader's are
+    eliminated (see eliminate). The confidence level holds for all prompts together
+    (Bonferroni). The sweep ends when one prompt is left or all test cases are used.
+
+    Pairs are journaled, cached and written to the workbook like in run_tests, so a sweep
+    can be resumed, and `test_prompts --resume` can complete the matrix for the survivors.
+    Failed calls are left out of the statistics. Returns {prompt_id: (PromptStats, reason)}
+    with reason None for the prompts never eliminated.
+    """
+    prompt_df, _ = test_prompts.read_excel_prompts(excel_file_path)
+    test_cases = test_prompts.read_jsonl_data(jsonl_file_path)
+    pairs = test_prompts.build_pairs(prompt_df, test_cases)
+    prompt_ids = list(dict.fromkeys(pair[1] for pair in pairs))
+    dataset = os.path.basename(jsonl_file_path)
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / (2 * max(1, len(prompt_ids))))
+    sizes = round_sizes(len(test_cases), initial_cases, growth)
+    order = random.Random(seed).sample(range(len(test_cases)), len(test_cases))
+    print(f"Sweeping {len(prompt_ids)} prompts over {len(test_cases)} test cases in rounds of "
+          f"{', '.join(str(size) for size in sizes)} cases ({confidence:.0%} confidence)")
+
+    # Scores by pair position; pairs are prompt-major, so prompt p / case i is pairs[p * n + i]
+    scores = {}
+    journal_path = journal_path or test_prompts.default_journal_path(excel_file_path)
+    if resume:
+        position = {pair[0]: index for index, pair in enumerate(pairs)}
+        for key, record in latest_records(journal_path).items():
+            if key in position and not record.get('error'):
+                scores[position[key]] = record['precision']
+        print(f"Resuming from {journal_path}: {len(scores)} pairs already scored")
+
+    journal = ResultsJournal(journal_path, resume=resume)
+    cache = test_prompts.open_response_cache(cache_path)
+
+    def score_pair(index, response):
+        record = test_prompts.score_response(pairs[index], response, len(test_cases), dataset)
+        journal.append(record)
+        if not record['error']:
+            scores[index] = record['precision']
+
+    def request_pair(index):
+        _, _, prompt_text, _, test_case = pairs[index]
+        return test_prompts.request_and_cache(prompt_text, test_case['image_url'], cache)
+
+    test_prompts.get_http_client(max_in_flight)
+    active = list(range(len(prompt_ids)))
+    outcome = {}
+    calls = cached = 0
+    try:
+        for round_number, size in enumerate(sizes, start=1):
+            subset = order[:size]
+            pending = []
+            for p in active:
+                for i in subset:
+                    index = p * len(test_cases) + i
+                    if index in scores:
+                        continue
+                    _, _, prompt_text, _, test_case = pairs[index]
+                    response = cache.get(test_prompts.response_cache_key(prompt_text, test_case['image_url'])) if cache else None
+                    if response is not None:
+                        score_pair(index, response)
+                        cached += 1
+                    else:
+                        pending.append(index)
+            run_concurrently(
+                pending,
+                request_pair,
+                max_in_flight=max_in_flight,
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=tokens_per_minute,
+                token_estimator=lambda index: test_prompts.estimate_request_tokens(pairs[index][2]),
+                on_result=lambda n, index, response: score_pair(index, response),
+            )
+            calls += len(pending)
+
+            stats = []
+            for p in active:
+                values = [scores[p * len(test_cases) + i] for i in subset if p * len(test_cases) + i in scores]
+                stats.append(prompt_stats(prompt_ids[p], values, z))
+            dropped = eliminate(stats, round_number, keep_fraction if size < len(test_cases) else None)
+            for p, s in zip(active, stats):
+                outcome[prompt_ids[p]] = (s, dropped.get(prompt_ids[p]))
+            active = [p for p in active if prompt_ids[p] not in dropped]
+            leader = max(stats, key=lambda s: (s.mean, s.lower))
+            print(f"Round {round_number}: {size} cases, {len(pending)} API calls; leader {leader.prompt_id} "
+                  f"mean {leader.mean:.3f} [{leader.lower:.3f}, {leader.upper:.3f}]; "
+                  f"{len(dropped)} eliminated, {len(active)} left")
+            if len(active) <= 1:
+                break
+    finally:
+        journal.close()
+        if cache is not None:
+            cache.close()
+
+    test_prompts.write_results_from_journal(excel_file_path, prompt_df, pairs, journal_path, results_path)
+    print(f"{calls} API calls and {cached} cache hits for {calls + cached} pairs: "
+          f"{(calls + cached) / len(pairs) if pairs else 0:.0%} of the full matrix of {len(pairs)}")
+    return outcome
+
+def print_sweep_report(outcome, confidence=0.95):
+    """
+    Prompts ranked by how far they got and their mean precision, with why each was eliminated
+    """
+    ranked = sorted(outcome.values(), key=lambda item: (item[1] is not None, -item[0].cases, -item[0].mean))
+    best = ranked[0][0] if ranked else None
+    print(f"\n{'prompt':>8} {'cases':>6} {'mean':>6} {f'{confidence:.0%} interval':>16}  outcome")
+    for s, reason in ranked:
+        if reason is not None:
+            status = f"eliminated in {reason}"
+        elif s is best:
+            status = "best"
+        else:
+            status = f"not separated from {best.prompt_id}: upper bound {s.upper:.3f} >= its lower bound {best.lower:.3f}"
+        print(f"{s.prompt_id!s:>8} {s.cases:>6} {s.mean:>6.3f} {f'[{s.lower:.3f}, {s.upper:.3f}]':>16}  {status}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the workbook's prompts in rounds, eliminating clearly worse prompts early")
+    parser.add_argument("--excel", required=True, help="Excel file with the prompts and results sheets")
+    parser.add_argument("--jsonl", required=True, help="JSONL file with the test cases")
+    parser.add_argument("--initial_cases", type=int, default=20, help="Test cases per prompt in the first round")
+    parser.add_argument("--growth", type=float, default=2.0, help="Factor by which the test cases grow per round")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level of the intervals, for all prompts together")
+    parser.add_argument("--keep_fraction", type=float, default=None, help="Also keep only this share of the prompts per round (successive halving)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random order of the test cases")
+    parser.add_argument("--max_in_flight", type=int, default=test_prompts.MAX_IN_FLIGHT, help="Maximum number of concurrent API requests")
+    parser.add_argument("--requests_per_minute", type=float, default=test_prompts.REQUESTS_PER_MINUTE, help="Request rate limit")
+    parser.add_argument("--tokens_per_minute", type=float, default=test_prompts.TOKENS_PER_MINUTE, help="Token rate limit")
+    parser.add_argument("--no_cache", action="store_true", help="Do not read or write the response cache")
+    parser.add_argument("--journal", help="Results journal file (defaults to <excel>.journal.jsonl)")
+    parser.add_argument("--results", help="Long-format results file (defaults to <excel>.results.parquet)")
+    parser.add_argument("--resume", action="store_true", help="Reuse the pairs already scored in the journal")
+    parser.add_argument("--api_url", default=None, help="Chat completions URL to call instead of the Azure deployment (e.g. mock_server.py); responses are cached per URL")
+
+    args = parser.parse_args()
+
+    if args.api_url:
+        test_prompts.API_URL = args.api_url
+
+    try:
+        outcome = run_sweep(
+            args.excel,
+            args.jsonl,
+            initial_cases=args.initial_cases,
+            growth=args.growth,
+            confidence=args.confidence,
+            keep_fraction=args.keep_fraction,
+            seed=args.seed,
+            max_in_flight=args.max_in_flight,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            cache_path=None if args.no_cache else test_prompts.RESPONSE_CACHE_PATH,
+            journal_path=args.journal,
+            resume=args.resume,
+            results_path=args.results,
+        )
+    finally:
+        test_prompts.close_http_client()
+    print_sweep_report(outcome, args.confidence)
+
+if __name__ == "__main__":
+    main()
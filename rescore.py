@@ -0,0 +1,150 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from answer_parsing import extract_batch, score_batch
+from results_journal import latest_records
+from results_store import results_frame, load_results, save_results, pivot_results
+
+def load_from_journal(journal_path):
+    """
+    Long-format results (with raw responses) from a run_tests journal, last record per pair
+    """
+    return results_frame(latest_records(journal_path).values())
+
+def load_from_cache(cache_path, excel_file_path, jsonl_file_path):
+    """
+    Long-format results rebuilt from the response cache for the prompts and test cases
+    of an Excel/JSONL pair. Pairs without a cached response are left out.
+    """
+    # Imported here: test_prompts reads its API configuration at import time
+    import test_prompts
+
+    prompt_df, _ = test_prompts.read_excel_prompts(excel_file_path)
+    test_cases = test_prompts.read_jsonl_data(jsonl_file_path)
+    cache = test_prompts.open_response_cache(cache_path)
+    records = []
+    try:
+        for _, prompt_row in prompt_df.iterrows():
+            for i, test_case in enumerate(test_cases):
+                response = cache.get(test_prompts.response_cache_key(prompt_row['Prompt'], test_case['image_url']))
+                if response is None:
+                    continue
+                records.append({
+                    'prompt_id': prompt_row['ID'],
+                    'case_index': i,
+                    'image_url': test_case['image_url'],
+                    'response': response,
+                    'expected': test_case['expected_answer'],
+                })
+    finally:
+        cache.close()
+    print(f"Found cached responses for {len(records)} of {len(prompt_df) * len(test_cases)} pairs")
+    return results_frame(records)
+
+def _rescore_chunk(chunk):
+    responses, expected = chunk
+    extracted = extract_batch(responses)
+    return extracted, score_batch(extracted, expected)
+
+def rescore(results_df, workers=None, chunk_size=5000):
+    """
+    Re-extract and re-score every stored response, spreading chunks of rows over a process pool.
+    Returns a copy of results_df with new `extracted` and `precision` columns; the stored
+    scores are kept as `previous_precision`.
+    """
+    results_df = results_df.copy()
+    results_df['previous_precision'] = results_df['precision']
+    responses = [value if isinstance(value, str) else "" for value in results_df['response']]
+    expected = list(results_df['expected'])
+    chunks = [
+        (responses[start:start + chunk_size], expected[start:start + chunk_size])
+        for start in range(0, len(responses), chunk_size)
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) <= 1:
+        outputs = [_rescore_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            outputs = list(executor.map(_rescore_chunk, chunks))
+
+    results_df['extracted'] = [value for extracted, _ in outputs for value in extracted]
+    results_df['precision'] = np.concatenate([scores for _, scores in outputs]) if outputs else []
+    return results_df
+
+def metrics_table(results_df):
+    """
+    Per-prompt metrics: number of tests, mean precision, full/partial/no matches and how many
+    scores changed compared to the stored ones
+    """
+    previous = pd.to_numeric(results_df['previous_precision'], errors='coerce')
+    frame = pd.DataFrame({
+        'prompt_id': results_df['prompt_id'],
+        'precision': results_df['precision'].astype(float),
+        'full': results_df['precision'] == 1.0,
+        'partial': results_df['precision'] == 0.5,
+        'none': results_df['precision'] == 0.0,
+        'changed': previous.notna() & (previous != results_df['precision']),
+        'delta': results_df['precision'] - previous,
+    })
+    table = frame.groupby('prompt_id').agg(
+        tests=('precision', 'size'),
+        mean_precision=('precision', 'mean'),
+        full_matches=('full', 'sum'),
+        partial_matches=('partial', 'sum'),
+        misses=('none', 'sum'),
+        changed=('changed', 'sum'),
+        mean_delta=('delta', 'mean'),
+    )
+    return table.sort_values('mean_precision', ascending=False)
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-extract and re-score stored responses without calling the API")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--journal", help="run_tests journal file (<excel>.journal.jsonl)")
+    source.add_argument("--results", help="Long-format results file (<excel>.results.parquet)")
+    source.add_argument("--cache", help="Response cache file; needs --excel and --jsonl")
+    parser.add_argument("--excel", help="Excel file with the prompts; with --update_excel its result sheet is rewritten")
+    parser.add_argument("--jsonl", help="JSONL file with the test cases (for --cache)")
+    parser.add_argument("--output", help="Write the re-scored long-format results to this Parquet file")
+    parser.add_argument("--metrics_csv", help="Write the per-prompt metrics table to this CSV file")
+    parser.add_argument("--update_excel", action="store_true", help="Write the re-scored results to the Excel result sheet")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (defaults to all cores)")
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.journal:
+        results_df = load_from_journal(args.journal)
+    elif args.results:
+        results_df = load_results(args.results)
+    else:
+        if not args.excel or not args.jsonl:
+            parser.error("--cache needs --excel and --jsonl")
+        results_df = load_from_cache(args.cache, args.excel, args.jsonl)
+
+    rescored_df = rescore(results_df, workers=args.workers)
+    table = metrics_table(rescored_df)
+    print(table.to_string())
+    print(f"Re-scored {len(rescored_df)} responses in {time.perf_counter() - start:.2f}s")
+
+    if args.output:
+        save_results(rescored_df.drop(columns=['previous_precision']), args.output)
+        print(f"Re-scored results written to {args.output}")
+    if args.metrics_csv:
+        table.to_csv(args.metrics_csv)
+        print(f"Metrics written to {args.metrics_csv}")
+    if args.update_excel:
+        if not args.excel:
+            parser.error("--update_excel needs --excel")
+        import test_prompts
+        prompt_df, _ = test_prompts.read_excel_prompts(args.excel)
+        test_prompts.update_excel_results(args.excel, pivot_results(rescored_df, prompt_df['ID']))
+
+if __name__ == "__main__":
+    main()
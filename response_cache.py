@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Share by which a limit may be exceeded before put() evicts, so eviction (a scan of the
+# whole table) runs once per that many inserts instead of on every insert
+EVICTION_SLACK = 0.1
+
+def make_cache_key(prompt_text, image, model_name, api_version, max_tokens, endpoint):
+    """
+    Build a content-addressed key for one API call.
+    `image` is either the raw image bytes or the image URL/data URL string; `endpoint` is the
+    URL the call goes to (for Azure it names the deployment), so answers of one model or
+    server are never served for another.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([prompt_text, model_name, api_version, max_tokens, endpoint]).encode("utf-8"))
+    digest.update(b"\0")
+    if isinstance(image, bytes):
+        digest.update(b"bytes:")
+        digest.update(image)
+    else:
+        digest.update(b"url:")
+        digest.update(str(image).encode("utf-8"))
+    return digest.hexdigest()
+
+class ResponseCache:
+    """
+    On-disk SQLite cache of assistant responses, keyed by `make_cache_key`.
+
+    Entries older than `max_age_seconds` are treated as misses and purged, and once the
+    cache holds more than `max_entries` entries or `max_bytes` of response text by more than
+    EVICTION_SLACK the least recently used entries are evicted down to the limits. Any limit
+    may be None to disable it.
+    """
+    def __init__(self, path, max_entries=None, max_bytes=None, max_age_seconds=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Entry count and size as of the last eviction plus our own writes since
+        self.entry_count = 0
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.connection.commit()
+        self.evict()
+
+    def get(self, key):
+        """
+        Return the cached response for `key`, or None on a miss.
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response, created_at, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age_seconds is not None and now - row[1] > self.max_age_seconds:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                self.evictions += 1
+                self.entry_count -= 1
+                self.total_bytes -= row[2]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        """
+        Store `response` under `key`, evicting once a size limit is exceeded by the slack.
+        """
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            previous = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self.connection.commit()
+            if previous is None:
+                self.entry_count += 1
+            self.total_bytes += size - (previous[0] if previous else 0)
+            over_limit = (
+                (self.max_entries is not None
+                 and self.entry_count > self.max_entries + max(1, int(self.max_entries * EVICTION_SLACK)))
+                or (self.max_bytes is not None and self.total_bytes > self.max_bytes * (1 + EVICTION_SLACK))
+            )
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop expired entries, then least recently used entries until the cache fits its limits.
+        """
+        with self.lock:
+            removed = 0
+            if self.max_age_seconds is not None:
+                cursor = self.connection.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+                )
+                removed += cursor.rowcount
+            if self.max_entries is not None:
+                cursor = self.connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                removed += cursor.rowcount
+            if self.max_bytes is not None:
+                total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    rows = self.connection.execute(
+                        "SELECT key, size FROM responses ORDER BY accessed_at ASC"
+                    ).fetchall()
+                    stale = []
+                    for key, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self.connection.executemany("DELETE FROM responses WHERE key = ?", stale)
+                    removed += len(stale)
+            self.connection.commit()
+            self.evictions += removed
+            # Resynchronised here, so writes by other processes sharing the file are picked up
+            self.entry_count, self.total_bytes = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            return removed
+
+    def stats(self):
+        """
+        Return hit/miss/eviction counters along with the current entry count and size.
+        """
+        with self.lock:
+            entries, size = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+
+class ResultsJournal:
+    """
+    Append-only JSONL journal of completed prompt x test case results.
+
+    Records are buffered and written in batches: the buffer is flushed and fsync'd once it
+    holds `flush_every` records or `fsync_interval` seconds have passed since the last sync,
+    and always on close(). A crash loses at most the records of one interval.
+    """
+    def __init__(self, path, resume=True, flush_every=50, fsync_interval=5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.fsync_interval = fsync_interval
+        self.buffer = []
+        self.last_sync = time.monotonic()
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if resume:
+            _truncate_partial_line(path)
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def append(self, record):
+        with self.lock:
+            self.buffer.append(json.dumps(record))
+            if len(self.buffer) >= self.flush_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+                self._flush_locked()
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self._flush_locked()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _truncate_partial_line(path):
+    """
+    Drop a trailing record that was only partially written when a previous run was killed
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the last complete line
+        position = size - 1
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                f.truncate(position - step + newline + 1)
+                return
+            position -= step
+        f.truncate(0)
+
+def read_journal(path):
+    """
+    Stream the records of a journal file. Unreadable lines are reported and skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable journal line {line_number} in {path}")
+
+def latest_records(path, key="pair_key"):
+    """
+    Return {record[key]: record} keeping the last record written for every key
+    """
+    records = {}
+    for record in read_journal(path):
+        records[record[key]] = record
+    return records
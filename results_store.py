@@ -0,0 +1,71 @@
+import pandas as pd
+
+# One row per prompt x test case result (long format)
+RESULT_COLUMNS = [
+    "prompt_id",
+    "case_index",
+    "image_url",
+    "response",
+    "extracted",
+    "expected",
+    "precision",
+    "latency",
+    "prompt_tokens",
+    "completion_tokens",
+    "text_bytes",
+    "image_bytes",
+    "payload_bytes",
+    "backend",
+    "dataset",
+]
+
+def results_frame(records):
+    """
+    Build a long-format results DataFrame from an iterable of result dicts.
+    Values are gathered column by column, so no row-wise DataFrame updates are needed.
+    Missing fields become None.
+    """
+    columns = {column: [] for column in RESULT_COLUMNS}
+    for record in records:
+        for column in RESULT_COLUMNS:
+            columns[column].append(record.get(column))
+    return pd.DataFrame(columns, columns=RESULT_COLUMNS)
+
+def save_results(results_df, results_path):
+    """
+    Persist a long-format results DataFrame as Parquet (requires pyarrow)
+    """
+    results_df.to_parquet(results_path, index=False)
+
+def load_results(results_path):
+    """
+    Load a results DataFrame saved with save_results
+    """
+    return pd.read_parquet(results_path)
+
+def pivot_results(results_df, prompt_ids):
+    """
+    Wide view for the Excel sheet: one row per prompt ID (in the given order) with
+    Result_i / Precision_i column pairs for every test case that has a result. When some
+    results were answered by a local backend, a Backend_i column after each pair names the
+    backend of every result ("remote" for the API).
+    """
+    result_df = pd.DataFrame({"ID": list(prompt_ids)})
+    if results_df.empty:
+        return result_df
+
+    latest = results_df.drop_duplicates(["prompt_id", "case_index"], keep="last")
+    extracted = latest.pivot(index="prompt_id", columns="case_index", values="extracted")
+    precision = latest.pivot(index="prompt_id", columns="case_index", values="precision")
+    backends = latest["backend"].fillna("remote")
+    backend = None
+    if (backends != "remote").any():
+        backend = latest.assign(backend=backends).pivot(index="prompt_id", columns="case_index", values="backend")
+
+    columns = {}
+    for case_index in sorted(extracted.columns):
+        columns[f"Result_{case_index+1}"] = result_df["ID"].map(extracted[case_index])
+        columns[f"Precision_{case_index+1}"] = result_df["ID"].map(precision[case_index])
+        if backend is not None:
+            columns[f"Backend_{case_index+1}"] = result_df["ID"].map(backend[case_index])
+    return pd.concat([result_df, pd.DataFrame(columns)], axis=1)
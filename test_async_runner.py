@@ -0,0 +1,67 @@
+import pytest
+
+from async_runner import get_retry_after, run_concurrently
+from mock_server import MockBehaviour, MockChatServer
+import test_prompts
+
+class EchoBehaviour(MockBehaviour):
+    """
+    Mock that answers with the prompt text and records how many requests it handles at once
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def respond(self, payload):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            status, headers, body = super().respond(payload)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        if status == 200:
+            body["choices"][0]["message"]["content"] = payload["messages"][0]["content"][0]["text"]
+        return status, headers, body
+
+@pytest.fixture
+def server(monkeypatch):
+    behaviour = EchoBehaviour(latency="constant:0.05", rate_limit_fraction=0.3, retry_after=0.05, seed=7)
+    server = MockChatServer(behaviour)
+    monkeypatch.setattr(test_prompts, "API_URL", server.start())
+    yield server
+    test_prompts.close_http_client()
+    server.shutdown()
+    server.server_close()
+
+def test_throttled_requests_are_retried_in_order_within_the_concurrency_cap(server):
+    items = list(range(40))
+    test_prompts.get_http_client(4)
+    results = run_concurrently(
+        items,
+        lambda i: test_prompts.request_completion(f"item {i}", "https://example.com/stamp.png"),
+        max_in_flight=4,
+        max_retries=10,
+        base_delay=0.01,
+    )
+
+    stats = server.behaviour.snapshot()
+    assert stats["status"].get("429", 0) > 0
+    assert stats["status"]["200"] == len(items)
+    assert [result["response"] for result in results] == [f"item {i}" for i in items]
+    assert 2 <= server.behaviour.max_in_flight <= 4
+
+def test_retry_after_headers():
+    class Response:
+        def __init__(self, headers):
+            self.headers = headers
+
+    class Error(Exception):
+        def __init__(self, headers):
+            self.response = Response(headers)
+
+    assert get_retry_after(Error({"retry-after-ms": "250", "Retry-After": "1"})) == 0.25
+    assert get_retry_after(Error({"Retry-After": "3"})) == 3.0
+    assert get_retry_after(Exception()) is None
@@ -0,0 +1,18 @@
+from PIL import Image
+
+from augmentations import plan_variants, render_augmented, rotation_variants, save_augmented
+
+def test_rendered_jpeg_matches_the_materialized_file(tmp_path):
+    source = tmp_path / "stamp.jpg"
+    Image.effect_noise((64, 48), 40).convert("RGB").save(source, quality=95)
+    variants = plan_variants(rotation_variants(), str(source), seed=0)
+
+    written = save_augmented(str(source), [(str(tmp_path / variant.output_filename(str(source))), steps)
+                                           for variant, steps in variants])
+    rendered = render_augmented(str(source), [(variant.name, steps) for variant, steps in variants])
+
+    for path, (variant, _) in zip(written, variants):
+        data, mime_type = rendered[variant.name]
+        assert mime_type == "image/jpeg"
+        with open(path, "rb") as f:
+            assert f.read() == data
@@ -0,0 +1,83 @@
+import base64
+import io
+import json
+import random
+from collections import Counter
+
+from PIL import Image, ImageDraw
+
+from dataset_splitter import SplitPlan, near_duplicate_record_pairs, write_split
+
+def record(image_url, year, month):
+    return {"messages": [
+        {"role": "user", "content": [{"type": "text", "text": "Date?"}, {"type": "image_url", "image_url": {"url": image_url}}]},
+        {"role": "assistant", "content": f"Final Answer: {month:02d}-{year} ({year}-{month:02d})"},
+    ]}
+
+def write_dataset(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for item in records:
+            f.write(json.dumps(item) + "\n")
+    return str(path)
+
+def photo_url(part, copy):
+    return f"https://github.com/owner/repo/blob/main/FULL_CROPPED/{part} ({copy}).jpeg?raw=true"
+
+def shapes_data_url(seed, rotate=0):
+    rng = random.Random(seed)
+    img = Image.new("L", (64, 64), 128)
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x, y = rng.randint(0, 48), rng.randint(0, 48)
+        draw.rectangle([x, y, x + rng.randint(8, 16), y + rng.randint(8, 16)], fill=rng.choice((0, 255)))
+    buffer = io.BytesIO()
+    img.rotate(rotate).save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def test_groups_stay_on_one_side_and_strata_keep_their_share(tmp_path):
+    rng = random.Random(0)
+    records = []
+    # 4 strata of 60 parts each, with 1 to 3 photos per part
+    for stratum, (year, month) in enumerate([(2020, 1), (2021, 6), (2022, 11), (2023, 3)]):
+        for part in range(60):
+            part_id = f"{500000 + stratum * 100 + part}-1-{part % 5}"
+            records.extend(record(photo_url(part_id, copy), year, month) for copy in range(rng.randint(1, 3)))
+    rng.shuffle(records)
+    jsonl_path = write_dataset(tmp_path / "dataset.jsonl", records)
+
+    plan = SplitPlan(jsonl_path)
+    assert len(plan) == len(records)
+    assert len(plan.groups) == 240
+    sides = plan.assign(0.2, seed=1)
+
+    sides_by_group = {}
+    for group, side in zip(plan.record_groups, sides):
+        sides_by_group.setdefault(group, set()).add(side)
+    assert all(len(group_sides) == 1 for group_sides in sides_by_group.values())
+
+    totals = Counter(plan.record_strata)
+    validation = Counter(stratum for stratum, side in zip(plan.record_strata, sides) if side)
+    assert abs(sum(sides) - 0.2 * len(records)) <= 3
+    for stratum, total in totals.items():
+        assert abs(validation[stratum] / total - 0.2) < 0.05
+
+    train_count, validation_count = write_split(jsonl_path, plan.line_numbers, sides,
+                                                str(tmp_path / "train.jsonl"), str(tmp_path / "val.jsonl"))
+    assert (train_count, validation_count) == (len(records) - sum(sides), sum(sides))
+
+def test_near_duplicates_under_different_groups_are_merged(tmp_path):
+    records = [record(shapes_data_url(seed), 2021, 3) for seed in range(6)]
+    # A rotated copy of the first image: its own group by line, but the same photo
+    records.append(record(shapes_data_url(0, rotate=90), 2021, 3))
+    jsonl_path = write_dataset(tmp_path / "dataset.jsonl", records)
+
+    plan = SplitPlan(jsonl_path)
+    assert len(set(plan.record_groups)) == 7
+    pairs = near_duplicate_record_pairs(plan, threshold=6, cache_path=str(tmp_path / "hashes.json"), workers=1)
+    assert pairs == [(0, 6)]
+    plan.merge_groups(pairs)
+    assert len(set(plan.record_groups)) == 6
+    assert plan.record_groups[0] == plan.record_groups[6]
+    for seed in range(5):
+        sides = plan.assign(0.5, seed)
+        assert sides[0] == sides[6]
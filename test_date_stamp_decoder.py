@@ -0,0 +1,54 @@
+import importlib
+import io
+import os
+import random
+
+import numpy as np
+import pytest
+from PIL import ImageFont
+
+import date_stamp_decoder
+from inference_backends import read_grayscale
+
+GENERATOR_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "IM_simulated")
+
+@pytest.fixture
+def generator(monkeypatch):
+    monkeypatch.syspath_prepend(GENERATOR_FOLDER)
+    return importlib.import_module("IM_date_generator")
+
+def render_batch(generator, count, seed, **render_kwargs):
+    """
+    (N, DECODE_SIZE, DECODE_SIZE) dials of every month at seeded random rotations, and their months
+    """
+    images, months = [], []
+    for index in range(count):
+        month = index % 12 + 1
+        img = generator.draw_injection_mold_date(2020 + index % 5, month, rng=random.Random(seed * 1000 + index),
+                                                 **render_kwargs)
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        images.append(read_grayscale(buffer.getvalue(), date_stamp_decoder.DECODE_SIZE))
+        months.append(month)
+    return np.stack(images), np.array(months)
+
+def test_reads_the_month_of_generated_dials(generator):
+    if not isinstance(generator.load_font(20), ImageFont.FreeTypeFont):
+        pytest.skip("Pillow without a scalable default font draws no legible month numbers")
+    images, months = render_batch(generator, 48, seed=3)
+    readings = date_stamp_decoder.decode_batch(images)
+    read = np.array([reading.month for reading in readings])
+    confidence = np.array([reading.confidence for reading in readings])
+
+    assert np.mean(read == months) >= 0.9
+    confident = confidence >= 0.5
+    assert confident.sum() >= len(images) // 5
+    assert np.all(read[confident] == months[confident])
+
+def test_illegible_month_numbers_are_not_confident(generator, monkeypatch):
+    # The unsized bitmap font draws the month numbers as specks: the arrow alone cannot give the month
+    monkeypatch.setattr(generator, "load_font", lambda size: ImageFont.load_default_imagefont()
+                        if hasattr(ImageFont, "load_default_imagefont") else ImageFont.load_default())
+    images, _ = render_batch(generator, 12, seed=4, use_cache=False)
+    readings = date_stamp_decoder.decode_batch(images)
+    assert max(reading.confidence for reading in readings) < 0.5
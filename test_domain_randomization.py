@@ -0,0 +1,21 @@
+import importlib
+import os
+import random
+
+import pytest
+
+import augmentations
+
+GENERATOR_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "IM_simulated")
+
+@pytest.fixture
+def domain_randomization(monkeypatch):
+    monkeypatch.syspath_prepend(GENERATOR_FOLDER)
+    return importlib.import_module("domain_randomization")
+
+def test_specs_resolve_like_the_augmentation_configs(domain_randomization):
+    specs = list(domain_randomization.DEFAULT_DISTRIBUTIONS.values()) + [[0.5, 2], {"choice": [1, "a"]}, "fixed"]
+    for spec in specs:
+        for seed in range(5):
+            assert domain_randomization.resolve_value(spec, random.Random(seed)) == \
+                augmentations.resolve_value(spec, random.Random(seed))
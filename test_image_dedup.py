@@ -0,0 +1,86 @@
+import base64
+import io
+import json
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from image_dedup import (MultiIndexHash, connected_groups, duplicate_report, hamming, hash_images, load_records,
+                         near_duplicate_pairs, write_records)
+
+def flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+@pytest.mark.parametrize("radius", [0, 3, 6, 9])
+def test_multi_index_hash_matches_brute_force(radius):
+    rng = random.Random(radius)
+    stored = [rng.getrandbits(64) for _ in range(300)]
+    # Near copies at every distance around the radius, so both sides of the boundary are probed
+    stored += [flip_bits(rng.choice(stored), rng.randint(0, radius + 3), rng) for _ in range(300)]
+    index = MultiIndexHash(radius)
+    for item, value in enumerate(stored):
+        index.add(value, item)
+
+    for value in stored[:100] + [flip_bits(value, radius, rng) for value in stored[:100]]:
+        expected = {item: hamming(value, other) for item, other in enumerate(stored) if hamming(value, other) <= radius}
+        assert index.search(value) == expected
+
+def test_near_duplicate_pairs_include_rotated_copies():
+    rng = random.Random(1)
+    original = [rng.getrandbits(64) for _ in range(4)]
+    # The same image turned by 90 degrees: its first hash is the original's second
+    rotated = original[1:] + original[:1]
+    unrelated = [rng.getrandbits(64) for _ in range(4)]
+    close = [flip_bits(value, 2, rng) for value in original]
+    hashes = {"a": original, "b": rotated, "c": unrelated, "d": close}
+    pairs = {(a, b): distance for a, b, distance in near_duplicate_pairs(hashes, threshold=6)}
+    assert pairs == {("a", "b"): 0, ("a", "d"): 2, ("b", "d"): 2}
+
+def test_connected_groups_are_labelled_by_their_smallest_key():
+    keys = ["e", "d", "c", "b", "a", "f"]
+    groups = connected_groups(keys, [("e", "d", 1), ("c", "d", 0), ("a", "b", 2)])
+    assert groups == {"c": "c", "d": "c", "e": "c", "a": "a", "b": "a", "f": "f"}
+
+def data_url(seed, rotate=0):
+    rng = random.Random(seed)
+    img = Image.new("L", (64, 64), 128)
+    draw = ImageDraw.Draw(img)
+    for _ in range(6):
+        x, y = rng.randint(0, 48), rng.randint(0, 48)
+        draw.rectangle([x, y, x + rng.randint(8, 16), y + rng.randint(8, 16)], fill=rng.choice((0, 255)))
+    buffer = io.BytesIO()
+    img.rotate(rotate).save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def write_dataset(path, urls):
+    with open(path, "w", encoding="utf-8") as f:
+        for url in urls:
+            f.write(json.dumps({"messages": [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": url}}]},
+                                             {"role": "assistant", "content": "Final Answer: 03-2021"}]}) + "\n")
+
+def test_leakage_across_splits_is_counted_and_lines_are_copied_by_offset(tmp_path):
+    train, validation = str(tmp_path / "train.jsonl"), str(tmp_path / "val.jsonl")
+    write_dataset(train, [data_url(0), data_url(1), data_url(2)])
+    # A rotated copy of train's first image leaks into the validation split
+    write_dataset(validation, [data_url(0, rotate=90), data_url(3)])
+
+    records, sources = load_records([train, validation])
+    assert [(record.split, record.line_number) for record in records] == [
+        (train, 1), (train, 2), (train, 3), (validation, 1), (validation, 2)]
+    hashes = hash_images(sources, workers=1)
+    assert len(hashes) == 5
+    pairs = near_duplicate_pairs(hashes)
+    groups = connected_groups(list(hashes), pairs)
+    assert duplicate_report(records, pairs, groups) == 2
+
+    output = str(tmp_path / "subset.jsonl")
+    write_records(records, [3, 0], output)
+    with open(validation, encoding="utf-8") as f:
+        first_validation = f.readline()
+    with open(train, encoding="utf-8") as f:
+        first_train = f.readline()
+    with open(output, encoding="utf-8") as f:
+        assert f.read() == first_validation + first_train
@@ -0,0 +1,82 @@
+import base64
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+
+import test_prompts
+from answer_parsing import DateParse
+from inference_backends import LocalBackend
+from results_journal import latest_records
+
+CASES = 8
+ANSWER = "Final Answer: March 2021 (2021-03)"
+
+def grey_data_url(level):
+    buffer = io.BytesIO()
+    Image.new("L", (32, 32), level).save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def stub_predictor(images):
+    """
+    Image i is filled with grey level 20 * i: even images are read confidently, odd ones not
+    """
+    cases = np.rint(images.mean(axis=(1, 2)) * 255 / 20).astype(int)
+    return [DateParse(2021, 3, 0.95 if case % 2 == 0 else 0.5) for case in cases]
+
+@pytest.fixture
+def workbook(tmp_path):
+    excel_path = str(tmp_path / "prompts.xlsx")
+    with pd.ExcelWriter(excel_path) as writer:
+        pd.DataFrame({"ID": [1, 2], "Prompt": ["first prompt", "second prompt"]}).to_excel(
+            writer, sheet_name="Prompts - Input Data", index=False)
+        pd.DataFrame({"ID": [1, 2]}).to_excel(writer, sheet_name="Prompts - Result Data", index=False)
+    jsonl_path = str(tmp_path / "cases.jsonl")
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for i in range(CASES):
+            f.write(json.dumps({"messages": [
+                {"role": "user", "content": [{"type": "text", "text": "Date?"},
+                                             {"type": "image_url", "image_url": {"url": grey_data_url(20 * i)}}]},
+                {"role": "assistant", "content": ANSWER},
+            ]}) + "\n")
+    return excel_path, jsonl_path
+
+def test_confident_complete_dates_skip_the_api(workbook, tmp_path, monkeypatch):
+    excel_path, jsonl_path = workbook
+    requested = []
+
+    def remote(prompt_text, image_url, cache=None):
+        requested.append((prompt_text, image_url))
+        return {"response": ANSWER}
+
+    monkeypatch.setattr(test_prompts, "request_and_cache", remote)
+    journal_path = str(tmp_path / "journal.jsonl")
+    try:
+        with LocalBackend(stub_predictor, name="stub", decode_workers=2) as backend:
+            test_prompts.run_tests(excel_path, jsonl_path, cache_path=None, journal_path=journal_path,
+                                   results_path=str(tmp_path / "results.parquet"), local_backend=backend,
+                                   requests_per_minute=None, tokens_per_minute=None)
+    finally:
+        test_prompts.close_http_client()
+
+    low_confidence = {grey_data_url(20 * i) for i in range(1, CASES, 2)}
+    assert {image_url for _, image_url in requested} == low_confidence
+    assert len(requested) == 2 * len(low_confidence)
+
+    records = list(latest_records(journal_path).values())
+    assert len(records) == 2 * CASES
+    local = [record for record in records if record["backend"] == "stub"]
+    assert len(local) == 2 * (CASES - len(low_confidence))
+    assert all(record["image_url"] not in low_confidence and record["precision"] == 1.0 for record in local)
+
+def test_month_only_backends_are_refused(workbook):
+    excel_path, jsonl_path = workbook
+    backend = LocalBackend(stub_predictor, name="months", month_only=True)
+    try:
+        with pytest.raises(ValueError, match="month only"):
+            test_prompts.run_tests(excel_path, jsonl_path, cache_path=None, local_backend=backend)
+    finally:
+        backend.close()
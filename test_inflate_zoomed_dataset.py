@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inflate_zoomed_dataset.py")
+
+def _record(filename):
+    return {"messages": [
+        {"role": "user", "content": [
+            {"type": "text", "text": "What is the date?"},
+            {"type": "image_url", "image_url": {"url": f"https://github.com/owner/repo/blob/main/zoomed/{filename}?raw=true"}},
+        ]},
+        {"role": "assistant", "content": "Final Answer: 03-2021"},
+    ]}
+
+@pytest.fixture
+def dataset(tmp_path):
+    images_dir = tmp_path / "images"
+    images_dir.mkdir()
+    # stamp.png matches exactly; part.jpeg only by stem, and ambiguously (part.jpg and part.png)
+    for name in ("stamp.png", "part.jpg", "part.png"):
+        Image.new("RGB", (8, 6), (200, 10, 10)).save(images_dir / name)
+    dataset_path = tmp_path / "dataset.jsonl"
+    dataset_path.write_text("".join(json.dumps(_record(name)) + "\n" for name in ("stamp.png", "part.jpeg")))
+    return dataset_path, images_dir
+
+def _inflate(dataset_path, images_dir, output_dir, *flags):
+    subprocess.run([sys.executable, SCRIPT, "--dataset", str(dataset_path), "--images_dir", str(images_dir),
+                    "--output_dir", str(output_dir), "--workers", "1", *flags], check=True, capture_output=True)
+    with open(output_dir / "inflated_dataset.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def _augmented_urls(records):
+    urls = [record["messages"][0]["content"][1]["image_url"]["url"] for record in records]
+    # Rotations go to <degrees>_degrees/<stem>_<degrees>.<ext>
+    return [url for url in urls if "_degrees/" in url]
+
+def test_lenient_matching_augments_the_first_ambiguous_candidate(dataset, tmp_path):
+    records = _inflate(*dataset, tmp_path / "lenient")
+    urls = _augmented_urls(records)
+    assert len(records) == 2 + 2 * 3
+    assert sum("stamp" in url for url in urls) == 3
+    assert sum("part" in url for url in urls) == 3
+
+def test_strict_matching_skips_ambiguous_references(dataset, tmp_path):
+    records = _inflate(*dataset, tmp_path / "strict", "--strict_matching")
+    urls = _augmented_urls(records)
+    assert len(records) == 2 + 3
+    assert sum("stamp" in url for url in urls) == 3
+    assert not any("part" in url for url in urls)
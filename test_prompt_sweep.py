@@ -0,0 +1,73 @@
+import json
+import random
+from statistics import NormalDist
+
+import pandas as pd
+import pytest
+
+import prompt_sweep
+import test_prompts
+
+# Accuracy of every simulated prompt
+ACCURACY = {1: 0.9, 2: 0.85, 3: 0.3, 4: 0.2}
+
+CASES = 160
+
+@pytest.fixture
+def sweep_files(tmp_path):
+    excel_path = str(tmp_path / "prompts.xlsx")
+    with pd.ExcelWriter(excel_path) as writer:
+        pd.DataFrame({"ID": list(ACCURACY), "Prompt": [f"Prompt {prompt_id}" for prompt_id in ACCURACY]}).to_excel(
+            writer, sheet_name="Prompts - Input Data", index=False)
+        pd.DataFrame({"ID": list(ACCURACY)}).to_excel(writer, sheet_name="Prompts - Result Data", index=False)
+    jsonl_path = str(tmp_path / "cases.jsonl")
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for i in range(CASES):
+            f.write(json.dumps({"messages": [
+                {"role": "user", "content": [{"type": "text", "text": "Date?"},
+                                             {"type": "image_url", "image_url": {"url": f"https://example.com/{i}.png"}}]},
+                {"role": "assistant", "content": "Final Answer: March 2021 (2021-03)"},
+            ]}) + "\n")
+    return excel_path, jsonl_path
+
+def simulated_request(prompt_text, image_url, cache=None):
+    """
+    Right with the accuracy of the prompt, the same way on every call for a pair
+    """
+    accuracy = ACCURACY[int(prompt_text.split()[-1])]
+    right = random.Random(prompt_text + image_url).random() < accuracy
+    return {"response": "Final Answer: March 2021 (2021-03)" if right else "Final Answer: January 1999 (1999-01)"}
+
+def test_worse_prompts_are_eliminated_and_the_leader_survives(sweep_files, tmp_path, monkeypatch):
+    excel_path, jsonl_path = sweep_files
+    monkeypatch.setattr(test_prompts, "request_and_cache", simulated_request)
+    try:
+        outcome = prompt_sweep.run_sweep(excel_path, jsonl_path, initial_cases=20, max_in_flight=16,
+                                         requests_per_minute=None, tokens_per_minute=None, cache_path=None,
+                                         journal_path=str(tmp_path / "journal.jsonl"),
+                                         results_path=str(tmp_path / "results.parquet"))
+        # The pool follows the requested concurrency instead of capping it at MAX_IN_FLIGHT
+        assert test_prompts.get_http_client().pool_size >= 16
+    finally:
+        test_prompts.close_http_client()
+
+    stats, reason = outcome[1]
+    assert reason is None
+    assert stats.mean == max(s.mean for s, _ in outcome.values())
+    for prompt_id in (3, 4):
+        stats, reason = outcome[prompt_id]
+        assert reason is not None
+        assert stats.cases < CASES
+
+@pytest.mark.parametrize("probabilities", [(0.5, 0.0, 0.5), (0.1, 0.1, 0.8), (0.9, 0.05, 0.05), (0.0, 1.0, 0.0), (0.02, 0.0, 0.98)])
+@pytest.mark.parametrize("count", [20, 80])
+def test_wilson_interval_covers_the_mean_of_partial_scores(probabilities, count):
+    mean = probabilities[1] * 0.5 + probabilities[2]
+    z = NormalDist().inv_cdf(0.975)
+    rng = random.Random(0)
+    covered = 0
+    for _ in range(1000):
+        scores = rng.choices([0.0, 0.5, 1.0], probabilities, k=count)
+        lower, upper = prompt_sweep.wilson_interval(sum(scores), count, z)
+        covered += lower <= mean <= upper
+    assert covered / 1000 >= 0.93
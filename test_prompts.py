@@ -1,11 +1,21 @@
 import pandas as pd
-import json
-import re
-import requests
 import os
-from time import sleep
+import argparse
+import threading
+import time
 from openpyxl import load_workbook
 from dotenv import load_dotenv
+from async_runner import run_concurrently
+from response_cache import ResponseCache, make_cache_key
+from http_client import ChatCompletionClient, REQUEST_EXCEPTIONS
+from image_preprocessing import prepare_image_url, encoding_cache_info
+from batch_mode import make_custom_id, parse_custom_id, request_digest, write_batch_requests, read_batch_results
+from results_journal import ResultsJournal, latest_records
+from results_store import results_frame, save_results, pivot_results
+from answer_parsing import extract_final_answer, calculate_precision
+from dataset_io import iter_jsonl, get_image_url, get_assistant_answer
+from inference_backends import add_backend_arguments, backend_from_args, check_backend_arguments, format_answer
+from token_usage import payload_sizes, print_usage_report
 
 load_dotenv()
 
@@ -15,10 +25,71 @@ AZURE_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT")  # e.g., "https://<your
 DEPLOYMENT_NAME = os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME")  # Your deployment name
 API_VERSION = "2023-03-15-preview"
 API_URL = f"{AZURE_ENDPOINT}/openai/deployments/{DEPLOYMENT_NAME}/chat/completions?api-version={API_VERSION}"
+# Any other OpenAI-compatible endpoint, e.g. the local mock_server.py. Cached responses are
+# keyed by the URL (response_cache_key), so mock answers are never served for the deployment
+API_URL = os.environ.get("CHAT_COMPLETIONS_URL") or API_URL
 
 print("API_URL: ", API_URL)
 
 MODEL_NAME = "gpt-4-vision-preview"  # Using vision model for image support
+MAX_TOKENS = 1000
+
+# Concurrency and rate limits for run_tests (match these to the deployment's quota)
+MAX_IN_FLIGHT = 8
+REQUESTS_PER_MINUTE = 60
+TOKENS_PER_MINUTE = None
+# Rough token cost of one image input, used to budget tokens/min before sending
+IMAGE_TOKEN_ESTIMATE = 765
+
+# On-disk cache of API responses; set RESPONSE_CACHE_PATH to None to always call the API
+RESPONSE_CACHE_PATH = "response_cache.sqlite"
+RESPONSE_CACHE_MAX_ENTRIES = 100000
+RESPONSE_CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600
+
+# HTTP client settings; connections to the endpoint are pooled and kept alive between requests
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 120
+USE_HTTP2 = os.environ.get("USE_HTTP2", "").lower() in ("1", "true", "yes")
+
+# Images from this repository are sent inline as downscaled data URLs instead of GitHub links
+INLINE_IMAGES = True
+IMAGE_MAX_SIDE = 1024
+IMAGE_FORMAT = "JPEG"  # or "WEBP"
+IMAGE_QUALITY = 85
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client(pool_size=None):
+    """
+    Return the shared HTTP client, creating it on first use. The connection pool blocks when
+    it is full, so callers about to run more than MAX_IN_FLIGHT requests at once pass their
+    concurrency as pool_size; a client with a smaller pool is then replaced.
+    """
+    global _http_client
+    pool_size = max(pool_size or 0, MAX_IN_FLIGHT)
+    with _http_client_lock:
+        if _http_client is not None and _http_client.pool_size < pool_size:
+            _http_client.close()
+            _http_client = None
+        if _http_client is None:
+            _http_client = ChatCompletionClient(
+                connect_timeout=CONNECT_TIMEOUT,
+                read_timeout=READ_TIMEOUT,
+                pool_size=pool_size,
+                http2=USE_HTTP2,
+            )
+        return _http_client
+
+def close_http_client():
+    """
+    Close the shared HTTP client; the next request creates a new one with the current settings
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
 
 def read_excel_prompts(excel_file_path):
     """
@@ -38,74 +109,34 @@ def read_jsonl_data(jsonl_file_path):
     """
     test_cases = []
     
-    with open(jsonl_file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            data = json.loads(line)
-            
-            # Extract relevant information from JSONL structure
-            # Assuming each JSON contains messages array with user prompt and assistant response
-            for entry in data.get('messages', []):
-                if entry.get('role') == 'user':
-                    # Extract image URL from user message
-                    image_url = None
-                    for content_item in entry.get('content', []):
-                        if content_item.get('type') == 'image_url':
-                            image_url = content_item.get('image_url', {}).get('url')
-                
-                if entry.get('role') == 'assistant':
-                    # Assistant message contains the expected response
-                    expected_response = entry.get('content', '')
-                    
-                    # Extract final answer using regex
-                    expected_answer = extract_final_answer(expected_response)
-            
-            if image_url and expected_answer:
-                test_cases.append({
-                    'image_url': image_url,
-                    'expected_answer': expected_answer
-                })
+    # Each JSON line contains a messages array with the user prompt (and image) and the assistant response
+    for line_number, data in iter_jsonl(jsonl_file_path):
+        image_url = get_image_url(data)
+        expected_response = get_assistant_answer(data)
+        
+        # Extract final answer using regex
+        expected_answer = extract_final_answer(expected_response) if expected_response is not None else None
+        
+        if image_url and expected_answer:
+            test_cases.append({
+                'image_url': image_url,
+                'expected_answer': expected_answer
+            })
     
     return test_cases
 
-def extract_final_answer(response_text):
+def prepare_request_image(image_url):
     """
-    Use regex to extract the final answer from the response
-    Looking for patterns like "Final Answer: X" or "**Final Answer: X**"
+    Return the image URL to send: repository images are inlined as recompressed data URLs
     """
-    # Pattern to match final answer with or without markdown formatting
-    patterns = [
-        r'[*]*Final Answer:\s*(.*?)\s*(\(.*?\))[*]*',  # Matches "Final Answer: Month YYYY (YYYY-MM)"
-        r'[*]*Final Answer:\s*(.*?)[*]*$',              # Matches "Final Answer: X"
-        r'[*]*Final Output:\s*(.*?)[*]*$',              # Matches "Final Output: X"
-        r'Formatted result:\s*(.*?)$'                   # Matches "Formatted result: X"
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, response_text, re.IGNORECASE | re.DOTALL)
-        if match:
-            # For the first pattern that has capture groups for both parts
-            if len(match.groups()) > 1 and '(' in match.group(0):
-                return match.group(0).strip()
-            return match.group(1).strip()
-    
-    # If no match found, try to find any answer format like Month YYYY (YYYY-MM)
-    date_pattern = r'([A-Z][a-z]+\s+\d{4}\s+\(\d{4}-\d{2}\))'
-    match = re.search(date_pattern, response_text)
-    if match:
-        return match.group(1).strip()
-    
-    # If all else fails, return the last 100 characters as a fallback
-    return response_text[-100:].strip()
+    if not INLINE_IMAGES:
+        return image_url
+    return prepare_image_url(image_url, max_side=IMAGE_MAX_SIDE, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY)
 
-def send_api_request(prompt_text, image_url):
+def build_request_payload(prompt_text, image_url):
     """
-    Send a request to the Azure OpenAI API with the given prompt and image
+    Build the chat completions payload for one prompt and image
     """
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": f"{API_KEY}"
-    }
-    
     # Construct the messages array
     messages = []
     
@@ -121,7 +152,7 @@ def send_api_request(prompt_text, image_url):
     # Add image
     user_content.append({
         "type": "image_url",
-        "image_url": {"url": image_url}
+        "image_url": {"url": prepare_request_image(image_url)}
     })
     
     # Add the user message
@@ -134,125 +165,78 @@ def send_api_request(prompt_text, image_url):
     payload = {
         "model": MODEL_NAME,
         "messages": messages,
-        "max_tokens": 1000
+        "max_tokens": MAX_TOKENS
+    }
+    return payload
+
+def request_completion(prompt_text, image_url):
+    """
+    Send a request to the Azure OpenAI API with the given prompt and image, over the
+    shared keep-alive HTTP client, and return the assistant's response together with
+    the call's latency and token usage. Request failures raise.
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "api-key": f"{API_KEY}"
     }
     
-    try:
-        response = requests.post(API_URL, headers=headers, json=payload)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        
-        # Parse the response JSON
-        response_data = response.json()
-        
+    payload = build_request_payload(prompt_text, image_url)
+    text_bytes, image_bytes, payload_bytes = payload_sizes(payload)
+    
+    # Raises for HTTP errors; the connection is reused from the client's pool
+    response_data, timing = get_http_client().post_json(API_URL, headers, payload)
+    usage = response_data.get("usage") or {}
+    
+    return {
         # Extract the assistant's response text
-        assistant_response = response_data["choices"][0]["message"]["content"]
-        return assistant_response
+        "response": response_data["choices"][0]["message"]["content"],
+        "latency": timing.total,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "text_bytes": text_bytes,
+        "image_bytes": image_bytes,
+        "payload_bytes": payload_bytes,
+    }
+
+def send_api_request(prompt_text, image_url):
+    """
+    Send a request to the Azure OpenAI API with the given prompt and image and return
+    the assistant's response text, or an "Error: ..." string if the request failed.
+    """
+    try:
+        return request_completion(prompt_text, image_url)["response"]
     
-    except requests.exceptions.RequestException as e:
+    except REQUEST_EXCEPTIONS as e:
         print(f"API request failed: {e}")
         return f"Error: {e}"
 
-def calculate_precision(extracted_result, expected_result):
-    """
-    Calculate a precision score (0.0 to 1.0) based on date comparison:
-    - 1.0 if both month and year match
-    - 0.5 if either month or year matches
-    - 0.0 otherwise
-    """
-    if not extracted_result or not expected_result:
-        return 0.0
-    
-    # Normalize both strings for comparison
-    extracted_norm = extracted_result.lower().strip()
-    expected_norm = expected_result.lower().strip()
-    
-    # If exact match
-    if extracted_norm == expected_norm:
-        return 1.0
-    
-    # Extract month and year from the expected and extracted results
-    # Look for patterns like "YYYY-MM" or "Month YYYY"
-    extracted_date_code = re.search(r'(\d{4})-(\d{2})', extracted_norm)
-    expected_date_code = re.search(r'(\d{4})-(\d{2})', expected_norm)
-    
-    # Look for month names and years
-    months = ["january", "february", "march", "april", "may", "june", "july", 
-              "august", "september", "october", "november", "december"]
-    
-    extracted_month_name = None
-    extracted_year_text = None
-    
-    for month in months:
-        if month in extracted_norm:
-            extracted_month_name = month
-            # Try to find a year near the month
-            year_match = re.search(r'\b(20\d{2})\b', extracted_norm)
-            if year_match:
-                extracted_year_text = year_match.group(1)
-            break
-    
-    expected_month_name = None
-    expected_year_text = None
-    
-    for month in months:
-        if month in expected_norm:
-            expected_month_name = month
-            # Try to find a year near the month
-            year_match = re.search(r'\b(20\d{2})\b', expected_norm)
-            if year_match:
-                expected_year_text = year_match.group(1)
-            break
-    
-    # Check if we have date codes to compare
-    if extracted_date_code and expected_date_code:
-        extracted_year = extracted_date_code.group(1)
-        extracted_month = extracted_date_code.group(2)
-        expected_year = expected_date_code.group(1)
-        expected_month = expected_date_code.group(2)
-        
-        # Check if both month and year match
-        if extracted_year == expected_year and extracted_month == expected_month:
-            return 1.0
-        # Check if either month or year matches
-        elif extracted_year == expected_year or extracted_month == expected_month:
-            return 0.5
-    
-    # Compare text-based dates if available
-    if extracted_month_name and expected_month_name and extracted_year_text and expected_year_text:
-        month_match = extracted_month_name == expected_month_name
-        year_match = extracted_year_text == expected_year_text
-        
-        if month_match and year_match:
-            return 1.0
-        elif month_match or year_match:
-            return 0.5
-    
-    # If we have mixed formats, try to compare what we can
-    if extracted_date_code and expected_month_name and expected_year_text:
-        extracted_year = extracted_date_code.group(1)
-        extracted_month = int(extracted_date_code.group(2))
-        expected_year = expected_year_text
-        expected_month = months.index(expected_month_name) + 1
-        
-        if extracted_year == expected_year and extracted_month == expected_month:
-            return 1.0
-        elif extracted_year == expected_year or extracted_month == expected_month:
-            return 0.5
-    
-    # Similarly, check the reverse mixed format
-    if expected_date_code and extracted_month_name and extracted_year_text:
-        expected_year = expected_date_code.group(1)
-        expected_month = int(expected_date_code.group(2))
-        extracted_year = extracted_year_text
-        extracted_month = months.index(extracted_month_name) + 1
-        
-        if extracted_year == expected_year and extracted_month == expected_month:
-            return 1.0
-        elif extracted_year == expected_year or extracted_month == expected_month:
-            return 0.5
-    
-    # Default to 0.0 if no date comparison was possible
-    return 0.0
+def estimate_request_tokens(prompt_text):
+    """
+    Estimate the tokens a request will be charged against the tokens/min quota:
+    ~4 characters per text token, a fixed image cost and the completion budget.
+    """
+    return len(prompt_text) // 4 + IMAGE_TOKEN_ESTIMATE + MAX_TOKENS
+
+def response_cache_key(prompt_text, image_url):
+    """
+    Cache key for a request: the prompt, the image and every setting that changes the answer,
+    including the endpoint and deployment (API_URL without its query string). Inlined images
+    are keyed by their encoded content, so editing an image invalidates its entries.
+    """
+    endpoint = API_URL.split("?", 1)[0]
+    return make_cache_key(prompt_text, prepare_request_image(image_url), MODEL_NAME, API_VERSION, MAX_TOKENS, endpoint)
+
+def open_response_cache(cache_path=RESPONSE_CACHE_PATH):
+    """
+    Open the response cache with the configured eviction limits, or return None if disabled
+    """
+    if cache_path is None:
+        return None
+    return ResponseCache(
+        cache_path,
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        max_age_seconds=RESPONSE_CACHE_MAX_AGE_SECONDS,
+    )
 
 def update_excel_results(excel_file_path, result_df):
     """
@@ -270,81 +254,363 @@ def update_excel_results(excel_file_path, result_df):
     writer.close()
     print(f"Results written to {excel_file_path}")
 
-def run_tests(excel_file_path, jsonl_file_path):
+def iter_batch_requests(prompt_df, test_cases):
+    """
+    Yield (custom_id, body) for every prompt x test case pair, without building the matrix
+    """
+    for _, prompt_row in prompt_df.iterrows():
+        for i, test_case in enumerate(test_cases):
+            custom_id = make_custom_id(prompt_row['ID'], i, prompt_row['Prompt'], test_case['image_url'])
+            body = build_request_payload(prompt_row['Prompt'], test_case['image_url'])
+            # Batch deployments are addressed by deployment name in the request body
+            body["model"] = DEPLOYMENT_NAME or MODEL_NAME
+            yield custom_id, body
+
+def import_batch_results(excel_file_path, jsonl_file_path, batch_output_path, results_path=None):
+    """
+    Score a batch output file produced from run_tests(..., batch_requests_path=...) and
+    write the results to the results store and the Excel file, like an interactive run would.
+    The output file is streamed line by line.
+    """
+    print(f"Importing batch results from {batch_output_path}...")
+    
+    prompt_df, _ = read_excel_prompts(excel_file_path)
+    test_cases = read_jsonl_data(jsonl_file_path)
+    prompts = {str(prompt_row['ID']): (prompt_row['ID'], prompt_row['Prompt']) for _, prompt_row in prompt_df.iterrows()}
+    
+    records = []
+    skipped = 0
+    for custom_id, response, error in read_batch_results(batch_output_path):
+        try:
+            prompt_key, i, digest = parse_custom_id(custom_id or "")
+        except ValueError as e:
+            print(f"  Skipping: {e}")
+            skipped += 1
+            continue
+        if prompt_key not in prompts or i >= len(test_cases):
+            print(f"  Skipping {custom_id}: no such prompt/test case in the current inputs")
+            skipped += 1
+            continue
+        prompt_id, prompt_text = prompts[prompt_key]
+        test_case = test_cases[i]
+        if digest != request_digest(prompt_text, test_case['image_url']):
+            print(f"  Skipping {custom_id}: prompt or image changed since the batch was exported")
+            skipped += 1
+            continue
+        
+        if error is not None:
+            print(f"API request failed: {error}")
+            response = f"Error: {error}"
+        extracted_result = extract_final_answer(response)
+        precision = calculate_precision(extracted_result, test_case['expected_answer'])
+        records.append({
+            'prompt_id': prompt_id,
+            'case_index': i,
+            'image_url': test_case['image_url'],
+            'response': response,
+            'extracted': extracted_result,
+            'expected': test_case['expected_answer'],
+            'precision': precision,
+            'dataset': os.path.basename(jsonl_file_path),
+        })
+    
+    results_df = results_frame(records)
+    save_results(results_df, results_path or default_results_path(excel_file_path))
+    update_excel_results(excel_file_path, pivot_results(results_df, prompt_df['ID']))
+    print(f"Imported {len(records)} batch results ({skipped} skipped)")
+
+def default_journal_path(excel_file_path):
+    """
+    Journal file used for a results workbook, e.g. results.xlsx -> results.journal.jsonl
+    """
+    return os.path.splitext(excel_file_path)[0] + ".journal.jsonl"
+
+def default_results_path(excel_file_path):
+    """
+    Long-format results file used for a workbook, e.g. results.xlsx -> results.results.parquet
+    """
+    return os.path.splitext(excel_file_path)[0] + ".results.parquet"
+
+def write_results_from_journal(excel_file_path, prompt_df, pairs, journal_path, results_path=None):
+    """
+    Compaction step: collect the journaled results of the current pairs into the long-format
+    results store, then write its wide Result_i/Precision_i view to the workbook.
+    The last journaled record of every pair wins.
+    """
+    records = latest_records(journal_path)
+    results_df = results_frame(records[pair[0]] for pair in pairs if pair[0] in records)
+    save_results(results_df, results_path or default_results_path(excel_file_path))
+    update_excel_results(excel_file_path, pivot_results(results_df, prompt_df['ID']))
+    return results_df
+
+def build_pairs(prompt_df, test_cases):
+    """
+    The prompt x test case matrix in a fixed order: (pair_key, prompt_id, prompt_text,
+    case_index, test_case) for every pair
+    """
+    pairs = []
+    for _, prompt_row in prompt_df.iterrows():
+        prompt_id = prompt_row['ID']
+        # Plain Python values, so the ID can be written to the journal
+        prompt_id = prompt_id.item() if hasattr(prompt_id, 'item') else prompt_id
+        for i, test_case in enumerate(test_cases):
+            pair_key = make_custom_id(prompt_id, i, prompt_row['Prompt'], test_case['image_url'])
+            pairs.append((pair_key, prompt_id, prompt_row['Prompt'], i, test_case))
+    return pairs
+
+def request_and_cache(prompt_text, image_url, cache=None):
+    """
+    request_completion, storing the response in the response cache
+    """
+    completion = request_completion(prompt_text, image_url)
+    if cache is not None:
+        cache.put(response_cache_key(prompt_text, image_url), completion['response'])
+    return completion
+
+def score_response(pair, response, test_case_count, dataset, backend="remote"):
+    """
+    Score the response to one pair of build_pairs and return its journal record. `response`
+    is a request_completion result, a cached response string or the exception of a failed call.
+    """
+    pair_key, prompt_id, _, i, test_case = pair
+    # Fresh API calls come with latency and token usage, cache hits are plain strings
+    details = response if isinstance(response, dict) else {}
+    if details:
+        response = details['response']
+    error = isinstance(response, Exception)
+    if error:
+        print(f"API request failed: {response}")
+        response = f"Error: {response}"
+    
+    expected_answer = test_case['expected_answer']
+    
+    # Extract the final answer using regex
+    extracted_result = extract_final_answer(response)
+    
+    # Calculate precision score
+    precision = calculate_precision(extracted_result, expected_answer)
+    
+    print(f"Prompt ID {prompt_id}, image {i+1}/{test_case_count}: {test_case['image_url']}")
+    print(f"  Extracted: {extracted_result}")
+    print(f"  Expected: {expected_answer}")
+    print(f"  Precision: {precision}")
+    
+    return {
+        'pair_key': pair_key,
+        'prompt_id': prompt_id,
+        'case_index': i,
+        'image_url': test_case['image_url'],
+        'response': response,
+        'extracted': extracted_result,
+        'expected': expected_answer,
+        'precision': precision,
+        'latency': details.get('latency'),
+        'prompt_tokens': details.get('prompt_tokens'),
+        'completion_tokens': details.get('completion_tokens'),
+        'text_bytes': details.get('text_bytes'),
+        'image_bytes': details.get('image_bytes'),
+        'payload_bytes': details.get('payload_bytes'),
+        'error': error,
+        'backend': backend,
+        'dataset': dataset,
+    }
+
+def run_tests(excel_file_path, jsonl_file_path, max_in_flight=MAX_IN_FLIGHT,
+              requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+              cache_path=RESPONSE_CACHE_PATH, batch_requests_path=None,
+              journal_path=None, resume=False, results_path=None,
+              local_backend=None, min_confidence=0.9, answer_format="named"):
     """
     Main function to run the tests.
     Reads prompts from the Excel file and test cases (images/expected answers) from the JSONL file,
     sends API requests for each prompt-test case pair, extracts and calculates precision,
     then writes all the results back to the Excel file.
+
+    Requests are sent concurrently (at most max_in_flight at a time) and throttled by the
+    requests/min and tokens/min limits; throttled or failed calls are retried with backoff.
+    Pairs whose response is already in the response cache are not sent again.
+
+    Every scored pair is appended to a journal (journal_path, next to the workbook by default)
+    as soon as it completes, and the workbook is written from the journal at the end. With
+    resume=True, pairs already in the journal from an interrupted run are skipped; failed
+    pairs are tried again. The compacted results are kept in long format (one row per pair,
+    with latency, token usage and request bytes) in results_path, Parquet next to the
+    workbook by default; token_usage reports on them per prompt and per dataset.
+
+    With batch_requests_path set, nothing is sent: the full prompt x test case matrix is
+    streamed to that file in the batch API input format instead. Score the batch output
+    file afterwards with import_batch_results.
+
+    With a local_backend (see inference_backends), every image is first answered in-process;
+    pairs whose local prediction is a complete date with at least min_confidence are scored
+    from it (phrased in answer_format, see inference_backends.format_answer) without an API
+    call, so the remote model only sees the images the backend is unsure about. Local
+    predictions do not depend on the prompt; the result sheet marks them in Backend_i columns.
+    Month-only backends are refused: no dated label can be matched without the year.
     """
+    if local_backend is not None and local_backend.month_only:
+        raise ValueError(f"Local backend {local_backend.name} reads the month only and cannot replace API calls")
+    
     print("Starting test execution...")
+    dataset = os.path.basename(jsonl_file_path)
     
     # Read prompts from Excel
     prompt_df, _ = read_excel_prompts(excel_file_path)
-    # Always reinitialize result_df with all IDs from prompt_df
-    result_df = prompt_df[['ID']].copy()
     
     # Read test cases (images and expected answers) from JSONL
     test_cases = read_jsonl_data(jsonl_file_path)
     
     print(f"Found {len(prompt_df)} prompts and {len(test_cases)} test cases")
     
-    # For each prompt
-    for prompt_idx, prompt_row in prompt_df.iterrows():
-        prompt_id = prompt_row['ID']
-        prompt_text = prompt_row['Prompt']
+    if batch_requests_path is not None:
+        count = write_batch_requests(iter_batch_requests(prompt_df, test_cases), batch_requests_path)
+        print(f"Wrote {count} batch requests to {batch_requests_path}")
+        return
+    
+    # Build the full prompt x test case matrix, in a fixed order
+    pairs = build_pairs(prompt_df, test_cases)
+    
+    # Skip pairs that an interrupted run already completed
+    journal_path = journal_path or default_journal_path(excel_file_path)
+    completed = set()
+    if resume:
+        completed = {key for key, record in latest_records(journal_path).items() if not record.get('error')}
+    todo = [index for index, pair in enumerate(pairs) if pair[0] not in completed]
+    if resume:
+        print(f"Resuming from {journal_path}: {len(pairs) - len(todo)} pairs already done")
+    
+    journal = ResultsJournal(journal_path, resume=resume)
+    cache = open_response_cache(cache_path)
+    
+    def score_pair(index, response, backend="remote"):
+        journal.append(score_response(pairs[index], response, len(test_cases), dataset, backend))
+    
+    def request_pair(index):
+        _, _, prompt_text, _, test_case = pairs[index]
+        return request_and_cache(prompt_text, test_case['image_url'], cache)
+    
+    try:
+        # Answer what we can from the response cache and only send the rest
+        pending = []
+        for index in todo:
+            _, _, prompt_text, _, test_case = pairs[index]
+            cached = cache.get(response_cache_key(prompt_text, test_case['image_url'])) if cache else None
+            if cached is not None:
+                score_pair(index, cached)
+            else:
+                pending.append(index)
         
-        print(f"Processing prompt ID: {prompt_id}")
+        cached = len(todo) - len(pending)
+        if local_backend is not None and pending:
+            image_urls = sorted({pairs[index][4]['image_url'] for index in pending})
+            start = time.perf_counter()
+            predictions = dict(zip(image_urls, local_backend.predict(image_urls)))
+            seconds = time.perf_counter() - start
+            remote = []
+            for index in pending:
+                test_case = pairs[index][4]
+                prediction = predictions[test_case['image_url']]
+                # Only complete dates can score
+                if prediction.year and prediction.month and prediction.confidence >= min_confidence:
+                    response = format_answer(prediction.year, prediction.month, answer_format)
+                    score_pair(index, {'response': response, 'latency': None}, backend=local_backend.name)
+                else:
+                    remote.append(index)
+            confident = sum(prediction.confidence >= min_confidence for prediction in predictions.values())
+            print(f"Local backend {local_backend.name}: {len(image_urls)} images in {seconds:.2f}s, "
+                  f"{confident} at confidence >= {min_confidence}; {len(pending) - len(remote)} pairs scored locally")
+            pending = remote
         
-        # For each test case (image + expected answer)
-        for i, test_case in enumerate(test_cases):
-            image_url = test_case['image_url']
-            expected_answer = test_case['expected_answer']
-            
-            print(f"  Testing with image {i+1}/{len(test_cases)}: {image_url}")
-            
-            # Send API request with prompt and image
-            print("  Sending API request...")
-            response = send_api_request(prompt_text, image_url)
-            
-            # Extract the final answer using regex
-            print("  Extracting final answer...")
-            extracted_result = extract_final_answer(response)
-            
-            # Calculate precision score
-            precision = calculate_precision(extracted_result, expected_answer)
-            
-            print(f"  Extracted: {extracted_result}")
-            print(f"  Expected: {expected_answer}")
-            print(f"  Precision: {precision}")
-            
-            # Define column names for the test case result
-            result_column = f"Result_{i+1}"
-            precision_column = f"Precision_{i+1}"
-            
-            # Ensure that the columns exist in the result dataframe
-            if result_column not in result_df.columns:
-                result_df[result_column] = None
-            if precision_column not in result_df.columns:
-                result_df[precision_column] = None
-            
-            # Update the result dataframe for the current prompt
-            result_df.loc[result_df['ID'] == prompt_id, result_column] = extracted_result
-            result_df.loc[result_df['ID'] == prompt_id, precision_column] = precision
-            
-            # Rate limit to avoid API throttling
-            sleep(1)
-    
-    # Write the updated results back to the Excel file
-    update_excel_results(excel_file_path, result_df)
+        print(f"Sending {len(pending)} API requests ({cached} cached, {max_in_flight} in flight)...")
+        get_http_client(max_in_flight)
+        run_concurrently(
+            pending,
+            request_pair,
+            max_in_flight=max_in_flight,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            token_estimator=lambda index: estimate_request_tokens(pairs[index][2]),
+            on_result=lambda n, index, response: score_pair(index, response),
+        )
+    finally:
+        journal.close()
+        if cache is not None:
+            stats = cache.stats()
+            print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['evictions']} evictions, {stats['entries']} entries")
+            cache.close()
+    
+    # Write the journaled results back to the Excel file
+    results_df = write_results_from_journal(excel_file_path, prompt_df, pairs, journal_path, results_path)
+    
+    latency = get_http_client().latency_summary() if pending else None
+    # Calls that never got a response (e.g. connection errors) record no timing
+    if latency and latency['requests']:
+        print(f"Latency over {latency['requests']} requests ({latency['new_connections']} new connections): "
+              f"connect p50 {latency['connect']['p50']:.3f}s, "
+              f"TTFB p50 {latency['ttfb']['p50']:.3f}s / p95 {latency['ttfb']['p95']:.3f}s, "
+              f"total p50 {latency['total']['p50']:.3f}s / p95 {latency['total']['p95']:.3f}s")
+    
+    if INLINE_IMAGES:
+        memo = encoding_cache_info()
+        print(f"Inline images: {memo.currsize} encoded, {memo.hits} reused")
     
     print("\nTest Execution Summary")
     print("======================")
-    print(f"Total tests: {len(prompt_df) * len(test_cases)}")
-    print(f"All results have been updated in {excel_file_path}")
+    print(f"Total tests: {len(pairs)}")
+    print(f"Results for {len(results_df)} tests have been updated in {excel_file_path}")
+    print_usage_report(results_df)
+
+
+def main():
+    global API_URL
+    parser = argparse.ArgumentParser(description="Evaluate prompts against the images in a JSONL dataset")
+    parser.add_argument("--excel", default=r"C:\Users\osabidi\sandbox\prompts_and_results.xlsx", help="Excel file with the prompts and results sheets")
+    parser.add_argument("--jsonl", default=r"C:\Users\osabidi\finetuning-garanti\zoomed\inflated_dataset.jsonl", help="JSONL file with the test cases")
+    parser.add_argument("--max_in_flight", type=int, default=MAX_IN_FLIGHT, help="Maximum number of concurrent API requests")
+    parser.add_argument("--requests_per_minute", type=float, default=REQUESTS_PER_MINUTE, help="Request rate limit")
+    parser.add_argument("--tokens_per_minute", type=float, default=TOKENS_PER_MINUTE, help="Token rate limit")
+    parser.add_argument("--no_cache", action="store_true", help="Do not read or write the response cache")
+    parser.add_argument("--journal", help="Results journal file (defaults to <excel>.journal.jsonl)")
+    parser.add_argument("--results", help="Long-format results file (defaults to <excel>.results.parquet)")
+    parser.add_argument("--resume", action="store_true", help="Skip pairs already completed in the journal")
+    parser.add_argument("--batch_export", metavar="PATH", help="Write a batch API input file instead of calling the API")
+    parser.add_argument("--batch_import", metavar="PATH", help="Score a batch API output file and update the Excel file")
+    parser.add_argument("--api_url", default=None, help="Chat completions URL to call instead of the Azure deployment (e.g. mock_server.py); responses are cached per URL")
+    parser.add_argument("--min_confidence", type=float, default=0.9, help="With --backend, send only images predicted below this confidence to the API")
+    add_backend_arguments(parser)
+    
+    args = parser.parse_args()
+    
+    if args.api_url:
+        API_URL = args.api_url
+    
+    if args.batch_import:
+        import_batch_results(args.excel, args.jsonl, args.batch_import, args.results)
+        return
+    
+    check_backend_arguments(parser, args, complete_dates=True)
+    local_backend = backend_from_args(args)
+    try:
+        run_tests(
+            args.excel,
+            args.jsonl,
+            max_in_flight=args.max_in_flight,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            cache_path=None if args.no_cache else RESPONSE_CACHE_PATH,
+            batch_requests_path=args.batch_export,
+            journal_path=args.journal,
+            resume=args.resume,
+            results_path=args.results,
+            local_backend=local_backend,
+            min_confidence=args.min_confidence,
+            answer_format=args.answer_format,
+        )
+    finally:
+        if local_backend is not None:
+            local_backend.close()
 
 
 if __name__ == "__main__":
-    excel_file_path = r"C:\Users\osabidi\sandbox\prompts_and_results.xlsx"  # Update with your Excel file path
-    jsonl_file_path = r"C:\Users\osabidi\finetuning-garanti\zoomed\inflated_dataset.jsonl"     # Update with your JSONL file path
-    run_tests(excel_file_path, jsonl_file_path)
\ No newline at end of file
+    main()
@@ -0,0 +1,80 @@
+import json
+
+import pandas as pd
+
+import response_cache
+import test_prompts
+from mock_server import MockBehaviour, MockChatServer
+from response_cache import ResponseCache
+
+def test_eviction_is_batched_and_keeps_the_recent_entries(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_entries=100)
+    evictions = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: evictions.append(evict()))
+
+    for i in range(1000):
+        cache.put(f"key {i}", "response")
+        assert cache.stats()["entries"] <= 100 * (1 + response_cache.EVICTION_SLACK) + 1
+
+    assert 0 < len(evictions) <= 1000 // (100 * response_cache.EVICTION_SLACK)
+    assert cache.get("key 999") == "response"
+    assert cache.get("key 0") is None
+    cache.close()
+
+def test_byte_limit_counts_replaced_entries_once(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), max_bytes=1000)
+    for _ in range(50):
+        cache.put("same key", "x" * 100)
+    assert cache.stats()["entries"] == 1
+    assert cache.total_bytes == 100
+    cache.close()
+
+def test_key_depends_on_the_endpoint_and_deployment(monkeypatch):
+    monkeypatch.setattr(test_prompts, "INLINE_IMAGES", False)
+    image_url = "https://example.com/stamp.png"
+    keys = set()
+    for url in ("https://a.openai.azure.com/openai/deployments/gpt4v/chat/completions?api-version=2023-03-15-preview",
+                "https://a.openai.azure.com/openai/deployments/finetuned/chat/completions?api-version=2023-03-15-preview",
+                "https://b.openai.azure.com/openai/deployments/gpt4v/chat/completions?api-version=2023-03-15-preview"):
+        monkeypatch.setattr(test_prompts, "API_URL", url)
+        keys.add(test_prompts.response_cache_key("prompt", image_url))
+    assert len(keys) == 3
+
+    # The query string only carries the API version, which is keyed on its own
+    monkeypatch.setattr(test_prompts, "API_URL", "https://a.openai.azure.com/openai/deployments/gpt4v/chat/completions")
+    assert test_prompts.response_cache_key("prompt", image_url) in keys
+
+def test_mock_server_answers_are_not_served_for_another_endpoint(tmp_path, monkeypatch):
+    excel_path = str(tmp_path / "prompts.xlsx")
+    with pd.ExcelWriter(excel_path) as writer:
+        pd.DataFrame({"ID": [1], "Prompt": ["prompt"]}).to_excel(writer, sheet_name="Prompts - Input Data", index=False)
+        pd.DataFrame({"ID": [1]}).to_excel(writer, sheet_name="Prompts - Result Data", index=False)
+    jsonl_path = str(tmp_path / "cases.jsonl")
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for i in range(3):
+            f.write(json.dumps({"messages": [
+                {"role": "user", "content": [{"type": "text", "text": "Date?"},
+                                             {"type": "image_url", "image_url": {"url": f"https://example.com/{i}.png"}}]},
+                {"role": "assistant", "content": "Final Answer: March 2021 (2021-03)"},
+            ]}) + "\n")
+    monkeypatch.setattr(test_prompts, "INLINE_IMAGES", False)
+    cache_path = str(tmp_path / "cache.sqlite")
+
+    servers = [MockChatServer(MockBehaviour(latency="constant:0.0")) for _ in range(2)]
+    try:
+        urls = [server.start() for server in servers]
+        for run, url in enumerate([urls[0], urls[0], urls[1]]):
+            monkeypatch.setattr(test_prompts, "API_URL", url)
+            test_prompts.run_tests(excel_path, jsonl_path, cache_path=cache_path, requests_per_minute=None,
+                                   journal_path=str(tmp_path / f"journal{run}.jsonl"),
+                                   results_path=str(tmp_path / f"results{run}.parquet"))
+            test_prompts.close_http_client()
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+    # The second run is answered from the cache, the third goes to the other server
+    assert servers[0].behaviour.snapshot()["status"]["200"] == 3
+    assert servers[1].behaviour.snapshot()["status"]["200"] == 3
@@ -0,0 +1,58 @@
+import base64
+import io
+import json
+
+import pandas as pd
+import pytest
+from PIL import Image
+
+import test_prompts
+from token_usage import estimate_sweep, image_tokens, image_url_tokens, payload_sizes
+
+def png_data_url(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+@pytest.mark.parametrize("width, height, tokens", [
+    (512, 512, 85 + 170 * 1),
+    (1024, 768, 85 + 170 * 4),
+    # Fit into 2048 x 2048 (2048 x 1024), shortest side to 768 (1536 x 768): 3 x 2 tiles
+    (4096, 2048, 85 + 170 * 6),
+    # Small images are not scaled up
+    (100, 40, 85 + 170 * 1),
+])
+def test_image_tokens_tiling(width, height, tokens):
+    assert image_tokens(width, height) == tokens
+
+def test_image_url_tokens_reads_the_image_size():
+    assert image_url_tokens(png_data_url(1024, 768)) == 765
+
+def test_payload_sizes_of_a_known_payload():
+    image_url = png_data_url(8, 8)
+    payload = test_prompts.build_request_payload("Tarih nedir? ÅÇ", image_url)
+    text_bytes, image_bytes, payload_bytes = payload_sizes(payload)
+    assert text_bytes == len("Tarih nedir? ÅÇ".encode("utf-8"))
+    assert image_bytes == len(image_url)
+    assert payload_bytes == len(json.dumps(payload).encode("utf-8"))
+
+def test_estimate_needs_more_than_the_default_concurrency_and_the_pool_allows_it(monkeypatch):
+    monkeypatch.setattr(test_prompts, "INLINE_IMAGES", False)
+    prompt_df = pd.DataFrame({"ID": [1, 2], "Prompt": ["first prompt", "second prompt"]})
+    test_cases = [{"image_url": png_data_url(512, 512)}] * 10
+
+    estimate_df, timing = estimate_sweep(test_prompts, prompt_df, test_cases, completion_tokens=20,
+                                         latency=2.0, max_in_flight=32, requests_per_minute=600)
+    assert timing["calls"] == 20
+    assert list(estimate_df["completion_tokens"]) == [200, 200]
+    # 32 in flight at 2 s is 16 requests/s, so the 10 requests/s limit binds
+    assert timing["bottleneck"] == "requests/min"
+    assert timing["requests_per_second"] == pytest.approx(10.0)
+    # Little's law: 10 requests/s x 2 s
+    assert timing["max_in_flight_needed"] == 20
+    assert timing["max_in_flight_needed"] > test_prompts.MAX_IN_FLIGHT
+
+    try:
+        assert test_prompts.get_http_client(timing["max_in_flight_needed"]).pool_size >= timing["max_in_flight_needed"]
+    finally:
+        test_prompts.close_http_client()
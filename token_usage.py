@@ -0,0 +1,338 @@
+import argparse
+import io
+import json
+import math
+import os
+
+import pandas as pd
+from PIL import Image
+
+from dataset_io import iter_image_urls, iter_jsonl
+from http_client import percentile
+from image_preprocessing import image_key
+from results_journal import latest_records
+from results_store import RESULT_COLUMNS, load_results, results_frame
+
+# Tokenizer of the GPT-4 family, used when tiktoken is installed
+TOKEN_ENCODING = "cl100k_base"
+# Fallback without tiktoken: ~4 characters per token
+CHARS_PER_TOKEN = 4
+# Chat formatting tokens of a request with one user message (message framing and reply priming)
+REQUEST_OVERHEAD_TOKENS = 7
+
+# Image input cost of the vision models (detail "high", the default for large images): the
+# image is fit into 2048x2048, scaled down to 768px on its shortest side and billed per
+# 512px tile. Images that cannot be measured are counted at the flat estimate test_prompts
+# budgets with.
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+IMAGE_TILE_SIZE = 512
+IMAGE_TOKEN_ESTIMATE = 765
+
+# USD per million tokens (gpt-4-vision-preview list prices); set these to the deployment's pricing
+PROMPT_PRICE_PER_MILLION = 10.0
+COMPLETION_PRICE_PER_MILLION = 30.0
+
+# Latency assumed by the estimator when no earlier results are given
+DEFAULT_LATENCY = 5.0
+
+_encoding = None
+
+def count_text_tokens(text):
+    """
+    Tokens of a text: exact with tiktoken when it is installed, otherwise ~4 characters per token
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except ImportError:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def tokenizer_name():
+    count_text_tokens("")
+    return f"tiktoken {TOKEN_ENCODING}" if _encoding else f"~{CHARS_PER_TOKEN} chars/token (pip install tiktoken for exact counts)"
+
+def image_tokens(width, height):
+    """
+    Prompt tokens of an image of width x height pixels
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / IMAGE_TILE_SIZE) * math.ceil(height / IMAGE_TILE_SIZE)
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+def image_url_tokens(image_url):
+    """
+    Prompt tokens of the image behind a URL as sent (a data URL or a repository image), read
+    from the image header; IMAGE_TOKEN_ESTIMATE for images that are not available locally
+    """
+    _, source = image_key(image_url)
+    if source is None:
+        return IMAGE_TOKEN_ESTIMATE
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+            return image_tokens(*img.size)
+    except OSError:
+        return IMAGE_TOKEN_ESTIMATE
+
+def payload_sizes(payload):
+    """
+    (text_bytes, image_bytes, payload_bytes) of a chat completions payload: the UTF-8 size of
+    its text parts, the size of its image URLs (inline data URLs are the encoded image) and
+    the size of the whole JSON request body
+    """
+    text_bytes = image_bytes = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        for item in content if isinstance(content, list) else [{"type": "text", "text": content or ""}]:
+            if item.get("type") == "text":
+                text_bytes += len((item.get("text") or "").encode("utf-8"))
+            elif item.get("type") == "image_url":
+                image_bytes += len((item.get("image_url") or {}).get("url") or "")
+    # Serialized like requests does for json=
+    payload_bytes = len(json.dumps(payload).encode("utf-8"))
+    return text_bytes, image_bytes, payload_bytes
+
+def load_usage(paths):
+    """
+    Results of earlier runs as one long-format DataFrame, from results files (Parquet) or
+    journals (.jsonl); rows without a dataset are attributed to the file they were read from
+    """
+    frames = []
+    for path in paths:
+        if path.endswith(".jsonl"):
+            results_df = results_frame(latest_records(path).values())
+        else:
+            results_df = load_results(path)
+        # Results saved before a column existed
+        for column in RESULT_COLUMNS:
+            if column not in results_df:
+                results_df[column] = None
+        results_df["dataset"] = results_df["dataset"].fillna(os.path.basename(path))
+        frames.append(results_df)
+    return pd.concat(frames, ignore_index=True) if frames else results_frame([])
+
+# Usage columns of the results; None where a pair made no API call or predates the column
+USAGE_COLUMNS = ["latency", "prompt_tokens", "completion_tokens", "text_bytes", "image_bytes", "payload_bytes"]
+
+def api_calls(results_df):
+    """
+    Rows of results_df that were API calls (cache hits and local answers cost nothing), with
+    the usage columns as numbers
+    """
+    calls = results_df[results_df["prompt_tokens"].notna()]
+    return calls.assign(**{column: pd.to_numeric(calls[column], errors="coerce") for column in USAGE_COLUMNS})
+
+def cost(prompt_tokens, completion_tokens, prompt_price=PROMPT_PRICE_PER_MILLION,
+         completion_price=COMPLETION_PRICE_PER_MILLION):
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+def usage_summary(results_df, by="prompt_id", prompt_price=PROMPT_PRICE_PER_MILLION,
+                  completion_price=COMPLETION_PRICE_PER_MILLION):
+    """
+    One row per value of `by` (prompt_id or dataset): pairs scored, API calls made, tokens,
+    payload sizes, call latency and cost
+    """
+    rows = []
+    for key, group in results_df.groupby(by, sort=True, dropna=False):
+        calls = api_calls(group)
+        prompt_tokens = int(calls["prompt_tokens"].sum())
+        completion_tokens = int(calls["completion_tokens"].sum())
+        latencies = calls["latency"].dropna().tolist()
+        rows.append({
+            by: key,
+            "pairs": len(group),
+            "calls": len(calls),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_per_call": (prompt_tokens + completion_tokens) / len(calls) if len(calls) else None,
+            "text_kb_per_call": calls["text_bytes"].mean() / 1024,
+            "image_kb_per_call": calls["image_bytes"].mean() / 1024,
+            "sent_mb": calls["payload_bytes"].sum() / 2**20,
+            "latency_p50": percentile(latencies, 0.50),
+            "latency_p95": percentile(latencies, 0.95),
+            "cost_usd": cost(prompt_tokens, completion_tokens, prompt_price, completion_price),
+        })
+    return pd.DataFrame(rows)
+
+def print_usage_report(results_df, prompt_price=PROMPT_PRICE_PER_MILLION, completion_price=COMPLETION_PRICE_PER_MILLION):
+    for by in ("prompt_id", "dataset"):
+        summary = usage_summary(results_df, by, prompt_price, completion_price)
+        print(f"\nUsage per {by}:")
+        print(summary.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    calls = api_calls(results_df)
+    prompt_tokens = int(calls["prompt_tokens"].sum())
+    completion_tokens = int(calls["completion_tokens"].sum())
+    print(f"\nTotal: {len(calls)} calls, {prompt_tokens} prompt + {completion_tokens} completion tokens, "
+          f"{calls['payload_bytes'].sum() / 2**20:.1f} MB sent, "
+          f"${cost(prompt_tokens, completion_tokens, prompt_price, completion_price):.2f}")
+
+def estimate_sweep(test_prompts, prompt_df, test_cases, history_df=None, completion_tokens=None,
+                   latency=None, max_in_flight=None, requests_per_minute=None, tokens_per_minute=None,
+                   cache=None):
+    """
+    Predict what run_tests would send for prompt_df x test_cases without calling the API:
+    prompt tokens (tokenizer count of every prompt plus the tile cost of every image as
+    encoded for the request), completion tokens, payload bytes and the duration under the
+    concurrency and rate limits. Pairs already in the response cache are not counted.
+
+    Completion tokens and latency default to the means/median of each prompt in history_df
+    (earlier results), then over all of history_df, then to MAX_TOKENS (an upper bound) and
+    DEFAULT_LATENCY.
+    """
+    max_in_flight = max_in_flight or test_prompts.MAX_IN_FLIGHT
+    calls = pd.DataFrame() if history_df is None else api_calls(history_df)
+    if latency is None:
+        latency = percentile(calls["latency"].dropna().tolist(), 0.50) if len(calls) else None
+        latency = latency or DEFAULT_LATENCY
+    history_completion = calls.groupby("prompt_id")["completion_tokens"].mean().to_dict() if len(calls) else {}
+    default_completion = calls["completion_tokens"].mean() if len(calls) else None
+    if default_completion is None or pd.isna(default_completion):
+        default_completion = test_prompts.MAX_TOKENS
+
+    # Every image is encoded once, exactly as run_tests will send it
+    images = {}
+    for test_case in test_cases:
+        image_url = test_case['image_url']
+        if image_url not in images:
+            sent_url = test_prompts.prepare_request_image(image_url)
+            images[image_url] = (image_url_tokens(sent_url), len(sent_url))
+
+    rows = []
+    for _, prompt_row in prompt_df.iterrows():
+        prompt_id, prompt_text = prompt_row['ID'], prompt_row['Prompt']
+        text_tokens = count_text_tokens(prompt_text) + REQUEST_OVERHEAD_TOKENS
+        text_bytes = len(prompt_text.encode("utf-8"))
+        sent = [test_case['image_url'] for test_case in test_cases
+                if cache is None or cache.get(test_prompts.response_cache_key(prompt_text, test_case['image_url'])) is None]
+        per_call_completion = completion_tokens or history_completion.get(prompt_id, default_completion)
+        prompt_tokens = len(sent) * text_tokens + sum(images[url][0] for url in sent)
+        rows.append({
+            "prompt_id": prompt_id,
+            "calls": len(sent),
+            "cached": len(test_cases) - len(sent),
+            "text_tokens": text_tokens,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": int(round(len(sent) * per_call_completion)),
+            "sent_mb": sum(text_bytes + images[url][1] for url in sent) / 2**20,
+            # What run_concurrently charges against the tokens/min limit before each call
+            "budget_tokens": len(sent) * test_prompts.estimate_request_tokens(prompt_text),
+        })
+    estimate_df = pd.DataFrame(rows)
+
+    total_calls = int(estimate_df["calls"].sum()) if len(estimate_df) else 0
+    rates = {"concurrency": max_in_flight / latency}
+    if requests_per_minute:
+        rates["requests/min"] = requests_per_minute / 60
+    if tokens_per_minute and total_calls:
+        rates["tokens/min"] = tokens_per_minute / 60 / (estimate_df["budget_tokens"].sum() / total_calls)
+    bottleneck = min(rates, key=rates.get)
+    limit_rate = min(rate for name, rate in rates.items() if name != "concurrency") if len(rates) > 1 else None
+    return estimate_df, {
+        "calls": total_calls,
+        "latency": latency,
+        "requests_per_second": rates[bottleneck],
+        "bottleneck": bottleneck,
+        "seconds": total_calls / rates[bottleneck] + latency if total_calls else 0.0,
+        # Little's law: requests in flight needed to reach the rate limits at this latency
+        "max_in_flight_needed": math.ceil(limit_rate * latency) if limit_rate else None,
+    }
+
+def print_estimate(estimate_df, timing, prompt_price=PROMPT_PRICE_PER_MILLION, completion_price=COMPLETION_PRICE_PER_MILLION):
+    estimate_df = estimate_df.assign(cost_usd=[
+        cost(row.prompt_tokens, row.completion_tokens, prompt_price, completion_price) for row in estimate_df.itertuples()
+    ])
+    print(estimate_df.drop(columns="budget_tokens").to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    prompt_tokens, completion_tokens = int(estimate_df["prompt_tokens"].sum()), int(estimate_df["completion_tokens"].sum())
+    print(f"\nEstimate: {timing['calls']} calls, {prompt_tokens} prompt + {completion_tokens} completion tokens, "
+          f"{estimate_df['sent_mb'].sum():.1f} MB sent, ${cost(prompt_tokens, completion_tokens, prompt_price, completion_price):.2f} "
+          f"(tokenizer: {tokenizer_name()})")
+    print(f"Duration: ~{timing['seconds'] / 60:.1f} min at {timing['requests_per_second'] * 60:.1f} requests/min, "
+          f"limited by {timing['bottleneck']} (latency {timing['latency']:.2f}s per call)")
+    if timing["max_in_flight_needed"] is not None:
+        print(f"About {timing['max_in_flight_needed']} requests in flight reach the rate limits at this latency")
+
+def profile_dataset(jsonl_path):
+    """
+    Token and size profile of the records of a dataset JSONL file (all messages, e.g. for
+    fine-tuning): (records, text tokens, images, image tokens, longest record in tokens)
+    """
+    records = text_tokens = images = image_token_count = longest = 0
+    for _, record in iter_jsonl(jsonl_path):
+        record_tokens = REQUEST_OVERHEAD_TOKENS
+        for message in record.get("messages", []):
+            content = message.get("content")
+            for item in content if isinstance(content, list) else [{"type": "text", "text": content or ""}]:
+                if isinstance(item, dict) and item.get("type") == "text":
+                    record_tokens += count_text_tokens(item.get("text") or "")
+        text_tokens += record_tokens
+        for _, _, url in iter_image_urls(record):
+            images += 1
+            tokens = image_url_tokens(url)
+            image_token_count += tokens
+            record_tokens += tokens
+        longest = max(longest, record_tokens)
+        records += 1
+    return records, text_tokens, images, image_token_count, longest
+
+def main():
+    parser = argparse.ArgumentParser(description="Token, payload and cost accounting of prompt evaluation runs")
+    parser.add_argument("--results", nargs="*", default=[], help="Results files (.parquet) or journals (.jsonl) of earlier runs to report on")
+    parser.add_argument("--excel", default=None, help="With --jsonl: estimate the sweep of this workbook's prompts before running it")
+    parser.add_argument("--jsonl", default=None, help="Test cases of the sweep to estimate")
+    parser.add_argument("--profile", nargs="*", default=[], help="Dataset JSONL files to profile (tokens per record)")
+    parser.add_argument("--completion_tokens", type=float, default=None, help="Completion tokens per call (default from --results, else max_tokens)")
+    parser.add_argument("--latency", type=float, default=None, help="Seconds per call (default median of --results)")
+    parser.add_argument("--max_in_flight", type=int, default=None, help="Concurrent requests of the run")
+    parser.add_argument("--requests_per_minute", type=float, default=None, help="Request rate limit of the run")
+    parser.add_argument("--tokens_per_minute", type=float, default=None, help="Token rate limit of the run")
+    parser.add_argument("--no_cache", action="store_true", help="Count pairs whose response is cached too")
+    parser.add_argument("--prompt_price", type=float, default=PROMPT_PRICE_PER_MILLION, help="USD per million prompt tokens")
+    parser.add_argument("--completion_price", type=float, default=COMPLETION_PRICE_PER_MILLION, help="USD per million completion tokens")
+
+    args = parser.parse_args()
+    if not (args.results or args.profile or (args.excel and args.jsonl)):
+        parser.error("give --results, --profile or --excel with --jsonl")
+
+    history_df = load_usage(args.results) if args.results else None
+    if history_df is not None:
+        print_usage_report(history_df, args.prompt_price, args.completion_price)
+
+    if args.excel and args.jsonl:
+        # Imported here: test_prompts loads the API configuration at import time
+        import test_prompts
+
+        prompt_df, _ = test_prompts.read_excel_prompts(args.excel)
+        test_cases = test_prompts.read_jsonl_data(args.jsonl)
+        cache = None if args.no_cache else test_prompts.open_response_cache()
+        try:
+            estimate_df, timing = estimate_sweep(
+                test_prompts, prompt_df, test_cases, history_df,
+                completion_tokens=args.completion_tokens,
+                latency=args.latency,
+                max_in_flight=args.max_in_flight,
+                requests_per_minute=args.requests_per_minute or test_prompts.REQUESTS_PER_MINUTE,
+                tokens_per_minute=args.tokens_per_minute or test_prompts.TOKENS_PER_MINUTE,
+                cache=cache,
+            )
+        finally:
+            if cache is not None:
+                cache.close()
+        print(f"\nSweep of {len(prompt_df)} prompts x {len(test_cases)} test cases from {args.jsonl}:")
+        print_estimate(estimate_df, timing, args.prompt_price, args.completion_price)
+
+    for jsonl_path in args.profile:
+        records, text_tokens, images, image_token_count, longest = profile_dataset(jsonl_path)
+        print(f"\n{jsonl_path}: {records} records, {text_tokens} text tokens "
+              f"({text_tokens / records if records else 0:.0f} per record), {images} images "
+              f"({image_token_count} tokens), longest record {longest} tokens (tokenizer: {tokenizer_name()})")
+
+if __name__ == "__main__":
+    main()